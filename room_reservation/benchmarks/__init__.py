@@ -0,0 +1,8 @@
+"""Repeatable performance benchmarks for the reservation site.
+
+Run them with the run_benchmarks management command, which builds a throwaway
+SQLite database, fills it with seeded data and writes the results as JSON:
+
+    python manage.py run_benchmarks --rooms 200 --users 500 --reservations 50000 --output before.json
+    python manage.py run_benchmarks --compare before.json --output after.json
+"""
@@ -0,0 +1,97 @@
+import random
+from datetime import datetime, time, timedelta
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.utils import timezone
+from reservations.models import ConferenceRoom, Reservation
+from reservations.occupancy import refresh_occupancy
+
+# Reservations are placed on half hour slots between 7:00 and 19:00
+FIRST_SLOT = 14
+LAST_SLOT = 38
+BATCH_SIZE = 5000
+
+PASSWORD = 'benchmark'
+
+LOCATIONS = ['North Wing', 'South Wing', 'East Wing', 'West Wing', 'Annex']
+
+
+def slot_time(slot):
+    return time(slot // 2, 30 * (slot % 2))
+
+
+def save(reservations):
+    # bulk_create skips the signals that keep the occupancy summary up to date
+    Reservation.objects.bulk_create(reservations)
+    refresh_occupancy({(reservation.room_id, reservation.date) for reservation in reservations})
+
+
+def generate(rooms=50, users=200, reservations=10000, days=90, seed=1, due_reminders=None):
+    """Fill the database with seeded rooms, users and reservations.
+
+    Reservations are spread over `days` days centred on today and never overlap
+    in a room. `due_reminders` of them (one per thousand by default) start
+    within the next hour, for the reminder task to find. The same arguments
+    always produce the same data. Returns the number of each actually created,
+    as a room can run out of free slots when asked for a lot of reservations.
+    """
+    rng = random.Random(seed)
+    password = make_password(PASSWORD)  # hashed once, hashing per user would dominate
+
+    room_objects = ConferenceRoom.objects.bulk_create([
+        ConferenceRoom(name=f'Room {i:04}', location=LOCATIONS[i % len(LOCATIONS)], capacity=rng.randint(2, 40))
+        for i in range(rooms)
+    ])
+    user_objects = User.objects.bulk_create([
+        User(username=f'user{i:05}', email=f'user{i:05}@example.com', password=password, is_staff=i == 0)
+        for i in range(users)
+    ], batch_size=BATCH_SIZE)
+
+    now = timezone.localtime()
+    today = now.date()
+    first_day = today - timedelta(days=days // 2)
+    occupied = {}  # (room index, day offset) -> bitmask of booked slots
+    created = 0
+
+    def place(room_index, day, start_slot, length):
+        key = (room_index, (day - first_day).days)
+        mask = ((1 << length) - 1) << start_slot
+        if occupied.get(key, 0) & mask:
+            return None
+        occupied[key] = occupied.get(key, 0) | mask
+        start = slot_time(start_slot)
+        return Reservation(
+            user=user_objects[rng.randrange(users)],
+            room=room_objects[room_index],
+            date=day,
+            start_time=start,
+            end_time=slot_time(start_slot + length),
+            start_at=timezone.make_aware(datetime.combine(day, start)),
+        )
+
+    batch = []
+    if due_reminders is None:
+        due_reminders = max(1, reservations // 1000)
+    # Starting at the next half hour, none this late in the evening
+    due_slot = (now.hour * 60 + now.minute) // 30 + 1
+    for i in range(min(due_reminders, rooms) if due_slot < 47 else 0):
+        reservation = place(i, today, due_slot, 1)
+        if reservation:
+            batch.append(reservation)
+
+    attempts = 0
+    while len(batch) + created < reservations and attempts < reservations * 3:
+        attempts += 1
+        length = rng.randint(1, 4)
+        reservation = place(rng.randrange(rooms), first_day + timedelta(days=rng.randrange(days)),
+                            rng.randint(FIRST_SLOT, LAST_SLOT - length), length)
+        if reservation:
+            batch.append(reservation)
+        if len(batch) >= BATCH_SIZE:
+            save(batch)
+            created += len(batch)
+            batch = []
+    save(batch)
+    created += len(batch)
+
+    return {'rooms': len(room_objects), 'users': len(user_objects), 'reservations': created}
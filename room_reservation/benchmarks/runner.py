@@ -0,0 +1,107 @@
+import json
+import platform
+import statistics
+import subprocess
+import tracemalloc
+from time import perf_counter
+import django
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+
+def measure(scenario, repeat):
+    """Run a scenario `repeat` times and return its figures.
+
+    Wall time comes from untraced runs, since tracemalloc slows Python down.
+    Queries and peak memory come from one more run with tracing on.
+    """
+    times = []
+    extra = {}
+    for _ in range(repeat):
+        scenario.setup()
+        began = perf_counter()
+        extra = scenario.run() or {}
+        times.append(perf_counter() - began)
+
+    scenario.setup()
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            traced = scenario.run() or {}
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    result = {
+        'wall_seconds': statistics.median(times),
+        'wall_seconds_min': min(times),
+        'runs': repeat,
+        'queries': traced.pop('queries', len(queries)),
+        'peak_memory_bytes': peak,
+    }
+    extra.pop('queries', None)
+    result.update(extra)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(scenarios, repeat, data, log=print):
+    # Run every scenario and return the results document written as JSON
+    results = {}
+    for scenario_class in scenarios:
+        scenario = scenario_class()
+        scenario.prepare()
+        results[scenario.name] = measure(scenario, repeat)
+        over_budget = scenario.check(results[scenario.name])
+        if over_budget:
+            results[scenario.name]['over_budget'] = over_budget
+        log(format_result(scenario.name, results[scenario.name]))
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'data': data,
+        },
+        'results': results,
+    }
+
+
+def format_result(name, result):
+    return (f"{name:32} {result['wall_seconds'] * 1000:9.1f} ms {result['queries']:6} queries "
+            f"{result['peak_memory_bytes'] / 1024:9.0f} KiB")
+
+
+def over_budget(results):
+    """Every over budget message in a results document, prefixed with its scenario."""
+    return [f"{name}: {message}" for name, result in results['results'].items()
+            for message in result.get('over_budget', [])]
+
+
+def compare(previous, current):
+    """Lines comparing two results documents, scenario by scenario."""
+    lines = [f"{'scenario':32} {'before ms':>10} {'after ms':>10} {'change':>8} {'queries':>15}"]
+    for name, after in current['results'].items():
+        before = previous['results'].get(name)
+        if before is None:
+            continue
+        change = (after['wall_seconds'] - before['wall_seconds']) / before['wall_seconds'] * 100
+        lines.append(f"{name:32} {before['wall_seconds'] * 1000:10.1f} {after['wall_seconds'] * 1000:10.1f} "
+                     f"{change:+7.0f}% {before['queries']:>7} -> {after['queries']:<5}")
+    return lines
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,377 @@
+import gzip
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from time import perf_counter
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core import mail
+from django.db import connection, connections
+from django.db.models import Count
+from django.http import HttpResponse
+from django.shortcuts import render
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+from reservations.availability import get_cache
+from reservations.feeds import get_feed
+from reservations.forms import ReservationFilterForm
+from reservations.fragments import get_row_cache, render_rows
+from reservations.listing import reservation_page
+from reservations.metrics import MetricsMiddleware
+from reservations.models import ConferenceRoom, Reservation
+from reservations.tasks import send_reminder_emails
+
+
+class Scenario:
+    """One timed operation. setup() runs before every measured run, untimed.
+
+    run() may return a dict of extra figures for the results, such as how many
+    bookings succeeded.
+    """
+
+    name = None
+
+    def prepare(self):
+        # Once, before the first run
+        pass
+
+    def setup(self):
+        pass
+
+    def run(self):
+        raise NotImplementedError
+
+    def check(self, result):
+        # What in the result is over budget, as messages. See run_benchmarks --check
+        return []
+
+
+def logged_in_client(user):
+    client = Client()
+    client.force_login(user)
+    return client
+
+
+def get(client, url, **params):
+    response = client.get(url, params)
+    if response.status_code != 200:
+        raise RuntimeError(f"GET {url} returned {response.status_code}")
+    return response
+
+
+class RoomList(Scenario):
+    name = 'room_list'
+    cold = False
+
+    def prepare(self):
+        self.client = logged_in_client(User.objects.filter(is_staff=False).first())
+        get(self.client, reverse('reservations:room_list'))
+
+    def setup(self):
+        if self.cold:
+            get_cache().clear()
+
+    def run(self):
+        get(self.client, reverse('reservations:room_list'))
+
+
+class RoomListCold(RoomList):
+    # The first request of the day, before availability is cached
+    name = 'room_list_cold'
+    cold = True
+
+
+class MyReservations(Scenario):
+    # The user with the most reservations
+    name = 'my_reservations'
+
+    def prepare(self):
+        user_id = (Reservation.objects.values('user').annotate(n=Count('id')).order_by('-n')
+                   .values_list('user', flat=True).first())
+        self.client = logged_in_client(User.objects.get(id=user_id))
+
+    def run(self):
+        get(self.client, reverse('reservations:my_reservations'))
+
+
+class AllReservations(Scenario):
+    name = 'view_all_reservations'
+    filtered = False
+
+    def prepare(self):
+        self.client = logged_in_client(User.objects.filter(is_staff=True).first())
+        self.params = {'username': 'user00001'} if self.filtered else {}
+
+    def run(self):
+        get(self.client, reverse('reservations:admin_reservations'), **self.params)
+
+
+class AllReservationsFiltered(AllReservations):
+    name = 'view_all_reservations_by_user'
+    filtered = True
+
+
+class UserList(Scenario):
+    name = 'user_list'
+
+    def prepare(self):
+        self.client = logged_in_client(User.objects.filter(is_staff=True).first())
+
+    def run(self):
+        get(self.client, reverse('reservations:user_list'))
+
+
+class MakeReservationContention(Scenario):
+    """Many users booking the same few rooms and times at once.
+
+    Every thread posts to make_reservation for one of CONTENDED_ROOMS rooms at
+    one of two overlapping times, on a day with nothing else booked.
+    """
+
+    name = 'make_reservation_contention'
+    THREADS = 8
+    ATTEMPTS = 64
+    CONTENDED_ROOMS = 4
+
+    def prepare(self):
+        self.day = timezone.localdate() + timedelta(days=400)
+        self.rooms = list(ConferenceRoom.objects.order_by('id')[:self.CONTENDED_ROOMS])
+        self.clients = [logged_in_client(user) for user in User.objects.order_by('id')[:self.THREADS]]
+
+    def setup(self):
+        Reservation.objects.filter(date=self.day).delete()
+
+    def attempt(self, i):
+        client = self.clients[i % self.THREADS]
+        start = '09:00' if i % 2 else '09:30'
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                response = client.post(reverse('reservations:make_reservation'), {
+                    'room': self.rooms[i % len(self.rooms)].id,
+                    'date': self.day.isoformat(),
+                    'start_time': start,
+                    'end_time': '10:30',
+                })
+            return response.status_code == 302, len(queries)
+        finally:
+            connections.close_all()
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            results = list(pool.map(self.attempt, range(self.ATTEMPTS)))
+        mail.outbox = []
+        return {
+            'booked': sum(booked for booked, _ in results),
+            'conflicts': sum(not booked for booked, _ in results),
+            'queries': sum(queries for _, queries in results),
+        }
+
+
+class ViewQueries(Scenario):
+    """Queries each page in reservations/urls.py costs a signed-in staff member.
+
+    Counted twice: with database sessions and the user read from auth_user on
+    every request, as before, and with the current session engine and backend.
+    Each page is requested once untimed first, so caches are warm.
+    """
+
+    name = 'view_queries'
+    # Never finishes
+    SKIP = {'api_availability_stream'}
+    BEFORE = {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+        'AUTHENTICATION_BACKENDS': ['django.contrib.auth.backends.ModelBackend'],
+    }
+
+    def prepare(self):
+        self.user = User.objects.filter(is_staff=True).first()
+        reservation = Reservation.objects.filter(user=self.user).first() or Reservation.objects.first()
+        day = timezone.localdate().isoformat()
+        kwargs = {'reservation_id': reservation.id, 'room_id': reservation.room_id, 'user_id': self.user.id,
+                  'token': get_feed(self.user).token}
+        params = {
+            'api_availability': {'date': day},
+            'api_free_slots': {'start': day, 'end': day, 'duration': 60},
+            'api_user_lookup': {'q': 'user'},
+            'api_room_lookup': {'q': 'room'},
+        }
+        self.pages = [
+            (pattern.name, reverse(f'reservations:{pattern.name}',
+                                   kwargs={name: kwargs[name] for name in pattern.pattern.converters}),
+             params.get(pattern.name, {}))
+            for pattern in get_resolver('reservations.urls').url_patterns if pattern.name not in self.SKIP
+        ]
+
+    def count(self, settings):
+        with override_settings(**settings):
+            # A new client builds its middleware, and so its session store, under these settings
+            client = logged_in_client(self.user)
+            counts = {}
+            for name, url, params in self.pages:
+                fetch(client, url, params)
+                with CaptureQueriesContext(connection) as queries:
+                    fetch(client, url, params)
+                counts[name] = len(queries)
+        return counts
+
+    def run(self):
+        before = self.count(self.BEFORE)
+        after = self.count({})
+        return {
+            'views': {name: {'before': before[name], 'after': after[name]} for name in after},
+            'queries_removed': sum(before.values()) - sum(after.values()),
+            'queries': sum(after.values()),
+        }
+
+
+def fetch(client, url, params):
+    # Streamed pages run their queries as the body is read
+    response = client.get(url, params)
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return response
+
+
+def stylesheet_path(name):
+    # Hashed names only exist in STATIC_ROOT, the source names in the apps
+    if staticfiles_storage.exists(name):
+        return staticfiles_storage.path(name)
+    return finders.find(name)
+
+
+class PageBytes(Scenario):
+    """Bytes a staff member downloads for the main pages, as sent and gzipped.
+
+    A first visit downloads every page and each distinct stylesheet once. On a
+    repeat visit the stylesheets, which have hashed names, come from the
+    browser cache, so only the pages are downloaded again. Styles inlined in a
+    page count against the page.
+    """
+
+    name = 'page_bytes'
+    PAGES = ['room_list', 'room_calendar', 'make_reservation', 'my_reservations', 'admin_panel',
+             'admin_reservations', 'user_list']
+    STYLESHEET = re.compile(r'<link rel="stylesheet" href="([^"]+)"')
+
+    def prepare(self):
+        self.client = logged_in_client(User.objects.filter(is_staff=True).first())
+
+    def run(self):
+        pages = {}
+        stylesheets = {}
+        for name in self.PAGES:
+            html = get(self.client, reverse(f'reservations:{name}')).content
+            pages[name] = {'html_bytes': len(html), 'html_gzip_bytes': len(gzip.compress(html))}
+            for href in self.STYLESHEET.findall(html.decode()):
+                path = stylesheet_path(href.removeprefix(settings.STATIC_URL))
+                if path and href not in stylesheets:
+                    with open(path, 'rb') as f:
+                        stylesheets[href] = f.read()
+        html_gzip = sum(page['html_gzip_bytes'] for page in pages.values())
+        css_gzip = sum(len(gzip.compress(css)) for css in stylesheets.values())
+        return {
+            'pages': pages,
+            'stylesheet_bytes': sum(len(css) for css in stylesheets.values()),
+            'stylesheet_gzip_bytes': css_gzip,
+            'first_visit_bytes': html_gzip + css_gzip,
+            'repeat_visit_bytes': html_gzip,
+        }
+
+
+class RenderReservationTable(Scenario):
+    """Render time of the staff reservations table with ROWS rows, rows cached.
+
+    Times the rows and the page around them, not the query that loads them.
+    """
+
+    name = 'render_reservation_table'
+    ROWS = 2000
+    cold = False
+
+    def prepare(self):
+        self.request = RequestFactory().get(reverse('reservations:admin_reservations'))
+        self.request.user = User.objects.filter(is_staff=True).first()
+        self.reservations = reservation_page(page_size=self.ROWS)[0]
+        self.run()
+
+    def setup(self):
+        if self.cold:
+            get_row_cache().clear()
+
+    def run(self):
+        response = render(self.request, 'reservations/admin_reservations.html', {
+            'form': ReservationFilterForm(),
+            'reservations': self.reservations,
+            'rows': render_rows('reservations/rows/admin_reservation.html', self.reservations,
+                                vary_on=['user.username', 'room.name']),
+        })
+        return {'rows': len(self.reservations), 'html_bytes': len(response.content)}
+
+
+class RenderReservationTableCold(RenderReservationTable):
+    # Every row rendered, as after the cache is cleared
+    name = 'render_reservation_table_cold'
+    cold = True
+
+
+class MetricsOverhead(Scenario):
+    """Time MetricsMiddleware adds to a request, against a real page.
+
+    The middleware is timed around a view that does nothing, so what is left
+    over is its own cost. It should stay under 1% of a room list request.
+    """
+
+    name = 'metrics_overhead'
+    RUNS = 2000
+    PAGES = 20
+    BUDGET_PERCENT = 1
+
+    def prepare(self):
+        self.client = logged_in_client(User.objects.filter(is_staff=False).first())
+        self.request = RequestFactory().get('/')
+        self.request.resolver_match = None
+        self.view = lambda request: HttpResponse()
+        self.middleware = MetricsMiddleware(self.view)
+
+    def run(self):
+        began = perf_counter()
+        for _ in range(self.RUNS):
+            self.view(self.request)
+        bare = perf_counter() - began
+        began = perf_counter()
+        for _ in range(self.RUNS):
+            self.middleware(self.request)
+        overhead = (perf_counter() - began - bare) / self.RUNS
+
+        began = perf_counter()
+        for _ in range(self.PAGES):
+            get(self.client, reverse('reservations:room_list'))
+        page = (perf_counter() - began) / self.PAGES
+        return {'overhead_seconds': overhead, 'page_seconds': page, 'overhead_percent': overhead / page * 100}
+
+    def check(self, result):
+        if result['overhead_percent'] >= self.BUDGET_PERCENT:
+            return [f"metrics middleware adds {result['overhead_percent']:.2f}% to a page, "
+                    f"over the {self.BUDGET_PERCENT}% budget"]
+        return []
+
+
+class ReminderEmails(Scenario):
+    name = 'send_reminder_emails'
+
+    def setup(self):
+        now = timezone.now()
+        Reservation.objects.filter(start_at__gte=now, start_at__lte=now + timedelta(hours=1)).update(reminder_sent=False)
+        mail.outbox = []
+
+    def run(self):
+        return {'sent': send_reminder_emails()}
+
+
+SCENARIOS = [RoomList, RoomListCold, MakeReservationContention, MyReservations, AllReservations,
+             AllReservationsFiltered, UserList, ViewQueries, PageBytes,
+             RenderReservationTable, RenderReservationTableCold, MetricsOverhead, ReminderEmails]
@@ -0,0 +1,126 @@
+from datetime import datetime, time, timedelta
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
+from .auth import forget_users
+from .feeds import forget_feeds
+from .forms import UserFilterForm
+from .models import Reservation, UserJob
+from .outbox import enqueue_after_commit
+from .search import prefix_range
+from .signals import delete_reservations
+
+User = get_user_model()
+
+USER_PAGE_SIZE = 50
+
+# Users handled per transaction by a bulk job
+USER_JOB_CHUNK_SIZE = 100
+
+
+def directory_users(q=None, staff=None, active=None, joined_from=None, joined_to=None):
+    # The filters of UserFilterForm, shared by the directory and the bulk jobs
+    users = User.objects.all()
+    if q:
+        users = users.alias(username_lower=Lower('username'), email_lower=Lower('email')).filter(
+            prefix_range('username_lower', q) | prefix_range('email_lower', q))
+    if staff is not None:
+        users = users.filter(is_staff=staff)
+    if active is not None:
+        users = users.filter(is_active=active)
+    # Ranges on the column itself, so user_date_joined_idx can be used
+    if joined_from:
+        users = users.filter(date_joined__gte=timezone.make_aware(datetime.combine(joined_from, time.min)))
+    if joined_to:
+        users = users.filter(date_joined__lt=timezone.make_aware(datetime.combine(joined_to + timedelta(days=1), time.min)))
+    return users
+
+
+def user_page(after=None, page_size=USER_PAGE_SIZE, **filters):
+    """Return one page of users in username order, and the cursor for the next page.
+
+    Like reservation_page, pages seek past the last username of the previous
+    page instead of using OFFSET.
+    """
+    users = directory_users(**filters).only('id', 'username', 'email', 'is_staff', 'is_active', 'date_joined')
+    if after:
+        users = users.filter(username__gt=after)
+    rows = list(users.order_by('username')[:page_size + 1])
+    next_cursor = rows[page_size - 1].username if len(rows) > page_size else None
+    return rows[:page_size], next_cursor
+
+
+def job_users(job):
+    # The users a job acts on, never the staff member who started it
+    if job.user_ids is not None:
+        users = User.objects.filter(id__in=job.user_ids)
+    else:
+        form = UserFilterForm(job.filters)
+        users = directory_users(**form.cleaned_data) if form.is_valid() else User.objects.none()
+    if job.requested_by_id:
+        users = users.exclude(id=job.requested_by_id)
+    return users
+
+
+def start_user_job(action, requested_by, user_ids=None, filters=None):
+    # Record the job and have the worker run it once the record is committed
+    job = UserJob(action=action, requested_by=requested_by, user_ids=user_ids, filters=filters or {})
+    job.total = job_users(job).count()
+    job.save()
+    enqueue_after_commit('run_user_job', job.id)
+    return job
+
+
+def deactivate_users(user_ids):
+    # Deactivated users are signed out on their next request. update() sends no
+    # post_save, so their cached copies are dropped here
+    User.objects.filter(id__in=user_ids).update(is_active=False)
+    forget_users(*user_ids)
+    transaction.on_commit(lambda: forget_users(*user_ids))
+
+
+def delete_users(user_ids):
+    """Delete users along with their reservations and calendar feeds.
+
+    Reservations go first, in batches, see delete_reservations. Their holders
+    are emailed about the upcoming bookings they lose once the delete commits.
+    """
+    bookings = [
+        [email, username, room_name, day.strftime('%d-%m-%Y'), start.strftime('%I:%M %p'), end.strftime('%I:%M %p')]
+        for email, username, room_name, day, start, end in
+        Reservation.objects.filter(user_id__in=user_ids, date__gte=timezone.localdate()).exclude(user__email='')
+        .order_by('user_id', 'date', 'start_time')
+        .values_list('user__email', 'user__username', 'room__name', 'date', 'start_time', 'end_time')
+    ]
+    # The owners' change feeds are deleted with them, so no changes are logged
+    delete_reservations(Reservation.objects.filter(user_id__in=user_ids), record=False)
+
+    with transaction.atomic():
+        forget_feeds(user_ids)
+        User.objects.filter(id__in=user_ids).delete()
+        # Signed out on their next request, whether or not the delete sends post_delete
+        forget_users(*user_ids)
+        transaction.on_commit(lambda: forget_users(*user_ids))
+        if bookings:
+            enqueue_after_commit('notify_user_deleted', bookings)
+
+
+def run_user_job(job):
+    """Work through a job's users a chunk at a time, saving progress after each chunk."""
+    act = delete_users if job.action == UserJob.DELETE else deactivate_users
+    users = job_users(job)
+    job.status = UserJob.RUNNING
+    job.save(update_fields=['status'])
+    while True:
+        user_ids = list(users.filter(id__gt=job.last_user_id).order_by('id')
+                        .values_list('id', flat=True)[:USER_JOB_CHUNK_SIZE])
+        if not user_ids:
+            break
+        act(user_ids)
+        job.done += len(user_ids)
+        job.last_user_id = user_ids[-1]
+        job.save(update_fields=['done', 'last_user_id'])
+    job.status = UserJob.DONE
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'finished_at'])
@@ -1,7 +1,11 @@
 from django.contrib import admin
-from .models import ConferenceRoom, Reservation
+from .models import ConferenceRoom, Reservation, ReservationSeries, OutboxEmail, RoomDayOccupancy, UserJob
 
 admin.site.register(ConferenceRoom)
 admin.site.register(Reservation)
+admin.site.register(ReservationSeries)
+admin.site.register(OutboxEmail)
+admin.site.register(RoomDayOccupancy)
+admin.site.register(UserJob)
 
 # Register your models here.
@@ -0,0 +1,289 @@
+import asyncio
+import hashlib
+import hmac
+import json
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.views.decorators.http import condition, require_GET
+from .availability import availability_for_date, versions
+from .events import get_broker
+from .feeds import (feed_user_id, feed_version, feed_rows, snapshot, changes_since,
+                    decode_sync_token, sync_token_expired)
+from .metrics import registry
+from .transfer import reservations_ics
+from .models import ConferenceRoom
+from .search import (find_free_slots, lookup_users, lookup_rooms, user_label, SEARCH_DAY_START, SEARCH_DAY_END,
+                     LOOKUP_LIMIT)
+
+# Longest date range one availability request can ask for
+API_MAX_DAYS = 31
+
+# Longest date range and meeting length a free slot search can ask for
+SEARCH_MAX_DAYS = 90
+SEARCH_MAX_MINUTES = 24 * 60
+
+# Seconds between keepalive comments on an idle event stream
+STREAM_HEARTBEAT = 15
+
+# Seconds between reconnects when the stream can't be held open, under WSGI
+STREAM_POLL_INTERVAL = 30
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (ValueError, TypeError):
+        return None
+
+
+def parse_time(value, default):
+    if not value:
+        return default
+    try:
+        return datetime.strptime(value, '%H:%M').time()
+    except (ValueError, TypeError):
+        return None
+
+
+def parse_int(value, default):
+    if not value:
+        return default
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def requested_dates(request):
+    # The dates asked for with ?date= or ?start=&end=, or None if they are invalid
+    if 'date' in request.GET:
+        day = parse_date(request.GET['date'])
+        return [day] if day else None
+
+    start = parse_date(request.GET.get('start'))
+    end = parse_date(request.GET.get('end'))
+    if not start or not end or end < start or (end - start).days >= API_MAX_DAYS:
+        return None
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def availability_etag(request):
+    # Built only from the cached version counters, so an unchanged poll gets a 304
+    # without touching the database
+    dates = requested_dates(request)
+    if not dates:
+        return None
+    generation, date_versions = versions(dates)
+    key = f"{generation}:" + ",".join(f"{d.isoformat()}={date_versions[d]}" for d in dates)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def interval_json(intervals):
+    return [{'start': start.strftime('%H:%M'), 'end': end.strftime('%H:%M')} for start, end in intervals]
+
+
+@login_required
+@require_GET
+@condition(etag_func=availability_etag)
+def availability(request):
+    dates = requested_dates(request)
+    if not dates:
+        return JsonResponse({
+            'error': f'Give a date (YYYY-MM-DD) or a start and end date at most {API_MAX_DAYS} days apart.'
+        }, status=400)
+
+    rooms = list(ConferenceRoom.objects.order_by('name'))
+    days = []
+    for day in dates:
+        days.append({
+            'date': day.isoformat(),
+            'rooms': [{
+                'id': room_availability.room.id,
+                'name': room_availability.room.name,
+                'location': room_availability.room.location,
+                'capacity': room_availability.room.capacity,
+                'booked': interval_json(room_availability.booked),
+                'free': interval_json(room_availability.free),
+            } for room_availability in availability_for_date(day, rooms=rooms)],
+        })
+    return JsonResponse({'dates': days})
+
+
+@login_required
+@require_GET
+def free_slots(request):
+    """Ranked free slots for ?start=&end=&duration= (minutes), with optional
+    &capacity=, &location= and the daily window &from=&to= (HH:MM)."""
+    start = parse_date(request.GET.get('start'))
+    end = parse_date(request.GET.get('end'))
+    duration = parse_int(request.GET.get('duration'), None)
+    capacity = parse_int(request.GET.get('capacity'), 1)
+    day_start = parse_time(request.GET.get('from'), SEARCH_DAY_START)
+    day_end = parse_time(request.GET.get('to'), SEARCH_DAY_END)
+
+    if (not start or not end or end < start or (end - start).days >= SEARCH_MAX_DAYS
+            or not duration or not 0 < duration <= SEARCH_MAX_MINUTES or capacity is None
+            or not day_start or not day_end or day_end <= day_start):
+        return JsonResponse({
+            'error': f'Give a start and end date at most {SEARCH_MAX_DAYS} days apart, a duration in minutes, '
+                     'and optionally a capacity, location and from/to times (HH:MM).'
+        }, status=400)
+
+    slots = find_free_slots(start, end, timedelta(minutes=duration), min_capacity=capacity,
+                            location=request.GET.get('location') or None, day_start=day_start, day_end=day_end)
+    return JsonResponse({'slots': [{
+        'room': {'id': slot.room.id, 'name': slot.room.name, 'location': slot.room.location,
+                 'capacity': slot.room.capacity},
+        'date': slot.date.isoformat(),
+        'start': slot.start.strftime('%H:%M'),
+        'end': slot.end.strftime('%H:%M'),
+    } for slot in slots]})
+
+
+async def stream_events(day):
+    # Subscribe on the server's event loop and turn each change into an SSE message
+    broker = get_broker()
+    subscription = broker.subscribe(day, asyncio.get_running_loop())
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), STREAM_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: availability\ndata: {json.dumps(event)}\n\n"
+    finally:
+        broker.unsubscribe(subscription)
+
+
+@login_required
+@require_GET
+async def availability_stream(request):
+    """Server-sent events with availability changes for ?date=.
+
+    Live only when served through room_reservation/asgi.py. Under WSGI, as on
+    Vercel, holding the stream open would tie up a worker per client, so the
+    client is answered at once and polls instead, see poll_events.
+    """
+    day = parse_date(request.GET.get('date'))
+    if not day:
+        return JsonResponse({'error': 'Give a date (YYYY-MM-DD).'}, status=400)
+    if not isinstance(request, ASGIRequest):
+        return poll_events(request, day)
+
+    response = StreamingHttpResponse(stream_events(day.isoformat()), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def poll_events(request, day):
+    # A stream that ends straight away. EventSource reconnects after the retry
+    # delay, sending back the id, and each reconnect tells the page to reload
+    # the date. The first connection has nothing new to say
+    body = f"retry: {STREAM_POLL_INTERVAL * 1000}\nid: poll\n\n"
+    if 'Last-Event-ID' in request.headers:
+        event = {'action': 'resync', 'date': day.isoformat()}
+        body += f"event: availability\nid: poll\ndata: {json.dumps(event)}\n\n"
+    response = HttpResponse(body, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def calendar_etag(request, token):
+    # Built from the cached per-user version, so an unchanged calendar gets a 304
+    # without reading any reservations
+    user_id = feed_user_id(token)
+    if user_id is None:
+        return None
+    generation, version = feed_version(user_id)
+    key = f"{request.path}:{generation}:{version}:{timezone.localdate().isoformat()}"
+    if 'since' in request.GET:
+        since = decode_sync_token(request.GET['since'])
+        key += f":{since[0] if since else request.GET['since']}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+@require_GET
+@condition(etag_func=calendar_etag)
+def calendar_feed(request, token):
+    """A user's reservations as an iCalendar feed to subscribe to.
+
+    The secret token in the URL stands in for logging in, since calendar apps
+    can't, so it is the only way the user is identified.
+    """
+    user_id = feed_user_id(token)
+    if user_id is None:
+        raise Http404()
+    response = HttpResponse(''.join(reservations_ics(feed_rows(user_id), 'My room reservations')),
+                            content_type='text/calendar; charset=utf-8')
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@require_GET
+@condition(etag_func=calendar_etag)
+def calendar_changes(request, token):
+    """The same reservations as calendar_feed as JSON, or only those changed since ?since=.
+
+    Without ?since= every reservation is returned. Each response has a sync_token
+    to send as ?since= next time. When more is true, ask again straight away for
+    the rest. An expired token gets a 410 and the client should start over.
+    """
+    user_id = feed_user_id(token)
+    if user_id is None:
+        raise Http404()
+    if 'since' in request.GET:
+        since = decode_sync_token(request.GET['since'])
+        if since is None:
+            return JsonResponse({'error': 'Invalid sync token.'}, status=400)
+        if sync_token_expired(since[1]):
+            return JsonResponse({'error': 'The sync token has expired, fetch everything again without since.'},
+                                status=410)
+        changes, sync_token, more = changes_since(user_id, since[0])
+    else:
+        changes, sync_token, more = snapshot(user_id)
+    response = JsonResponse({'changes': changes, 'sync_token': sync_token, 'more': more})
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def lookup_response(request, search, label):
+    # {"results": [{"id": ..., "label": ...}]} for staff, matching ?q= as a prefix
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Only staff can look up users and rooms.'}, status=403)
+    limit = parse_int(request.GET.get('limit'), LOOKUP_LIMIT)
+    if limit is None or limit < 1:
+        return JsonResponse({'error': 'limit must be a positive number.'}, status=400)
+    term = request.GET.get('q', '').strip()
+    rows = search(term, min(limit, LOOKUP_LIMIT)) if term else []
+    return JsonResponse({'results': [{'id': row.id, 'label': label(row)} for row in rows]})
+
+
+@login_required
+@require_GET
+def user_lookup(request):
+    # Users whose username or email starts with ?q=, for the staff booking form
+    return lookup_response(request, lookup_users, user_label)
+
+
+@login_required
+@require_GET
+def room_lookup(request):
+    # Rooms whose name or location starts with ?q=
+    return lookup_response(request, lookup_rooms, str)
+
+
+@require_GET
+def metrics(request):
+    # Prometheus scrape endpoint, for staff or a scraper sending METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    token_ok = bool(settings.METRICS_TOKEN) and hmac.compare_digest(authorization, f"Bearer {settings.METRICS_TOKEN}")
+    if not token_ok and not (request.user.is_authenticated and request.user.is_staff):
+        return HttpResponse('Forbidden\n', status=403, content_type='text/plain')
+    return HttpResponse(registry.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ReservationsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'reservations'
+
+
+    def ready(self):
+        # Connect the cache invalidation signals, and the query timer before any connection opens
+        from . import metrics, signals  # noqa: F401
@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.db import router
+
+
+def get_user_cache():
+    return caches[settings.USER_CACHE]
+
+
+def user_key(user_id):
+    return f"auth:user-fields:{user_id}"
+
+
+def forget_users(*user_ids):
+    get_user_cache().delete_many([user_key(user_id) for user_id in user_ids])
+
+
+def cached_fields(user_model):
+    # Every column but the password hash, which stays in the database
+    return [field.attname for field in user_model._meta.concrete_fields if field.attname != 'password']
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend that keeps signed-in users in the cache for USER_CACHE_TIMEOUT seconds.
+
+    AuthenticationMiddleware asks the backend for the user on every request, so
+    this saves a query on every signed-in page. Saving or deleting a user drops
+    the cached copy, see signals.py. Changes made with QuerySet.update() must
+    call forget_users themselves.
+
+    The password hash is never cached. The user comes back with the password
+    deferred, so reading or saving it goes to the database, and the session
+    check uses the cached session hash instead.
+    """
+
+    def get_user(self, user_id):
+        cache = get_user_cache()
+        user_model = get_user_model()
+        cached = cache.get(user_key(user_id))
+        if cached is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                values = {name: getattr(user, name) for name in cached_fields(user_model)}
+                cache.set(user_key(user_id), (values, user.get_session_auth_hash()), settings.USER_CACHE_TIMEOUT)
+            return user
+
+        values, session_hash = cached
+        user = user_model.from_db(router.db_for_read(user_model), list(values), list(values.values()))
+        user.get_session_auth_hash = lambda: session_hash
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,165 @@
+from datetime import time
+from time import time_ns
+from django.conf import settings
+from django.core.cache import caches
+from .models import ConferenceRoom, Reservation
+
+# The bookable day, used to work out the free gaps between reservations
+DAY_START = time(0, 0)
+DAY_END = time(23, 59)
+
+
+def format_time(value):
+    # Same format the views use in emails and on the room list, e.g. "9:30 AM"
+    return value.strftime('%I:%M %p').lstrip('0')
+
+
+def free_gaps(booked, window_start=DAY_START, window_end=DAY_END):
+    # Walk the sorted booked intervals and collect the space between them inside the window
+    gaps = []
+    cursor = window_start
+    for start, end in booked:
+        if start > cursor:
+            gaps.append((cursor, min(start, window_end)))
+        if end > cursor:
+            cursor = end
+        if cursor >= window_end:
+            break
+    if cursor < window_end:
+        gaps.append((cursor, window_end))
+    return [(start, end) for start, end in gaps if start < end]
+
+
+class RoomAvailability:
+    """Booked intervals and free gaps for one room on one date."""
+
+    def __init__(self, room, booked):
+        self.room = room
+        self.booked = booked  # list of (start_time, end_time), sorted by start
+
+    @property
+    def is_available(self):
+        return not self.booked
+
+    @property
+    def free(self):
+        return free_gaps(self.booked)
+
+    @property
+    def booking_times(self):
+        # Display friendly version of the booked intervals for templates
+        return [{'start': format_time(start), 'end': format_time(end)} for start, end in self.booked]
+
+
+class CacheStats:
+    # Hit and miss counters for the availability cache in this process
+    hits = 0
+    misses = 0
+
+    @classmethod
+    def as_dict(cls):
+        return {'hits': cls.hits, 'misses': cls.misses}
+
+
+def get_cache():
+    return caches[settings.AVAILABILITY_CACHE]
+
+
+def new_version():
+    # Counters start from the clock, so a counter that was evicted from the cache
+    # never comes back with a number a client has already seen
+    return time_ns() // 1000
+
+
+def bump(key):
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, new_version(), None)
+
+
+def versions(dates):
+    """Return (generation, {date: version}) for the given dates.
+
+    The generation changes whenever a room changes and each date's version changes
+    whenever a reservation on that date does, so together they identify the
+    availability data exactly.
+    """
+    cache = get_cache()
+    keys = ['availability:generation'] + [f"availability:version:{d.isoformat()}" for d in dates]
+    found = cache.get_many(keys)
+    missing = {key: new_version() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return found[keys[0]], {d: found[key] for d, key in zip(dates, keys[1:])}
+
+
+def cache_key(selected_date):
+    generation, date_versions = versions([selected_date])
+    return f"availability:{generation}:{selected_date.isoformat()}:{date_versions[selected_date]}"
+
+
+def invalidate_date(selected_date):
+    bump(f"availability:version:{selected_date.isoformat()}")
+
+
+def invalidate_all():
+    # Bumping the generation orphans every cached date at once
+    bump('availability:generation')
+
+
+def booked_intervals(selected_date):
+    """Return {room_id: [(start_time, end_time), ...]} for every room booked on the date.
+
+    Results are cached per date and invalidated by the signals in signals.py whenever
+    a reservation or room changes.
+    """
+    cache = get_cache()
+    key = cache_key(selected_date)
+    intervals = cache.get(key)
+    if intervals is not None:
+        CacheStats.hits += 1
+        return intervals
+    CacheStats.misses += 1
+
+    # Get every reservation for the date in one ordered query and group by room
+    rows = Reservation.objects.filter(date=selected_date).order_by(
+        'room_id', 'start_time').values_list('room_id', 'start_time', 'end_time')
+    intervals = {}
+    for room_id, start, end in rows:
+        intervals.setdefault(room_id, []).append((start, end))
+
+    cache.set(key, intervals, settings.AVAILABILITY_CACHE_TIMEOUT)
+    return intervals
+
+
+def availability_for_date(selected_date, rooms=None):
+    """Return a RoomAvailability for every room on the given date.
+
+    Costs one query for the rooms and at most one for the reservations, no matter
+    how many rooms there are.
+    """
+    if rooms is None:
+        rooms = ConferenceRoom.objects.all()
+    intervals = booked_intervals(selected_date)
+    return [RoomAvailability(room, intervals.get(room.id, [])) for room in rooms]
+
+
+def room_availability(room, selected_date):
+    # Availability for a single room, e.g. for the booking form
+    return availability_for_date(selected_date, rooms=[room])[0]
+
+
+def has_conflict(room, selected_date, start_time, end_time, exclude_id=None):
+    # True if the given time overlaps an existing reservation for the room
+    overlapping = Reservation.objects.filter(
+        room=room,
+        date=selected_date,
+        start_time__lt=end_time,
+        end_time__gt=start_time
+    )
+    if exclude_id is not None:
+        overlapping = overlapping.exclude(id=exclude_id)
+    return overlapping.exists()
@@ -0,0 +1,192 @@
+import json
+import logging
+import threading
+import time
+from asyncio import Queue, QueueFull
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Events waiting for a slow client before it is told to reload instead
+SUBSCRIBER_QUEUE_SIZE = 20
+
+# Seconds the Redis listener waits before reconnecting, doubling up to the most
+LISTEN_RETRY_MIN = 1
+LISTEN_RETRY_MAX = 60
+
+
+class Subscription:
+    # One connected client, waiting for changes on one date
+    __slots__ = ('day', 'queue', 'loop')
+
+    def __init__(self, day, loop):
+        self.day = day
+        self.queue = Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.loop = loop
+
+    def offer(self, event):
+        # Runs on the subscriber's event loop
+        try:
+            self.queue.put_nowait(event)
+        except QueueFull:
+            # The client has fallen behind, drop what it missed and ask it to reload
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({'action': 'resync', 'date': self.day})
+
+
+class InProcessBroker:
+    """Fans availability changes out to the clients connected to this process."""
+
+    def __init__(self):
+        self.subscribers = {}  # date string -> set of Subscription
+        self.lock = threading.Lock()
+
+    def subscribe(self, day, loop):
+        subscription = Subscription(day, loop)
+        with self.lock:
+            self.subscribers.setdefault(day, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.subscribers.get(subscription.day)
+            if subscribers:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[subscription.day]
+
+    def subscriber_count(self):
+        with self.lock:
+            return sum(len(subscribers) for subscribers in self.subscribers.values())
+
+    def publish(self, event):
+        self.deliver(event)
+
+    def deliver(self, event):
+        # Hand the event to every subscriber of its date on that subscriber's own loop
+        with self.lock:
+            subscribers = list(self.subscribers.get(event['date'], ()))
+        for subscription in subscribers:
+            subscription.loop.call_soon_threadsafe(subscription.offer, event)
+        return len(subscribers)
+
+
+class RedisBroker(InProcessBroker):
+    """Shares events between worker processes through Redis pub/sub.
+
+    Every process publishes to the same channel and relays what it hears to its
+    own subscribers, so a booking made on one worker reaches clients on all of them.
+    """
+
+    channel = 'reservations:availability'
+
+    def __init__(self):
+        super().__init__()
+        import redis
+        self.redis = redis.Redis.from_url(settings.AVAILABILITY_EVENTS_REDIS_URL)
+        self.listener = None
+
+    def subscribe(self, day, loop):
+        with self.lock:
+            if self.listener is None:
+                self.listener = threading.Thread(target=self.listen, daemon=True)
+                self.listener.start()
+        return super().subscribe(day, loop)
+
+    def publish(self, event):
+        self.redis.publish(self.channel, json.dumps(event))
+
+    def listen(self):
+        # Runs for the life of the process. A lost connection is retried with
+        # backoff, and clients are told to reload what they may have missed
+        delay = LISTEN_RETRY_MIN
+        reconnecting = False
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                if reconnecting:
+                    self.resync_all()
+                    reconnecting = False
+                delay = LISTEN_RETRY_MIN
+                for message in pubsub.listen():
+                    try:
+                        self.deliver(json.loads(message['data']))
+                    except Exception as e:
+                        logger.error(f"failed to relay availability event: {str(e)}")
+            except Exception as e:
+                logger.error(f"lost the availability channel, reconnecting in {delay}s: {str(e)}")
+            finally:
+                pubsub.close()
+            reconnecting = True
+            time.sleep(delay)
+            delay = min(delay * 2, LISTEN_RETRY_MAX)
+
+    def resync_all(self):
+        with self.lock:
+            days = list(self.subscribers)
+        for day in days:
+            self.deliver({'action': 'resync', 'date': day})
+
+
+broker = None
+
+
+def get_broker():
+    global broker
+    if broker is None:
+        broker = import_string(settings.AVAILABILITY_EVENTS_BROKER)()
+    return broker
+
+
+def reservation_event(action, reservation, day=None):
+    day = day or reservation.date
+    return {
+        'action': action,
+        'date': day.isoformat(),
+        'reservation': reservation.id,
+        'room': reservation.room_id,
+        'start': reservation.start_time.strftime('%H:%M'),
+        'end': reservation.end_time.strftime('%H:%M'),
+    }
+
+
+def publish_change(action, reservation, previous_date=None):
+    """Tell live clients about a created, updated or cancelled reservation once it commits.
+
+    An edit that moves a reservation to another date is sent as a cancellation on
+    the old date and a new booking on the new one.
+    """
+    if action == 'updated' and previous_date and previous_date != reservation.date:
+        events = [reservation_event('cancelled', reservation, previous_date), reservation_event('created', reservation)]
+    else:
+        events = [reservation_event(action, reservation)]
+
+    def publish():
+        for event in events:
+            try:
+                get_broker().publish(event)
+            except Exception as e:
+                logger.error(f"failed to publish availability event: {str(e)}")
+
+    transaction.on_commit(publish)
+
+
+def publish_resync(dates):
+    """Tell live clients to reload the given dates once the transaction commits.
+
+    For bulk deletes, where one event per reservation would flood the clients.
+    """
+    events = [{'action': 'resync', 'date': day.isoformat()} for day in sorted(set(dates))]
+
+    def publish():
+        for event in events:
+            try:
+                get_broker().publish(event)
+            except Exception as e:
+                logger.error(f"failed to publish availability event: {str(e)}")
+
+    transaction.on_commit(publish)
@@ -0,0 +1,177 @@
+import secrets
+import time
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from .availability import get_cache, bump, new_version
+from .models import CalendarFeed, Reservation, ReservationChange
+
+# How far back the calendar feed goes, later reservations are all included
+FEED_PAST_DAYS = 90
+
+# Most changes returned by one "changes since" request
+CHANGES_LIMIT = 500
+
+# How long changes are kept. Clients that last synced before this start over
+CHANGE_RETENTION = timedelta(days=30)
+
+
+def version_key(user_id):
+    return f"calendar:version:{user_id}"
+
+
+def token_key(token):
+    return f"calendar:token:{token}"
+
+
+def feed_version(user_id):
+    """Return (generation, version) for a user's calendar.
+
+    The version changes whenever one of the user's reservations does and the
+    generation whenever a room does, so together they identify the feed without
+    reading the reservation table.
+    """
+    cache = get_cache()
+    keys = ['availability:generation', version_key(user_id)]
+    found = cache.get_many(keys)
+    missing = {key: new_version() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return found[keys[0]], found[keys[1]]
+
+
+def invalidate_users(*user_ids):
+    # Bump now, and again after commit in case a client fetched the old feed in between
+    user_ids = set(user_ids)
+
+    def clear():
+        for user_id in user_ids:
+            bump(version_key(user_id))
+
+    clear()
+    transaction.on_commit(clear)
+
+
+def record_changes(action, reservations):
+    # Log a change for each reservation and bump its owner's feed version
+    ReservationChange.objects.bulk_create([
+        ReservationChange(user_id=reservation.user_id, reservation_id=reservation.id, action=action)
+        for reservation in reservations
+    ])
+    invalidate_users(*{reservation.user_id for reservation in reservations})
+
+
+def record_room_changes(room):
+    # A renamed or moved room changes every calendar entry that shows it
+    record_changes(ReservationChange.SAVED, feed_reservations_for_room(room).only('id', 'user_id'))
+
+
+def feed_user_id(token):
+    # The user a feed token belongs to, or None. Cached so polling needs no queries
+    cache = get_cache()
+    user_id = cache.get(token_key(token))
+    if user_id is None:
+        user_id = CalendarFeed.objects.filter(token=token).values_list('user_id', flat=True).first()
+        if user_id is not None:
+            cache.set(token_key(token), user_id, None)
+    return user_id
+
+
+def get_feed(user):
+    feed, _ = CalendarFeed.objects.get_or_create(user=user, defaults={'token': secrets.token_urlsafe(32)})
+    return feed
+
+
+def reset_feed(user):
+    # Give the user a new token, so the old subscription URL stops working
+    feed = get_feed(user)
+    get_cache().delete(token_key(feed.token))
+    feed.token = secrets.token_urlsafe(32)
+    feed.save(update_fields=['token'])
+    return feed
+
+
+def forget_feeds(user_ids):
+    # Stop serving the feeds of users about to be deleted from the token cache
+    tokens = CalendarFeed.objects.filter(user_id__in=user_ids).values_list('token', flat=True)
+    get_cache().delete_many([token_key(token) for token in tokens])
+
+
+def feed_reservations(user_id):
+    # Read with reservation_user_date_idx
+    return Reservation.objects.filter(
+        user_id=user_id,
+        date__gte=timezone.localdate() - timedelta(days=FEED_PAST_DAYS),
+    ).order_by('date', 'start_time', 'id')
+
+
+def feed_reservations_for_room(room):
+    return Reservation.objects.filter(room=room, date__gte=timezone.localdate() - timedelta(days=FEED_PAST_DAYS))
+
+
+def feed_rows(user_id):
+    # The same columns as transfer.export_rows, for transfer.reservations_ics
+    return feed_reservations(user_id).values_list(
+        'id', 'room__name', 'room__location', 'user__username', 'date', 'start_time', 'end_time'
+    )
+
+
+def encode_sync_token(change_id):
+    # The last change a client has seen, and when, e.g. "1042.1767225600"
+    return f"{change_id}.{int(time.time())}"
+
+
+def decode_sync_token(token):
+    # (change id, seconds since epoch), or None if the token isn't valid
+    try:
+        change_id, issued = token.split('.')
+        return int(change_id), int(issued)
+    except (ValueError, AttributeError):
+        return None
+
+
+def sync_token_expired(issued):
+    return time.time() - issued > CHANGE_RETENTION.total_seconds()
+
+
+def reservation_json(reservation):
+    return {
+        'id': reservation.id,
+        'action': ReservationChange.SAVED,
+        'room': {'id': reservation.room_id, 'name': reservation.room.name, 'location': reservation.room.location},
+        'date': reservation.date.isoformat(),
+        'start': reservation.start_time.strftime('%H:%M'),
+        'end': reservation.end_time.strftime('%H:%M'),
+    }
+
+
+def snapshot(user_id):
+    # Every reservation in the feed, and a sync token to ask for changes after it
+    last_change = ReservationChange.objects.filter(user_id=user_id).aggregate(last=Max('id'))['last'] or 0
+    reservations = feed_reservations(user_id).select_related('room')
+    return [reservation_json(r) for r in reservations], encode_sync_token(last_change), False
+
+
+def changes_since(user_id, since):
+    """Return (changes, next sync token, more) for a user's changes after change id `since`.
+
+    Several changes to one reservation are sent as its latest state. A
+    reservation that was saved and then deleted is sent as deleted.
+    """
+    rows = list(ReservationChange.objects.filter(user_id=user_id, id__gt=since)
+                .order_by('id').values_list('id', 'reservation_id')[:CHANGES_LIMIT + 1])
+    more = len(rows) > CHANGES_LIMIT
+    rows = rows[:CHANGES_LIMIT]
+    if not rows:
+        return [], encode_sync_token(since), False
+
+    reservation_ids = list(dict.fromkeys(reservation_id for _, reservation_id in rows))
+    current = {r.id: r for r in Reservation.objects.filter(id__in=reservation_ids, user_id=user_id).select_related('room')}
+    changes = [
+        reservation_json(current[reservation_id]) if reservation_id in current
+        else {'id': reservation_id, 'action': ReservationChange.DELETED}
+        for reservation_id in reservation_ids
+    ]
+    return changes, encode_sync_token(rows[-1][0]), more
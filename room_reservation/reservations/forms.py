@@ -3,50 +3,42 @@ from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
 from django.contrib.auth.password_validation import validate_password
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
+from django.http import QueryDict
+from django.urls import reverse
 from django.utils import timezone
-from .models import ConferenceRoom, Reservation
+from .models import ConferenceRoom, Reservation, ReservationSeries, UserJob
+from .recurrence import MAX_OCCURRENCES, occurrence_dates
+from .search import user_label
 
 # Get the active user model
 User = get_user_model()
 
-class AdminReservationForm(forms.ModelForm):
-    user = forms.ModelChoiceField(
-        queryset=User.objects.all().order_by('username'),
-        label="Select User",
+# This whole section is the reservation form
+class ReservationForm(forms.ModelForm):
+    # Optional repeat, only offered when making a new reservation
+    repeat = forms.ChoiceField(
+        choices=[('', 'Does not repeat')] + ReservationSeries.FREQUENCY_CHOICES,
+        required=False,
         widget=forms.Select(attrs={'class': 'form-control'})
     )
-    room = forms.ModelChoiceField(
-        queryset=ConferenceRoom.objects.all().order_by('name'),
-        label="Select Room",
-        widget=forms.Select(attrs={'class': 'form-control'})
+    repeat_until = forms.DateField(
+        required=False,
+        label="Repeat until",
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'})
     )
-    date = forms.DateField(
-        widget=forms.DateInput(attrs={
-            'type': 'date',
-            'class': 'form-control',
-        })
+    skip_dates = forms.CharField(
+        required=False,
+        label="Skip dates",
+        help_text="Dates to leave out, as YYYY-MM-DD separated by commas.",
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'YYYY-MM-DD, YYYY-MM-DD'})
     )
-    start_time = forms.TimeField(
-        widget=forms.TimeInput(attrs={
-            'type': 'time',
-            'class': 'form-control',
-        })
-    )
-    end_time = forms.TimeField(
-        widget=forms.TimeInput(attrs={
-            'type': 'time',
-            'class': 'form-control',
-        })
-    )
-
-    class Meta:
-        model = Reservation
-        fields = ['user', 'room', 'date', 'start_time', 'end_time']
 
-# This whole section is the reservation form
-class ReservationForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            # Editing changes a single reservation
+            for fieldname in ['repeat', 'repeat_until', 'skip_dates']:
+                del self.fields[fieldname]
         # Set initial time to the next half hour
         now = timezone.now()
         next_half_hour = (now + timezone.timedelta(minutes=30 - now.minute % 30)).replace(second=0, microsecond=0)
@@ -76,14 +68,79 @@ class ReservationForm(forms.ModelForm):
             }),
         }
 
-        # Admin reservation form
+    def clean_skip_dates(self):
+        skip_dates = []
+        for value in self.cleaned_data.get('skip_dates', '').split(','):
+            if value.strip():
+                try:
+                    skip_dates.append(forms.DateField().to_python(value.strip()))
+                except ValidationError:
+                    raise forms.ValidationError(f'"{value.strip()}" is not a valid date.')
+        return skip_dates
+
+    def clean(self):
+        cleaned_data = super().clean()
+        self.occurrences = []
+        repeat = cleaned_data.get('repeat')
+        first = cleaned_data.get('date')
+        if not repeat or not first:
+            return cleaned_data
+
+        until = cleaned_data.get('repeat_until')
+        if not until or until <= first:
+            self.add_error('repeat_until', 'Choose a date after the first reservation.')
+            return cleaned_data
+        # One past the most allowed is enough to tell the series is too long
+        self.occurrences = occurrence_dates(first, repeat, until, cleaned_data.get('skip_dates', []),
+                                            limit=MAX_OCCURRENCES + 1)
+        if not self.occurrences:
+            self.add_error('skip_dates', 'Every date has been skipped.')
+        elif len(self.occurrences) > MAX_OCCURRENCES:
+            self.add_error('repeat_until', f'A repeating reservation can have at most {MAX_OCCURRENCES} dates.')
+        return cleaned_data
+
+# Search box for picking one row, instead of a <select> listing the whole table
+class AutocompleteSelect(forms.Widget):
+    template_name = 'reservations/widgets/autocomplete.html'
+
+    def __init__(self, url_name, attrs=None):
+        super().__init__(attrs)
+        self.url_name = url_name
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['url'] = reverse(self.url_name)
+        # Only the chosen row is read, to show its label
+        chosen = None
+        if value not in (None, ''):
+            try:
+                chosen = self.choices.queryset.filter(pk=value).first()
+            except (ValueError, TypeError, ValidationError):
+                pass
+        context['widget']['label'] = self.choices.field.label_from_instance(chosen) if chosen else ''
+        return context
+
+
+class UserChoiceField(forms.ModelChoiceField):
+    def label_from_instance(self, obj):
+        return user_label(obj)
+
+
+# Admin reservation form, the user and room are validated by id with one query each
 class AdminReservationForm(forms.ModelForm):
-    user = forms.ModelChoiceField(
+    user = UserChoiceField(
         queryset=User.objects.all(),
-        required=True,
-        label="User"
+        label="User",
+        widget=AutocompleteSelect('reservations:api_user_lookup',
+                                  attrs={'class': 'form-control', 'placeholder': 'Search username or email'})
     )
-    
+    room = forms.ModelChoiceField(
+        queryset=ConferenceRoom.objects.all(),
+        label="Room",
+        widget=AutocompleteSelect('reservations:api_room_lookup',
+                                  attrs={'class': 'form-control', 'placeholder': 'Search room name or location'})
+    )
+
     class Meta:
         model = Reservation
         fields = ['user', 'room', 'date', 'start_time', 'end_time']
@@ -102,6 +159,110 @@ class AdminReservationForm(forms.ModelForm):
             }),
         }
 
+# Filters for the staff reservations listing
+class ReservationFilterForm(forms.Form):
+    room = forms.ModelChoiceField(
+        queryset=ConferenceRoom.objects.all().order_by('name'),
+        required=False,
+        empty_label="All rooms",
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    username = forms.CharField(
+        required=False,
+        label="User",
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Username'})
+    )
+    date_from = forms.DateField(
+        required=False,
+        label="From",
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'})
+    )
+    date_to = forms.DateField(
+        required=False,
+        label="To",
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'})
+    )
+
+# Filters for the staff user directory
+class UserFilterForm(forms.Form):
+    YES_NO = [('', 'Any'), ('yes', 'Yes'), ('no', 'No')]
+
+    q = forms.CharField(
+        required=False,
+        label="Search",
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Username or email starts with'})
+    )
+    staff = forms.ChoiceField(choices=YES_NO, required=False, widget=forms.Select(attrs={'class': 'form-control'}))
+    active = forms.ChoiceField(choices=YES_NO, required=False, widget=forms.Select(attrs={'class': 'form-control'}))
+    joined_from = forms.DateField(
+        required=False,
+        label="Joined from",
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'})
+    )
+    joined_to = forms.DateField(
+        required=False,
+        label="Joined to",
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'})
+    )
+
+    def clean_q(self):
+        return self.cleaned_data['q'].strip()
+
+    # None when not filtering on it
+    def clean_staff(self):
+        return {'yes': True, 'no': False}.get(self.cleaned_data['staff'])
+
+    def clean_active(self):
+        return {'yes': True, 'no': False}.get(self.cleaned_data['active'])
+
+
+# Bulk action on the user directory, for the ticked users or every user matching the filters
+class UserBulkActionForm(forms.Form):
+    SELECTED = 'selected'
+    MATCHING = 'matching'
+
+    action = forms.ChoiceField(choices=UserJob.ACTION_CHOICES, widget=forms.Select(attrs={'class': 'form-control'}))
+    scope = forms.ChoiceField(
+        choices=[(SELECTED, 'Ticked users'), (MATCHING, 'Every user matching the filters')],
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        try:
+            cleaned_data['user_ids'] = [int(value) for value in self.data.getlist('user_ids')]
+        except ValueError:
+            raise forms.ValidationError('Invalid user selection.')
+        if cleaned_data.get('scope') == self.SELECTED and not cleaned_data['user_ids']:
+            raise forms.ValidationError('Tick at least one user.')
+        if cleaned_data.get('scope') == self.MATCHING:
+            filters = QueryDict(self.data.get('filter_query', ''))
+            cleaned_data['filters'] = {field: filters.get(field, '') for field in UserFilterForm.base_fields}
+            # Empty filters match everyone, which is never what a bulk action means
+            filter_form = UserFilterForm(cleaned_data['filters'])
+            if not filter_form.is_valid() or all(value in (None, '') for value in filter_form.cleaned_data.values()):
+                raise forms.ValidationError('Filter the list first, or tick the users to act on.')
+        return cleaned_data
+
+
+# Upload for the staff CSV/ICS import
+class ImportForm(forms.Form):
+    ROOMS = 'rooms'
+    RESERVATIONS = 'reservations'
+
+    kind = forms.ChoiceField(
+        choices=[(ROOMS, 'Rooms (CSV)'), (RESERVATIONS, 'Reservations (CSV or ICS)')],
+        label="Import",
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    file = forms.FileField()
+    default_user = forms.CharField(
+        required=False,
+        label="Default user",
+        help_text="Username for reservations that don't name one.",
+        widget=forms.TextInput(attrs={'class': 'form-control'})
+    )
+
 # Conference room form
 class ConferenceRoomForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,60 @@
+from datetime import date, time
+from django.db.models import Q
+from .models import Reservation
+
+PAGE_SIZE = 50
+
+
+def encode_cursor(reservation):
+    # The sort key of the last row on a page, e.g. "2030-01-15_09:00:00_42", or
+    # "2030-01-15_09:00:00.250000_42" for a time with microseconds
+    return f"{reservation.date.isoformat()}_{reservation.start_time.isoformat()}_{reservation.id}"
+
+
+def decode_cursor(cursor):
+    try:
+        date_str, time_str, id_str = cursor.split('_')
+        return date.fromisoformat(date_str), time.fromisoformat(time_str), int(id_str)
+    except (ValueError, AttributeError):
+        return None
+
+
+def filter_reservations(reservations, room=None, username=None, date_from=None, date_to=None):
+    # The filters of ReservationFilterForm, shared by the listing and the exports
+    if room:
+        reservations = reservations.filter(room=room)
+    if username:
+        reservations = reservations.filter(user__username=username)
+    if date_from:
+        reservations = reservations.filter(date__gte=date_from)
+    if date_to:
+        reservations = reservations.filter(date__lte=date_to)
+    return reservations
+
+
+def reservation_page(room=None, username=None, date_from=None, date_to=None, after=None, page_size=PAGE_SIZE):
+    """Return one page of reservations, newest date first, and the cursor for the next page.
+
+    Pages are found by seeking past the last row of the previous page rather than
+    with OFFSET, so every page costs the same no matter how deep it is.
+    """
+    reservations = filter_reservations(
+        Reservation.objects.select_related('user', 'room').only(
+            'id', 'date', 'start_time', 'end_time', 'updated_at', 'user__username', 'room__name'
+        ), room, username, date_from, date_to
+    )
+
+    key = decode_cursor(after) if after else None
+    if key:
+        date, start_time, last_id = key
+        # Rows that sort after (date desc, start_time asc, id asc)
+        reservations = reservations.filter(
+            Q(date__lt=date) |
+            Q(date=date, start_time__gt=start_time) |
+            Q(date=date, start_time=start_time, id__gt=last_id)
+        )
+
+    # Fetch one extra row to know if there is another page
+    rows = list(reservations.order_by('-date', 'start_time', 'id')[:page_size + 1])
+    next_cursor = encode_cursor(rows[page_size - 1]) if len(rows) > page_size else None
+    return rows[:page_size], next_cursor
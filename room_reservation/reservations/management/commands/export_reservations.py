@@ -0,0 +1,37 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from reservations import transfer
+
+
+def date_argument(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+class Command(BaseCommand):
+    help = "Write reservations as CSV or ICS, a chunk at a time so memory stays flat for big exports."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['csv', 'ics'], default='csv')
+        parser.add_argument('--output', '-o', help="File to write, defaults to stdout")
+        parser.add_argument('--room', type=int, help="Room id")
+        parser.add_argument('--user', help="Username")
+        parser.add_argument('--from', dest='date_from', type=date_argument, help="First date, YYYY-MM-DD")
+        parser.add_argument('--to', dest='date_to', type=date_argument, help="Last date, YYYY-MM-DD")
+
+    def handle(self, *args, **options):
+        rows = transfer.export_rows(room=options['room'], username=options['user'],
+                                    date_from=options['date_from'], date_to=options['date_to'])
+        chunks = transfer.reservations_ics(rows) if options['format'] == 'ics' else transfer.reservations_csv(rows)
+        try:
+            output = open(options['output'], 'w', encoding='utf-8', newline='') if options['output'] else None
+        except OSError as e:
+            raise CommandError(str(e))
+        try:
+            for chunk in chunks:
+                if output:
+                    output.write(chunk)
+                else:
+                    self.stdout.write(chunk, ending='')
+        finally:
+            if output:
+                output.close()
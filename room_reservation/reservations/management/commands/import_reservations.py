@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from reservations import transfer
+from .import_rooms import report
+
+
+class Command(BaseCommand):
+    help = ("Create reservations from a CSV file with the columns room,user,date,start_time,end_time, "
+            "or from an ICS file exported by export_reservations.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'ics'], help="Defaults to the file extension")
+        parser.add_argument('--user', help="Username for rows that don't name one")
+        parser.add_argument('--batch-size', type=int, default=transfer.IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or ('ics' if options['path'].lower().endswith('.ics') else 'csv')
+        try:
+            with open(options['path'], encoding='utf-8-sig', newline='') as lines:
+                if file_format == 'ics':
+                    rows = transfer.ics_rows(lines)
+                else:
+                    rows = transfer.csv_rows(lines, transfer.RESERVATION_COLUMNS)
+                result = transfer.import_reservations(rows, default_user=options['user'],
+                                                      batch_size=options['batch_size'])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        report(self, result, 'reservations')
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from reservations import transfer
+
+
+class Command(BaseCommand):
+    help = "Create rooms from a CSV file with the columns name,location,capacity."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=transfer.IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], encoding='utf-8-sig', newline='') as lines:
+                result = transfer.import_rooms(transfer.csv_rows(lines, transfer.ROOM_COLUMNS),
+                                               batch_size=options['batch_size'])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        report(self, result, 'rooms')
+
+
+def report(command, result, kind):
+    for line, message in result.errors:
+        command.stderr.write(f"line {line}: {message}")
+    command.stdout.write(command.style.SUCCESS(f"Imported {result.created} {kind}, skipped {len(result.errors)}."))
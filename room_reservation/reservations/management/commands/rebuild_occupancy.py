@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from reservations.occupancy import occupancy_differences, refresh_occupancy
+from reservations.transfer import batches
+
+# Differences shown before the rest are only counted
+SHOWN_DIFFERENCES = 20
+
+
+class Command(BaseCommand):
+    help = "Check the room occupancy summary against the reservations and fix any day that differs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help="Only report differences, and fail if there are any")
+
+    def handle(self, *args, **options):
+        differences = occupancy_differences()
+        if options['verify']:
+            count = 0
+            for key, expected, actual in differences:
+                count += 1
+                if count <= SHOWN_DIFFERENCES:
+                    self.stderr.write(f"room {key[0]} on {key[1]}: expected {expected[2:] if expected else 'nothing'}, "
+                                      f"found {actual[2:] if actual else 'nothing'}")
+            if count:
+                raise CommandError(f"{count} days differ from the reservations, run rebuild_occupancy to fix them.")
+            self.stdout.write(self.style.SUCCESS("The occupancy summary matches the reservations."))
+            return
+
+        # Collect the keys first, so fixing rows doesn't disturb the comparison
+        keys = [key for key, _, _ in differences]
+        for batch in batches(keys, 1000):
+            refresh_occupancy(batch)
+        self.stdout.write(self.style.SUCCESS(f"Fixed {len(keys)} days."))
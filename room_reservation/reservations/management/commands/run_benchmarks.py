@@ -0,0 +1,75 @@
+import json
+import os
+import tempfile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from benchmarks import generators, runner
+from benchmarks.scenarios import SCENARIOS
+
+
+class Command(BaseCommand):
+    help = ("Fill a throwaway database with seeded data, time each benchmark scenario and "
+            "report its queries, wall time and peak memory as JSON.")
+
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=50)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--reservations', type=int, default=10000)
+        parser.add_argument('--days', type=int, default=90, help="Days the reservations are spread over")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--repeat', type=int, default=5, help="Timed runs of each scenario")
+        parser.add_argument('--only', nargs='+', metavar='SCENARIO', help="Scenarios to run, default all")
+        parser.add_argument('--output', '-o', help="File to write the JSON results to, default stdout")
+        parser.add_argument('--compare', metavar='JSON', help="Earlier results to compare against")
+        parser.add_argument('--check', action='store_true',
+                            help="Fail when a scenario is over its budget, such as metrics_overhead")
+
+    def handle(self, *args, **options):
+        scenarios = SCENARIOS
+        if options['only']:
+            names = {scenario.name for scenario in SCENARIOS}
+            unknown = set(options['only']) - names
+            if unknown:
+                raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}. Choose from {', '.join(sorted(names))}.")
+            scenarios = [scenario for scenario in SCENARIOS if scenario.name in options['only']]
+        previous = runner.load(options['compare']) if options['compare'] else None
+
+        # Tasks run in this process, email goes to a list, and the test client's host is allowed
+        from room_reservation import celery_app
+        setup_test_environment()
+        eager = celery_app.conf.task_always_eager
+        celery_app.conf.task_always_eager = True
+
+        with tempfile.TemporaryDirectory() as directory:
+            # A database file rather than SQLite's in-memory test database, so the
+            # contention scenario's threads can all reach it
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                self.stderr.write("Generating data...")
+                data = generators.generate(rooms=options['rooms'], users=options['users'],
+                                           reservations=options['reservations'], days=options['days'],
+                                           seed=options['seed'])
+                data.update(seed=options['seed'], days=options['days'])
+                self.stderr.write(f"Created {data['rooms']} rooms, {data['users']} users and "
+                                  f"{data['reservations']} reservations")
+                results = runner.run(scenarios, options['repeat'], data, log=self.stderr.write)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                celery_app.conf.task_always_eager = eager
+                teardown_test_environment()
+
+        if previous:
+            for line in runner.compare(previous, results):
+                self.stderr.write(line)
+        document = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(document + '\n')
+        else:
+            self.stdout.write(document)
+        if options['check'] and runner.over_budget(results):
+            raise CommandError('\n'.join(runner.over_budget(results)))
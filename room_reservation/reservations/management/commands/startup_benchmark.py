@@ -0,0 +1,76 @@
+import json
+import os
+import subprocess
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter, so nothing is imported or connected yet
+COLD_START = """
+import json, sys, time
+began = time.perf_counter()
+from room_reservation.wsgi import application
+imported = time.perf_counter()
+
+status = []
+environ = {
+    'REQUEST_METHOD': 'GET', 'PATH_INFO': %(path)r, 'QUERY_STRING': '', 'SERVER_NAME': 'localhost',
+    'SERVER_PORT': '80', 'wsgi.url_scheme': 'http', 'wsgi.input': sys.stdin.buffer, 'wsgi.errors': sys.stderr,
+}
+body = b''.join(application(environ, lambda s, headers, exc_info=None: status.append(s)))
+responded = time.perf_counter()
+
+print(json.dumps({
+    'import_seconds': imported - began,
+    'first_response_seconds': responded - began,
+    'status': status[0],
+    'celery_imported': 'celery' in sys.modules,
+    'smtp_imported': 'smtplib' in sys.modules,
+}))
+"""
+
+# Generous enough for a slow CI machine, but importing Celery and the task
+# modules on top of Django would blow through it
+IMPORT_BUDGET_SECONDS = 1.5
+
+
+class Command(BaseCommand):
+    help = "Time a cold start of the WSGI app: importing it and serving the first request."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/login/', help="Path to request after startup")
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--budget', type=float, default=IMPORT_BUDGET_SECONDS,
+                            help="Most seconds the median import may take with --check")
+        parser.add_argument('--check', action='store_true',
+                            help="Fail when the import is over budget or loads Celery or smtplib")
+
+    def handle(self, *args, **options):
+        runs = []
+        for _ in range(options['runs']):
+            output = subprocess.run(
+                [sys.executable, '-c', COLD_START % {'path': options['path']}],
+                cwd=settings.BASE_DIR, env=os.environ.copy(), capture_output=True, text=True, check=True,
+            ).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+
+        runs.sort(key=lambda run: run['first_response_seconds'])
+        result = {
+            'runs': len(runs),
+            'median_import_seconds': sorted(run['import_seconds'] for run in runs)[len(runs) // 2],
+            'median_first_response_seconds': runs[len(runs) // 2]['first_response_seconds'],
+            'status': runs[0]['status'],
+            'celery_imported': any(run['celery_imported'] for run in runs),
+            'smtp_imported': any(run['smtp_imported'] for run in runs),
+        }
+        self.stdout.write(json.dumps(result, indent=2))
+
+        if options['check']:
+            problems = []
+            if result['median_import_seconds'] > options['budget']:
+                problems.append(f"importing the app took {result['median_import_seconds']:.2f}s, "
+                                f"over the {options['budget']:g}s budget")
+            if result['celery_imported'] or result['smtp_imported']:
+                problems.append("the web process imported Celery or smtplib")
+            if problems:
+                raise CommandError('\n'.join(problems))
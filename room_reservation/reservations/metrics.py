@@ -0,0 +1,287 @@
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextvars import ContextVar
+from time import perf_counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates
+
+# Upper bounds of the request latency histogram, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# How many of the latest requests are kept for the dashboard
+RECENT_REQUESTS = 200
+
+# The request being measured, if any. A ContextVar rather than a thread local,
+# so it follows an async request and the sync code it calls into other threads
+current_metrics = ContextVar('current_metrics', default=None)
+
+
+class RequestMetrics:
+    # What one request spent its time on
+    __slots__ = ('queries', 'db_time', 'template_time', 'smtp_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.smtp_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Runs around every query made while this request is measured
+        began = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += perf_counter() - began
+
+
+def time_query(execute, sql, params, many, context):
+    # Installed on every connection. Connections belong to a thread, and an async
+    # request's queries run on another one, so the request is found through the
+    # ContextVar rather than by wrapping the connection it started on
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+class ViewMetrics:
+    # Running totals and a latency histogram for one view
+    __slots__ = ('count', 'errors', 'buckets', 'total_time', 'queries', 'max_queries', 'db_time',
+                 'template_time', 'smtp_time')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # the last one is +Inf
+        self.total_time = 0.0
+        self.queries = 0
+        self.max_queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.smtp_time = 0.0
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket the percentile falls in, None past the last bound
+        target = self.count * fraction
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= target:
+                return bound
+        return None
+
+    def as_dict(self, name):
+        count = self.count or 1
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            'view': name,
+            'count': self.count,
+            'errors': self.errors,
+            'avg_ms': self.total_time / count * 1000,
+            'p50_ms': p50 * 1000 if p50 is not None else None,
+            'p95_ms': p95 * 1000 if p95 is not None else None,
+            'avg_queries': self.queries / count,
+            'max_queries': self.max_queries,
+            'avg_db_ms': self.db_time / count * 1000,
+            'avg_template_ms': self.template_time / count * 1000,
+            'smtp_ms': self.smtp_time * 1000,
+        }
+
+
+class Registry:
+    """Metrics for every view served by this process since it started.
+
+    Each process keeps its own, so with several workers the dashboard and the
+    Prometheus endpoint show the worker that answered, and Prometheus should
+    scrape each one.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.recent = deque(maxlen=RECENT_REQUESTS)  # (view, seconds, queries, status)
+        self.smtp_sends = 0
+        self.smtp_time = 0.0
+
+    def record(self, view, elapsed, status, metrics):
+        with self.lock:
+            stats = self.views.get(view)
+            if stats is None:
+                stats = self.views[view] = ViewMetrics()
+            stats.count += 1
+            stats.errors += status >= 500
+            stats.buckets[bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+            stats.total_time += elapsed
+            stats.queries += metrics.queries
+            stats.max_queries = max(stats.max_queries, metrics.queries)
+            stats.db_time += metrics.db_time
+            stats.template_time += metrics.template_time
+            stats.smtp_time += metrics.smtp_time
+            self.recent.append((view, elapsed, metrics.queries, status))
+
+    def record_smtp(self, elapsed):
+        # Emails can be sent outside a request too, e.g. by the worker
+        with self.lock:
+            self.smtp_sends += 1
+            self.smtp_time += elapsed
+        current = current_metrics.get()
+        if current is not None:
+            current.smtp_time += elapsed
+
+    def summary(self):
+        # Per-view rows, slowest on average first, and the slowest recent requests
+        with self.lock:
+            views = [stats.as_dict(name) for name, stats in self.views.items()]
+            recent = list(self.recent)
+        views.sort(key=lambda row: row['avg_ms'], reverse=True)
+        slowest = sorted(recent, key=lambda row: row[1], reverse=True)[:10]
+        return {
+            'views': views,
+            'slowest': [{'view': v, 'ms': t * 1000, 'queries': q, 'status': s} for v, t, q, s in slowest],
+            'smtp_sends': self.smtp_sends,
+            'smtp_ms': self.smtp_time * 1000,
+        }
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+            self.recent.clear()
+            self.smtp_sends = 0
+            self.smtp_time = 0.0
+
+    def prometheus(self):
+        """The metrics in the Prometheus text exposition format."""
+        with self.lock:
+            views = sorted(self.views.items())
+            lines = [
+                '# HELP room_reservation_request_seconds Time taken to answer requests, by view.',
+                '# TYPE room_reservation_request_seconds histogram',
+            ]
+            for name, stats in views:
+                label = f'view="{escape_label(name)}"'
+                seen = 0
+                for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                    seen += count
+                    lines.append(f'room_reservation_request_seconds_bucket{{{label},le="{bound}"}} {seen}')
+                lines.append(f'room_reservation_request_seconds_bucket{{{label},le="+Inf"}} {stats.count}')
+                lines.append(f'room_reservation_request_seconds_sum{{{label}}} {stats.total_time:.6f}')
+                lines.append(f'room_reservation_request_seconds_count{{{label}}} {stats.count}')
+
+            counters = [
+                ('request_errors_total', 'Requests answered with a 5xx status.', 'errors', '{}'),
+                ('db_queries_total', 'Database queries run while answering requests.', 'queries', '{}'),
+                ('db_seconds_total', 'Time spent in database queries.', 'db_time', '{:.6f}'),
+                ('template_seconds_total', 'Time spent rendering templates.', 'template_time', '{:.6f}'),
+                ('smtp_seconds_total', 'Time spent sending email during requests.', 'smtp_time', '{:.6f}'),
+            ]
+            for metric, help_text, field, number in counters:
+                lines.append(f'# HELP room_reservation_{metric} {help_text}')
+                lines.append(f'# TYPE room_reservation_{metric} counter')
+                for name, stats in views:
+                    value = number.format(getattr(stats, field))
+                    lines.append(f'room_reservation_{metric}{{view="{escape_label(name)}"}} {value}')
+
+            lines += [
+                '# HELP room_reservation_smtp_sends_total Batches of email sent by this process.',
+                '# TYPE room_reservation_smtp_sends_total counter',
+                f'room_reservation_smtp_sends_total {self.smtp_sends}',
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+
+class MetricsMiddleware:
+    """Times every request and counts its queries, template and SMTP time.
+
+    Put it first in MIDDLEWARE so the time includes the other middleware. Turn
+    it off with REQUEST_METRICS = False.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_METRICS', True):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        # Under ASGI stay async, so async views like the availability stream
+        # aren't moved onto a worker thread
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        began = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        self.record(request, response, metrics, perf_counter() - began)
+        return response
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        began = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        self.record(request, response, metrics, perf_counter() - began)
+        return response
+
+    def record(self, request, response, metrics, elapsed):
+        match = request.resolver_match
+        registry.record(match.view_name if match else 'unresolved', elapsed, response.status_code, metrics)
+
+
+class TimedTemplate:
+    # Wraps a backend template so the request's template time includes its render
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        metrics = current_metrics.get()
+        if metrics is None:
+            return self.template.render(context, request)
+        began = perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            metrics.template_time += perf_counter() - began
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, with render time added to the request metrics."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0002_reservation_reminder_sent'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['room', 'date', 'start_time', 'end_time'], name='reservation_room_slot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['date', 'room', 'start_time'], name='reservation_date_room_idx'),
+        ),
+    ]
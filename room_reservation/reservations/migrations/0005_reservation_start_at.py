@@ -0,0 +1,40 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:28
+
+from datetime import datetime
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_start_at(apps, schema_editor):
+    # Historical models don't have the custom save(), so work it out here
+    Reservation = apps.get_model('reservations', 'Reservation')
+    batch = []
+    for reservation in Reservation.objects.only('date', 'start_time').iterator(chunk_size=2000):
+        reservation.start_at = timezone.make_aware(datetime.combine(reservation.date, reservation.start_time))
+        batch.append(reservation)
+        if len(batch) == 2000:
+            Reservation.objects.bulk_update(batch, ['start_at'])
+            batch = []
+    Reservation.objects.bulk_update(batch, ['start_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0004_outboxemail'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservation',
+            name='start_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_start_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(condition=models.Q(('reminder_sent', False)), fields=['start_at'], name='reservation_reminder_due_idx'),
+        ),
+    ]
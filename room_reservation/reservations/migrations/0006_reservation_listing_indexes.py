@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0005_reservation_start_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['-date', 'start_time', 'id'], name='reservation_listing_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['user', '-date', 'start_time'], name='reservation_user_date_idx'),
+        ),
+    ]
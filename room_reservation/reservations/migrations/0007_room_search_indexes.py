@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0006_reservation_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conferenceroom',
+            index=models.Index(fields=['capacity'], name='room_capacity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conferenceroom',
+            index=models.Index(fields=['location', 'capacity'], name='room_location_capacity_idx'),
+        ),
+    ]
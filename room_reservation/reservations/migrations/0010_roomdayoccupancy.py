@@ -0,0 +1,55 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:03
+
+import django.db.models.deletion
+from itertools import groupby
+from django.db import migrations, models
+
+
+def build_occupancy(apps, schema_editor):
+    # Summarise the reservations that already exist, one room and day at a time
+    Reservation = apps.get_model('reservations', 'Reservation')
+    RoomDayOccupancy = apps.get_model('reservations', 'RoomDayOccupancy')
+    rows = Reservation.objects.order_by('room_id', 'date').values_list(
+        'room_id', 'date', 'start_time', 'end_time').iterator(chunk_size=2000)
+    batch = []
+    for (room_id, day), bookings in groupby(rows, key=lambda row: (row[0], row[1])):
+        bookings = [(start, end) for _, _, start, end in bookings]
+        batch.append(RoomDayOccupancy(
+            room_id=room_id,
+            date=day,
+            booked_minutes=sum(max(0, (end.hour * 60 + end.minute) - (start.hour * 60 + start.minute)) for start, end in bookings),
+            booking_count=len(bookings),
+            first_start=min(start for start, _ in bookings),
+            last_end=max(end for _, end in bookings),
+        ))
+        if len(batch) >= 2000:
+            RoomDayOccupancy.objects.bulk_create(batch)
+            batch = []
+    RoomDayOccupancy.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0009_calendar_feed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomDayOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('booked_minutes', models.PositiveIntegerField()),
+                ('booking_count', models.PositiveIntegerField()),
+                ('first_start', models.TimeField()),
+                ('last_end', models.TimeField()),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='reservations.conferenceroom')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'booked_minutes'], name='occupancy_date_minutes_idx')],
+                'constraints': [models.UniqueConstraint(fields=('room', 'date'), name='occupancy_room_date_unique')],
+            },
+        ),
+        migrations.RunPython(build_occupancy, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:12
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+# auth.User belongs to another app, so its lookup indexes are added through the schema editor
+USER_INDEXES = [
+    models.Index(django.db.models.functions.text.Lower('username'), name='user_username_lower_idx'),
+    models.Index(django.db.models.functions.text.Lower('email'), name='user_email_lower_idx'),
+]
+
+
+def add_user_indexes(apps, schema_editor):
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    for index in USER_INDEXES:
+        schema_editor.add_index(User, index)
+
+
+def remove_user_indexes(apps, schema_editor):
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    for index in USER_INDEXES:
+        schema_editor.remove_index(User, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('reservations', '0010_roomdayoccupancy'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conferenceroom',
+            index=models.Index(django.db.models.functions.text.Lower('name'), name='room_name_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conferenceroom',
+            index=models.Index(django.db.models.functions.text.Lower('location'), name='room_location_lower_idx'),
+        ),
+        migrations.RunPython(add_user_indexes, remove_user_indexes),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Filters of the user directory, which lists users in username order
+USER_INDEXES = [
+    models.Index(fields=['is_staff', 'username'], name='user_staff_username_idx'),
+    models.Index(fields=['is_active', 'username'], name='user_active_username_idx'),
+    models.Index(fields=['date_joined'], name='user_date_joined_idx'),
+]
+
+
+def add_user_indexes(apps, schema_editor):
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    for index in USER_INDEXES:
+        schema_editor.add_index(User, index)
+
+
+def remove_user_indexes(apps, schema_editor):
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    for index in USER_INDEXES:
+        schema_editor.remove_index(User, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0011_lookup_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('deactivate', 'Deactivate'), ('delete', 'Delete')], max_length=10)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('user_ids', models.JSONField(blank=True, null=True)),
+                ('filters', models.JSONField(blank=True, default=dict)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('done', models.PositiveIntegerField(default=0)),
+                ('last_user_id', models.BigIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('requested_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(add_user_indexes, remove_user_indexes),
+    ]
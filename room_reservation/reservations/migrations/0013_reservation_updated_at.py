@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0012_user_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservation',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0013_reservation_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CancelledBooking',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('room_id', models.IntegerField(db_index=True)),
+                ('room_name', models.CharField(max_length=100)),
+                ('email', models.EmailField(max_length=254)),
+                ('username', models.CharField(max_length=150)),
+                ('date', models.DateField()),
+                ('start_time', models.TimeField()),
+                ('end_time', models.TimeField()),
+            ],
+        ),
+    ]
@@ -1,4 +1,7 @@
+from datetime import datetime
 from django.db import models
+from django.db.models.functions import Lower
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 class ConferenceRoom(models.Model):
@@ -7,10 +10,52 @@ class ConferenceRoom(models.Model):
     location = models.CharField(max_length=100) # Where the room is located
     capacity = models.PositiveIntegerField() # How many people can fit in the room
 
+    class Meta:
+        indexes = [
+            # Used by the free slot search, which filters on capacity and optionally location
+            models.Index(fields=['capacity'], name='room_capacity_idx'),
+            models.Index(fields=['location', 'capacity'], name='room_location_capacity_idx'),
+            # Used by the staff room lookup, which matches name or location prefixes in any case
+            models.Index(Lower('name'), name='room_name_lower_idx'),
+            models.Index(Lower('location'), name='room_location_lower_idx'),
+        ]
+
+    # The name and location the room had when it was loaded, so calendar feeds
+    # are only told about a save that changes what they show
+    loaded_name = None
+    loaded_location = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.loaded_name = instance.__dict__.get('name')
+        instance.loaded_location = instance.__dict__.get('location')
+        return instance
+
     def __str__(self):
         # Show name, location and how many seats
         return f"{self.name} @ {self.location} - Seats: {self.capacity}"
 
+class ReservationSeries(models.Model):
+    # A repeating booking, every occurrence is its own Reservation pointing back here
+    DAILY = 'daily'
+    WEEKLY = 'weekly'
+    MONTHLY = 'monthly'
+    FREQUENCY_CHOICES = [
+        (DAILY, 'Daily'),
+        (WEEKLY, 'Weekly'),
+        (MONTHLY, 'Monthly'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    room = models.ForeignKey(ConferenceRoom, on_delete=models.CASCADE)
+    frequency = models.CharField(max_length=10, choices=FREQUENCY_CHOICES)
+    until = models.DateField() # Last date an occurrence can fall on
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.room.name} - {self.get_frequency_display()} until {self.until}"
+
 class Reservation(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE) # Shows who booked the room
     room = models.ForeignKey(ConferenceRoom, on_delete=models.CASCADE) # Which room the user booked
@@ -18,7 +63,195 @@ class Reservation(models.Model):
     start_time = models.TimeField() # When the reservation starts
     end_time = models.TimeField() # When the reservation ends
     created_at = models.DateTimeField(auto_now_add=True) # When the reservation was made
+    updated_at = models.DateTimeField(auto_now=True) # When it was last saved, part of its cached table rows' keys
     reminder_sent = models.BooleanField(default=False) # Track if reminder email was sent
+    start_at = models.DateTimeField(null=True, editable=False) # date and start_time combined, kept in sync on save
+    series = models.ForeignKey(ReservationSeries, null=True, blank=True, editable=False,
+                               on_delete=models.SET_NULL, related_name='reservations') # Set for repeating bookings
+
+    class Meta:
+        indexes = [
+            # Used by the overlap check and the per-date availability lookups
+            models.Index(fields=['room', 'date', 'start_time', 'end_time'], name='reservation_room_slot_idx'),
+            models.Index(fields=['date', 'room', 'start_time'], name='reservation_date_room_idx'),
+            # Sort order and user filter of the admin reservations listing
+            models.Index(fields=['-date', 'start_time', 'id'], name='reservation_listing_idx'),
+            models.Index(fields=['user', '-date', 'start_time'], name='reservation_user_date_idx'),
+            # Only reservations still waiting for a reminder, so old bookings don't bloat it
+            models.Index(fields=['start_at'], condition=models.Q(reminder_sent=False), name='reservation_reminder_due_idx'),
+        ]
+
+    # The date and room this reservation had when it was loaded, so caches and
+    # summaries for the old day can be updated after an edit
+    loaded_date = None
+    loaded_room_id = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.loaded_date = instance.__dict__.get('date')
+        instance.loaded_room_id = instance.__dict__.get('room_id')
+        return instance
+
+    @staticmethod
+    def combine_start(date, start_time):
+        # Aware datetime for when a reservation starts, in the site's time zone
+        return timezone.make_aware(datetime.combine(date, start_time))
+
+    def save(self, *args, **kwargs):
+        self.start_at = self.combine_start(self.date, self.start_time)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            # auto_now only reaches the database if updated_at is saved too
+            kwargs['update_fields'] = set(update_fields) | {'updated_at'}
+            if {'date', 'start_time'} & set(update_fields):
+                kwargs['update_fields'].add('start_at')
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.room.name} - {self.date} {self.start_time}-{self.end_time}" #Show which room, date and time.
+
+
+class RoomDayOccupancy(models.Model):
+    # How booked each room is on each day, kept up to date as reservations change
+    # so reports don't have to scan every reservation
+    room = models.ForeignKey(ConferenceRoom, on_delete=models.CASCADE)
+    date = models.DateField()
+    booked_minutes = models.PositiveIntegerField()
+    booking_count = models.PositiveIntegerField()
+    first_start = models.TimeField() # Start of the day's first booking
+    last_end = models.TimeField() # End of the day's last booking
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'date'], name='occupancy_room_date_unique'),
+        ]
+        indexes = [
+            # Utilization over a date range, and the least busy rooms on a day
+            models.Index(fields=['date', 'booked_minutes'], name='occupancy_date_minutes_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.room.name} {self.date}: {self.booked_minutes} minutes"
+
+
+class ReservationChange(models.Model):
+    # One row each time a reservation is saved or deleted, read by the calendar
+    # "changes since" feed. Old rows are pruned by a periodic task
+    SAVED = 'saved'
+    DELETED = 'deleted'
+    ACTION_CHOICES = [
+        (SAVED, 'Saved'),
+        (DELETED, 'Deleted'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE) # Whose calendar the change is for
+    reservation_id = models.BigIntegerField() # Not a foreign key, the reservation may be gone
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    changed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # The feed reads one user's changes after a given id
+            models.Index(fields=['user', 'id'], name='change_user_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"Reservation {self.reservation_id} {self.action}"
+
+
+class CalendarFeed(models.Model):
+    # The secret in the URL a user subscribes their calendar app to
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='calendar_feed')
+    token = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Calendar feed for {self.user.username}"
+
+
+class OutboxEmail(models.Model):
+    # Emails waiting to be sent by the Celery worker, written in the same
+    # transaction as the reservation change that caused them
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    to_email = models.EmailField() # Who the email is going to
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0) # How many times sending has failed
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now) # Don't retry before this time
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The worker only ever looks for pending emails that are due
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {self.to_email} ({self.status})"
+
+
+class CancelledBooking(models.Model):
+    # A copy of a booking in a deleted room, kept until the worker has emailed
+    # its owner. Plain fields, as the room and reservation are already gone
+    room_id = models.IntegerField(db_index=True)
+    room_name = models.CharField(max_length=100)
+    email = models.EmailField()
+    username = models.CharField(max_length=150)
+    date = models.DateField()
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+
+    def __str__(self):
+        return f"{self.room_name} {self.date} -> {self.email}"
+
+
+class UserJob(models.Model):
+    # A bulk deactivate or delete started from the user directory, run by the
+    # Celery worker a chunk of users at a time
+    DEACTIVATE = 'deactivate'
+    DELETE = 'delete'
+    ACTION_CHOICES = [
+        (DEACTIVATE, 'Deactivate'),
+        (DELETE, 'Delete'),
+    ]
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='+') # Never included in the job
+    user_ids = models.JSONField(null=True, blank=True) # The users picked, or null for every user matching filters
+    filters = models.JSONField(default=dict, blank=True) # The user directory's filters, as in its query string
+    total = models.PositiveIntegerField(default=0) # How many users matched when the job started
+    done = models.PositiveIntegerField(default=0)
+    last_user_id = models.BigIntegerField(default=0) # Users are handled in id order, a retried job carries on after this
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def percent(self):
+        return min(100, self.done * 100 // self.total) if self.total else 100
+
+    def __str__(self):
+        return f"{self.get_action_display()} {self.total} users ({self.status})"
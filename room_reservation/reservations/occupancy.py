@@ -0,0 +1,177 @@
+from array import array
+from datetime import timedelta
+from itertools import groupby
+from django.db import connection, transaction
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from .models import ConferenceRoom, Reservation, RoomDayOccupancy
+
+# Each day is split into 48 half hour slots, one bit per slot
+SLOT_MINUTES = 30
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+
+# Utilization is booked time as a share of a 10 hour working day
+UTILIZATION_DAY_MINUTES = 10 * 60
+
+
+def slot_mask(start_time, end_time):
+    # Bits for every slot the reservation touches, e.g. 9:15-10:00 sets slots 18 and 19
+    first = (start_time.hour * 60 + start_time.minute) // SLOT_MINUTES
+    end_minutes = end_time.hour * 60 + end_time.minute + (1 if end_time.second or end_time.microsecond else 0)
+    last = min(-(-end_minutes // SLOT_MINUTES), SLOTS_PER_DAY)
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def runs(mask):
+    # Yield (first_slot, length) for each block of consecutive booked slots
+    while mask:
+        first = (mask & -mask).bit_length() - 1
+        shifted = mask >> first
+        length = ((shifted + 1) & ~shifted).bit_length() - 1
+        yield first, length
+        mask &= ~(((1 << length) - 1) << first)
+
+
+class OccupancyGrid:
+    """Room x day x half hour occupancy for a date range.
+
+    Every room gets an array of one 64 bit integer per day, with a bit set for
+    each booked slot, so a 200 room month is about 50KB.
+    """
+
+    def __init__(self, rooms, start_date, days):
+        self.rooms = list(rooms)
+        self.start_date = start_date
+        self.days = [start_date + timedelta(days=i) for i in range(days)]
+        self.bits = {room.id: array('Q', bytes(8 * days)) for room in self.rooms}
+
+    @classmethod
+    def load(cls, start_date, days, rooms=None):
+        # Two queries: the rooms, and every reservation in the range
+        if rooms is None:
+            rooms = ConferenceRoom.objects.order_by('name')
+        grid = cls(rooms, start_date, days)
+        rows = Reservation.objects.filter(
+            date__range=(start_date, grid.days[-1])
+        ).values_list('room_id', 'date', 'start_time', 'end_time')
+        for room_id, day, start_time, end_time in rows:
+            room_bits = grid.bits.get(room_id)
+            if room_bits is not None:
+                room_bits[(day - start_date).days] |= slot_mask(start_time, end_time)
+        return grid
+
+    def is_booked(self, room_id, day, slot):
+        return bool(self.bits[room_id][(day - self.start_date).days] >> slot & 1)
+
+    def booked_slots(self, room_id, day):
+        return bin(self.bits[room_id][(day - self.start_date).days]).count('1')
+
+    def rows(self):
+        # Everything the calendar template needs, as plain lists and numbers
+        for room in self.rooms:
+            cells = []
+            for mask in self.bits[room.id]:
+                cells.append({
+                    'hours': bin(mask).count('1') * SLOT_MINUTES / 60,
+                    # Position of each booked block along the day, ready for a style attribute
+                    'runs': [f"left: {first * 100 / SLOTS_PER_DAY:.2f}%; width: {length * 100 / SLOTS_PER_DAY:.2f}%"
+                             for first, length in runs(mask)],
+                })
+            yield {'room': room, 'cells': cells}
+
+
+def minutes_between(start_time, end_time):
+    # Forms reject bookings that end before they start, but the model doesn't
+    return max(0, (end_time.hour * 60 + end_time.minute) - (start_time.hour * 60 + start_time.minute))
+
+
+def summarize(rows):
+    """Turn (room_id, date, start_time, end_time) rows sorted by room and date into
+    (room_id, date, booked_minutes, booking_count, first_start, last_end) per day."""
+    for (room_id, day), bookings in groupby(rows, key=lambda row: (row[0], row[1])):
+        bookings = [(start, end) for _, _, start, end in bookings]
+        yield (room_id, day, sum(minutes_between(start, end) for start, end in bookings), len(bookings),
+               min(start for start, _ in bookings), max(end for _, end in bookings))
+
+
+def refresh_occupancy(keys):
+    """Recount RoomDayOccupancy for (room_id, date) pairs from their reservations.
+
+    Three queries per room however many of its dates changed, so single edits and
+    bulk bookings share it.
+    """
+    days_by_room = {}
+    for room_id, day in keys:
+        if room_id is not None and day is not None:
+            days_by_room.setdefault(room_id, set()).add(day)
+    if not days_by_room:
+        return
+
+    with transaction.atomic():
+        if connection.features.has_select_for_update:
+            # The same lock bookings take, so two refreshes of a day can't both insert it
+            list(ConferenceRoom.objects.select_for_update().filter(pk__in=days_by_room).order_by('pk').values_list('pk'))
+        for room_id, days in days_by_room.items():
+            rows = Reservation.objects.filter(room_id=room_id, date__in=days).order_by('date').values_list(
+                'room_id', 'date', 'start_time', 'end_time')
+            summaries = [RoomDayOccupancy(room_id=room_id, date=day, booked_minutes=minutes, booking_count=count,
+                                          first_start=first_start, last_end=last_end)
+                         for _, day, minutes, count, first_start, last_end in summarize(rows)]
+            RoomDayOccupancy.objects.filter(room_id=room_id, date__in=days).delete()
+            RoomDayOccupancy.objects.bulk_create(summaries)
+
+
+def occupancy_differences(chunk_size=2000):
+    """Yield ((room_id, date), expected, actual) for every day where RoomDayOccupancy
+    doesn't match the reservations. Either side is None when its row is missing.
+
+    Both are read in the same order and merged, so memory stays flat.
+    """
+    expected = summarize(Reservation.objects.order_by('room_id', 'date').values_list(
+        'room_id', 'date', 'start_time', 'end_time').iterator(chunk_size=chunk_size))
+    actual = RoomDayOccupancy.objects.order_by('room_id', 'date').values_list(
+        'room_id', 'date', 'booked_minutes', 'booking_count', 'first_start', 'last_end').iterator(chunk_size=chunk_size)
+
+    want, have = next(expected, None), next(actual, None)
+    while want is not None or have is not None:
+        if have is None or (want is not None and want[:2] < have[:2]):
+            yield want[:2], want, None
+            want = next(expected, None)
+        elif want is None or have[:2] < want[:2]:
+            yield have[:2], None, have
+            have = next(actual, None)
+        else:
+            if want != have:
+                yield want[:2], want, have
+            want, have = next(expected, None), next(actual, None)
+
+
+def utilization(date_from, date_to):
+    """Booked time per room between two dates, read from RoomDayOccupancy."""
+    days = (date_to - date_from).days + 1
+    totals = {row['room']: row for row in RoomDayOccupancy.objects.filter(date__range=(date_from, date_to))
+              .values('room').annotate(minutes=Sum('booked_minutes'), bookings=Sum('booking_count'),
+                                       busy_days=Count('id'))}
+    rows = []
+    for room in ConferenceRoom.objects.order_by('name'):
+        total = totals.get(room.id, {})
+        minutes = total.get('minutes', 0)
+        rows.append({
+            'room': room,
+            'hours': minutes / 60,
+            'bookings': total.get('bookings', 0),
+            'busy_days': total.get('busy_days', 0),
+            'utilization': minutes / (days * UTILIZATION_DAY_MINUTES) * 100,
+        })
+    rows.sort(key=lambda row: row['utilization'], reverse=True)
+    return rows
+
+
+def least_busy_rooms(day, min_capacity=1, limit=5):
+    # Rooms with the fewest booked minutes on a day, smallest first when tied
+    booked = RoomDayOccupancy.objects.filter(room=OuterRef('pk'), date=day).values('booked_minutes')
+    return list(ConferenceRoom.objects.filter(capacity__gte=min_capacity)
+                .annotate(booked_minutes=Coalesce(Subquery(booked), Value(0)))
+                .order_by('booked_minutes', 'capacity', 'name')[:limit])
@@ -0,0 +1,37 @@
+import logging
+from django.db import transaction
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+
+def queue_email(subject, message, to_email):
+    """Store an email in the outbox and have the worker send it after commit.
+
+    Call this inside the same transaction as the change the email is about, so
+    the email is only sent if the change is saved.
+    """
+    email = OutboxEmail.objects.create(subject=subject, body=message, to_email=to_email)
+    # The email stays pending and is picked up on the next drain if this fails
+    enqueue_after_commit('drain_email_outbox')
+    return email
+
+
+def enqueue_after_commit(task_name, *args):
+    # Queue a task from reservations.tasks once the current transaction commits,
+    # so the worker never sees rows that were rolled back
+    def enqueue():
+        # Imported here so web processes only load Celery when they first queue a task
+        from room_reservation import celery_app
+        try:
+            if celery_app.conf.task_always_eager:
+                # Running without a worker (tests, local development), run it here
+                from . import tasks
+                getattr(tasks, task_name).apply(args=args)
+            else:
+                # Sent by name, so the web process never imports the task modules
+                celery_app.send_task(f'reservations.tasks.{task_name}', args=args)
+        except Exception as e:
+            logger.error(f"failed to enqueue {task_name}: {str(e)}")
+
+    transaction.on_commit(enqueue)
@@ -0,0 +1,40 @@
+from datetime import date, timedelta
+from .models import ReservationSeries
+
+# Most occurrences one repeating booking can create
+MAX_OCCURRENCES = 500
+
+
+def add_months(day, months):
+    # The same day of the month, or None when that month is too short (e.g. the 31st)
+    month = day.month - 1 + months
+    year, month = day.year + month // 12, month % 12 + 1
+    try:
+        return date(year, month, day.day)
+    except ValueError:
+        return None
+
+
+def occurrence_dates(first, frequency, until, exceptions=(), limit=None):
+    """Dates from first to until (inclusive) for a daily, weekly or monthly booking.
+
+    Dates in exceptions are left out. Monthly bookings skip months that don't
+    have the starting day, like most calendar apps. Stops after limit dates,
+    so a far off until costs no more than the dates that will be used.
+    """
+    exceptions = set(exceptions)
+    dates = []
+    step = 0
+    while True:
+        if frequency == ReservationSeries.MONTHLY:
+            day = add_months(first, step)
+            if day is None:
+                step += 1
+                continue
+        else:
+            day = first + timedelta(days=step * (7 if frequency == ReservationSeries.WEEKLY else 1))
+        if day > until or len(dates) == limit:
+            return dates
+        if day not in exceptions:
+            dates.append(day)
+        step += 1
@@ -0,0 +1,126 @@
+from datetime import time, timedelta
+from itertools import groupby
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+from django.db.models.functions import Lower
+from .availability import free_gaps
+from .models import ConferenceRoom, Reservation
+
+# Hours searched each day unless the caller gives their own
+SEARCH_DAY_START = time(8, 0)
+SEARCH_DAY_END = time(18, 0)
+SEARCH_LIMIT = 50
+# Reservation rows fetched from the database at a time while searching
+SEARCH_CHUNK_SIZE = 500
+
+# Most matches one user or room lookup returns
+LOOKUP_LIMIT = 20
+
+
+class FreeSlot:
+    # A gap in one room's day that is long enough for the requested meeting
+    def __init__(self, room, date, start, end):
+        self.room = room
+        self.date = date
+        self.start = start
+        self.end = end
+
+
+def minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def find_free_slots(start_date, end_date, duration, min_capacity=1, location=None,
+                    day_start=SEARCH_DAY_START, day_end=SEARCH_DAY_END, limit=SEARCH_LIMIT):
+    """Find rooms with at least min_capacity seats that are free for `duration` between the dates.
+
+    Slots are ranked by date, then start time, then how closely the room fits the
+    group so big rooms are left for big meetings. Costs two queries however many
+    rooms and days are searched: one for the matching rooms and one for their
+    reservations, which are then swept in sorted order. The reservations are
+    fetched a chunk at a time as the sweep reaches them, so once limit slots
+    are found the rest of the range is never read.
+    """
+    rooms = ConferenceRoom.objects.filter(capacity__gte=min_capacity)
+    if location:
+        rooms = rooms.filter(location=location)
+    rooms = {room.id: room for room in rooms.order_by('capacity', 'id')}
+    if not rooms:
+        return []
+
+    reservations = Reservation.objects.filter(
+        date__range=(start_date, end_date),
+        start_time__lt=day_end,
+        end_time__gt=day_start,
+        room__capacity__gte=min_capacity,
+    )
+    if location:
+        reservations = reservations.filter(room__location=location)
+    rows = (reservations.order_by('date', 'room_id', 'start_time')
+            .values_list('date', 'room_id', 'start_time', 'end_time').iterator(chunk_size=SEARCH_CHUNK_SIZE))
+    # (date, rows) for each booked date in turn, taken as the sweep reaches that date
+    booked_days = groupby(rows, key=lambda row: row[0])
+    next_booked = next(booked_days, None)
+
+    needed = duration.total_seconds() / 60
+    slots = []
+    day = start_date
+    while day <= end_date and len(slots) < limit:
+        # {room_id: [(start, end), ...]} for the day
+        day_booked = {}
+        if next_booked is not None and next_booked[0] == day:
+            day_booked = {room_id: [(start, end) for _, _, start, end in intervals]
+                          for room_id, intervals in groupby(next_booked[1], key=lambda row: row[1])}
+            next_booked = next(booked_days, None)
+        found = []
+        for room_id, room in rooms.items():
+            for start, end in free_gaps(day_booked.get(room_id, []), day_start, day_end):
+                if minutes(end) - minutes(start) >= needed:
+                    found.append(FreeSlot(room, day, start, end))
+        found.sort(key=lambda slot: (slot.start, slot.room.capacity - min_capacity, slot.room.id))
+        slots.extend(found[:limit - len(slots)])
+        day += timedelta(days=1)
+    # Let go of the cursor when the search stopped early
+    rows.close()
+    return slots
+
+
+def prefix_range(alias, term):
+    """Condition for rows whose lowered column, aliased as `alias`, starts with `term`.
+
+    Written as a range so the functional indexes on Lower(column) serve it.
+    LIKE alone only uses an index on PostgreSQL with a pattern operator class.
+    The startswith keeps the match exact where the collation doesn't sort by
+    code point.
+    """
+    term = term.lower()
+    after = term[:-1] + chr(ord(term[-1]) + 1)
+    return Q(**{f'{alias}__gte': term, f'{alias}__lt': after, f'{alias}__startswith': term})
+
+
+def prefix_matches(queryset, field, term, limit):
+    # Up to `limit` rows whose `field` starts with `term` in any case, read in index order
+    return list(queryset.alias(lowered=Lower(field)).filter(prefix_range('lowered', term))
+                .order_by('lowered', 'id')[:limit])
+
+
+def lookup(queryset, fields, term, limit=LOOKUP_LIMIT):
+    # Prefix matches on any of the fields, one indexed query per field, sorted by the first
+    found = {}
+    for field in fields:
+        for row in prefix_matches(queryset, field, term, limit):
+            found.setdefault(row.id, row)
+    return sorted(found.values(), key=lambda row: (getattr(row, fields[0]).lower(), row.id))[:limit]
+
+
+def lookup_users(term, limit=LOOKUP_LIMIT):
+    users = get_user_model().objects.only('id', 'username', 'email')
+    return lookup(users, ['username', 'email'], term, limit)
+
+
+def lookup_rooms(term, limit=LOOKUP_LIMIT):
+    return lookup(ConferenceRoom.objects.all(), ['name', 'location'], term, limit)
+
+
+def user_label(user):
+    return f"{user.username} ({user.email})" if user.email else user.username
@@ -0,0 +1,91 @@
+import threading
+from contextlib import contextmanager, nullcontext
+from django.db import connection, transaction
+from django.db.models import F
+from .availability import has_conflict
+from .models import ConferenceRoom, Reservation, ReservationSeries
+from .signals import reservations_created
+
+
+class BookingConflict(Exception):
+    # Raised when the requested time overlaps an existing reservation,
+    # with the clashing dates when booking a series
+    def __init__(self, dates=()):
+        super().__init__(*dates)
+        self.dates = list(dates)
+
+
+class ReservationService:
+    """Single path for creating and updating reservations.
+
+    The overlap check and the save run in one transaction while holding a lock
+    on the room, so two people can't book the same slot at the same time.
+    """
+
+    # SQLite only allows one writer, so bookings in this process queue here
+    # instead of failing with "database is locked"
+    sqlite_lock = threading.Lock()
+
+    @staticmethod
+    def lock_rooms(room_ids):
+        if connection.features.has_select_for_update:
+            # PostgreSQL: row locks on the rooms until the transaction ends,
+            # taken in id order so two bulk bookings can't deadlock
+            list(ConferenceRoom.objects.select_for_update().filter(pk__in=room_ids).order_by('pk').values_list('pk'))
+        else:
+            # SQLite has no row locks, so take the database write lock instead
+            ConferenceRoom.objects.filter(pk__in=room_ids).update(name=F('name'))
+
+    @classmethod
+    @contextmanager
+    def booking(cls, *room_ids):
+        # A transaction that holds the booking lock on the given rooms
+        process_lock = cls.sqlite_lock if connection.vendor == 'sqlite' else nullcontext()
+        with process_lock, transaction.atomic():
+            cls.lock_rooms(room_ids)
+            yield
+
+    @classmethod
+    def book(cls, reservation):
+        # Save a new or edited reservation, raising BookingConflict on overlap
+        with cls.booking(reservation.room_id):
+            if has_conflict(reservation.room_id, reservation.date, reservation.start_time,
+                            reservation.end_time, exclude_id=reservation.pk):
+                raise BookingConflict()
+            reservation.save()
+        return reservation
+
+    @classmethod
+    def book_series(cls, reservation, frequency, until, dates):
+        """Book `reservation` on every date in `dates` as one repeating series.
+
+        One range query finds every clash and one bulk insert saves all the
+        occurrences, so nothing is booked unless every date is free. Raises
+        BookingConflict listing the clashing dates.
+        """
+        dates = sorted(set(dates))
+        with cls.booking(reservation.room_id):
+            # A date range keeps the query small however many dates there are
+            clashes = set(Reservation.objects.filter(
+                room_id=reservation.room_id,
+                date__range=(dates[0], dates[-1]),
+                start_time__lt=reservation.end_time,
+                end_time__gt=reservation.start_time,
+            ).values_list('date', flat=True)) & set(dates)
+            if clashes:
+                raise BookingConflict(sorted(clashes))
+
+            series = ReservationSeries.objects.create(user=reservation.user, room_id=reservation.room_id,
+                                                      frequency=frequency, until=until)
+            occurrences = [Reservation(
+                user=reservation.user,
+                room_id=reservation.room_id,
+                date=day,
+                start_time=reservation.start_time,
+                end_time=reservation.end_time,
+                start_at=Reservation.combine_start(day, reservation.start_time),
+                series=series,
+            ) for day in dates]
+            occurrences = Reservation.objects.bulk_create(occurrences)
+            reservations_created(occurrences)
+        return occurrences
@@ -0,0 +1,116 @@
+from contextvars import ContextVar
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .auth import forget_users
+from .availability import invalidate_date, invalidate_all
+from .events import publish_resync
+from .feeds import record_changes, record_room_changes
+from .models import ConferenceRoom, Reservation, ReservationChange
+from .occupancy import refresh_occupancy
+
+# Reservations deleted per transaction by delete_reservations
+RESERVATION_DELETE_BATCH = 1000
+
+# Set while delete_reservations deletes a batch, so post_delete leaves the
+# bookkeeping to it
+deleting_batch = ContextVar('deleting_batch', default=False)
+
+
+def invalidate_dates(*dates):
+    # Clear now, and again after commit in case a reader cached the old rows in between
+    dates = {d for d in dates if d is not None}
+
+    def clear():
+        for d in dates:
+            invalidate_date(d)
+
+    clear()
+    transaction.on_commit(clear)
+
+
+def reservations_created(reservations):
+    # bulk_create doesn't send post_save, so bulk bookings and imports call this instead
+    invalidate_dates(*{reservation.date for reservation in reservations})
+    record_changes(ReservationChange.SAVED, reservations)
+    refresh_occupancy({(reservation.room_id, reservation.date) for reservation in reservations})
+
+
+def delete_reservations(reservations, record=True, refresh=True):
+    """Delete reservations RESERVATION_DELETE_BATCH at a time, each batch in its own transaction.
+
+    post_delete would clear the cache, log a change and recount occupancy for
+    every reservation. Here that is done once per batch, and live clients are
+    told to reload the affected dates. record=False skips the change feed, for
+    users being deleted, and refresh=False the occupancy, for rooms being deleted.
+    Returns how many were deleted.
+    """
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            batch = list(reservations.order_by('id').only('id', 'user_id', 'room_id', 'date')[:RESERVATION_DELETE_BATCH])
+            if not batch:
+                return deleted
+            token = deleting_batch.set(True)
+            try:
+                Reservation.objects.filter(id__in=[reservation.id for reservation in batch]).delete()
+            finally:
+                deleting_batch.reset(token)
+            dates = {reservation.date for reservation in batch}
+            invalidate_dates(*dates)
+            if record:
+                record_changes(ReservationChange.DELETED, batch)
+            if refresh:
+                refresh_occupancy({(reservation.room_id, reservation.date) for reservation in batch})
+            publish_resync(dates)
+        deleted += len(batch)
+
+
+@receiver(post_save, sender=Reservation)
+def reservation_saved(sender, instance, **kwargs):
+    # An edit can move a reservation to another date, so clear both
+    invalidate_dates(instance.date, instance.loaded_date)
+    refresh_occupancy({(instance.room_id, instance.date), (instance.loaded_room_id, instance.loaded_date)})
+    instance.loaded_date = instance.date
+    instance.loaded_room_id = instance.room_id
+    record_changes(ReservationChange.SAVED, [instance])
+
+
+@receiver(post_delete, sender=Reservation)
+def reservation_deleted(sender, instance, origin=None, **kwargs):
+    if deleting_batch.get():
+        return
+    invalidate_dates(instance.date, instance.loaded_date)
+    # A deleted user's change feed goes with them, so there is no one to tell
+    if not isinstance(origin, User):
+        record_changes(ReservationChange.DELETED, [instance])
+    # Deleting a room removes its occupancy rows along with its reservations
+    if not isinstance(origin, ConferenceRoom):
+        refresh_occupancy({(instance.room_id, instance.date)})
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    # Drop the signed-in user cache now, and again after commit in case a request
+    # cached the old row in between
+    forget_users(instance.id)
+    transaction.on_commit(lambda: forget_users(instance.id))
+
+
+@receiver(post_save, sender=ConferenceRoom)
+@receiver(post_delete, sender=ConferenceRoom)
+def room_changed(sender, instance, **kwargs):
+    invalidate_all()
+    transaction.on_commit(invalidate_all)
+
+
+@receiver(post_save, sender=ConferenceRoom)
+def room_saved(sender, instance, created, **kwargs):
+    # Calendars show the room's name and location, a capacity edit changes nothing there
+    changed = (instance.name, instance.location) != (instance.loaded_name, instance.loaded_location)
+    if not created and changed:
+        record_room_changes(instance)
+    instance.loaded_name = instance.name
+    instance.loaded_location = instance.location
@@ -0,0 +1,218 @@
+import gzip
+import json
+import mimetypes
+import os
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import MiddlewareNotUsed, SuspiciousFileOperation
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+# Text files worth compressing, and the size below which it isn't worth it
+COMPRESS_EXTENSIONS = ('.css', '.js', '.svg', '.txt', '.json', '.map', '.html', '.xml')
+COMPRESS_MIN_SIZE = 256
+
+# Hashed names never change content, so browsers may keep them for a year.
+# Unhashed names can change on the next deploy
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+STATIC_MAX_AGE = 60
+
+
+def encoders():
+    # (suffix, Content-Encoding, compress), best first. brotli is optional
+    found = [('.gz', 'gzip', lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+    try:
+        import brotli
+    except ImportError:
+        return found
+    return [('.br', 'br', brotli.compress)] + found
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """ManifestStaticFilesStorage that also writes .gz copies of text files at
+    collectstatic, and .br copies when the brotli package is installed.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if not dry_run:
+            self.compress_all()
+
+    def compress_all(self):
+        codecs = encoders()
+        for root, _, files in os.walk(self.location):
+            for filename in files:
+                if filename.endswith(COMPRESS_EXTENSIONS):
+                    compress_file(os.path.join(root, filename), codecs)
+
+    def stored_name(self, name):
+        # Before collectstatic has written a manifest, as in tests, link the plain name
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+
+def compress_file(path, codecs):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return
+    for suffix, _, compress in codecs:
+        target = path + suffix
+        if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+            continue
+        compressed = compress(data)
+        # Only kept if it saves something, the middleware sends the original otherwise
+        if len(compressed) < len(data) * 0.95:
+            with open(target, 'wb') as f:
+                f.write(compressed)
+
+
+class StaticFile:
+    __slots__ = ('path', 'content_type', 'mtime', 'cache_control', 'encoded')
+
+    def __init__(self, path, immutable):
+        self.path = path
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.mtime = os.path.getmtime(path)
+        max_age = IMMUTABLE_MAX_AGE if immutable else STATIC_MAX_AGE
+        self.cache_control = f"public, max-age={max_age}" + (", immutable" if immutable else "")
+        # [(Content-Encoding, path)] of the precompressed copies, best first
+        self.encoded = [(encoding, path + suffix) for suffix, encoding, _ in
+                        [('.br', 'br', None), ('.gz', 'gzip', None)] if os.path.exists(path + suffix)]
+
+
+def accepted_encodings(header):
+    """{content-coding: q} from an Accept-Encoding header, e.g. {'br': 0.0, 'gzip': 1.0}."""
+    accepted = {}
+    for item in header.split(','):
+        coding, *params = item.split(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def choose_encoding(static_file, header):
+    # The precompressed copy the client rates highest, ours best first on a tie,
+    # or (None, original) when it accepts none of them
+    accepted = accepted_encodings(header)
+    best = (0.0, None, static_file.path)
+    for encoding, path in static_file.encoded:
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+        if q > best[0]:
+            best = (q, encoding, path)
+    return best[1], best[2]
+
+
+def read_manifest(root):
+    """(original names, hashed names) from the staticfiles.json collectstatic wrote,
+    or None when there is no manifest.
+    """
+    try:
+        with open(os.path.join(root, 'staticfiles.json')) as f:
+            paths = json.load(f).get('paths', {})
+    except (OSError, ValueError):
+        return None
+    return set(paths), set(paths.values())
+
+
+class StaticFilesMiddleware:
+    """Serves the files in STATIC_ROOT before the rest of the middleware runs.
+
+    Only the manifest is read at startup. A file is looked up the first time
+    it is asked for and kept, so later requests cost a dictionary lookup, and
+    names the manifest doesn't list are turned away without touching the disk.
+    Put it first in MIDDLEWARE and run collectstatic before deploying. Turn it off with SERVE_STATIC =
+    False when a web server or CDN serves the files instead.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'SERVE_STATIC', True) or not settings.STATIC_ROOT:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.prefix = settings.STATIC_URL
+        self.root = settings.STATIC_ROOT
+        self.manifest = read_manifest(self.root)
+        self.files = {}
+        # Under ASGI stay async, so async views like the availability stream
+        # aren't moved onto a worker thread
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        static_file = self.find(request)
+        if static_file is not None:
+            return self.serve(request, static_file)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        static_file = self.find(request)
+        if static_file is not None:
+            # Read on a thread. FileResponse's file iterator is sync, which ASGI
+            # would copy into a list with a warning on every request
+            return await sync_to_async(self.serve, thread_sensitive=False)(request, static_file, stream=False)
+        return await self.get_response(request)
+
+    def find(self, request):
+        if request.method in ('GET', 'HEAD') and request.path_info.startswith(self.prefix):
+            name = request.path_info[len(self.prefix):]
+            static_file = self.files.get(name)
+            if static_file is None:
+                static_file = self.load(name)
+            return static_file
+        return None
+
+    def load(self, name):
+        original, hashed = self.manifest or ((), ())
+        if self.manifest is not None and name not in original and name not in hashed:
+            return None
+        if name.endswith(('.gz', '.br')) or name == 'staticfiles.json':
+            return None
+        try:
+            path = safe_join(self.root, name)
+        except SuspiciousFileOperation:
+            return None
+        if not os.path.isfile(path):
+            return None
+        static_file = self.files[name] = StaticFile(path, name in hashed)
+        return static_file
+
+    def serve(self, request, static_file, stream=True):
+        if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), static_file.mtime):
+            response = HttpResponseNotModified()
+        else:
+            encoding, path = choose_encoding(static_file, request.headers.get('Accept-Encoding', ''))
+            if stream:
+                response = FileResponse(open(path, 'rb'), content_type=static_file.content_type)
+                # FileResponse names the file it opened, which may be the .gz copy
+                response.headers.pop('Content-Disposition', None)
+            else:
+                with open(path, 'rb') as f:
+                    response = HttpResponse(f.read(), content_type=static_file.content_type)
+            if encoding:
+                response['Content-Encoding'] = encoding
+            response['Last-Modified'] = http_date(static_file.mtime)
+        if static_file.encoded:
+            response['Vary'] = 'Accept-Encoding'
+        response['Cache-Control'] = static_file.cache_control
+        return response
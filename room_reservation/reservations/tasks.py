@@ -1,31 +1,228 @@
 from django.utils import timezone
-from .models import Reservation
-from datetime import datetime, timedelta
+from .models import CancelledBooking, Reservation, OutboxEmail, ReservationChange, UserJob
+from . import accounts
+from .feeds import CHANGE_RETENTION
+from datetime import timedelta
 from celery import shared_task
-from django.core.mail import send_mail
+from django.conf import settings
+from django.core.mail import get_connection, EmailMessage
+from django.contrib.sessions.backends.db import SessionStore as DatabaseSessionStore
+from django.db import transaction
+from django.db.models import Q
+from importlib import import_module
+from itertools import groupby, islice
 import logging
 logger = logging.getLogger(__name__)
 
+# Outbox retry policy: wait 1, 2, 4, 8... minutes between attempts, then give up
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_BACKOFF = timedelta(minutes=1)
+OUTBOX_BATCH_SIZE = 50
+# How long a claimed batch is left to one worker before others may send it
+OUTBOX_LEASE = timedelta(minutes=5)
+
+# Reminders are sent for reservations starting within this window
+REMINDER_WINDOW = timedelta(hours=1)
+REMINDER_BATCH_SIZE = 500
+
+# Expired sessions deleted per query
+SESSION_PRUNE_BATCH_SIZE = 5000
+
+# Bulk notifications go out this many messages per send_messages call
+NOTIFY_CHUNK_SIZE = 100
+
+
+@shared_task
+def drain_email_outbox():
+    # Send a batch of the pending outbox emails that are due, over a single SMTP connection
+    now = timezone.now()
+    sent = failed = 0
+    # Claim the batch in a short transaction. Pushing next_attempt_at out acts as
+    # a lease: other workers skip the rows while they are sent, and if this worker
+    # dies they are due again once it runs out. skip_locked lets several workers
+    # drain the outbox at the same time
+    with transaction.atomic():
+        emails = list(OutboxEmail.objects.select_for_update(skip_locked=True).filter(
+            status=OutboxEmail.PENDING,
+            next_attempt_at__lte=now
+        ).order_by('id')[:OUTBOX_BATCH_SIZE])
+        if not emails:
+            return 0
+        OutboxEmail.objects.filter(id__in=[email.id for email in emails]).update(next_attempt_at=now + OUTBOX_LEASE)
+
+    # No transaction or row locks are held while talking to the SMTP server
+    connection = get_connection()
+    for email in emails:
+        try:
+            EmailMessage(email.subject, email.body, settings.DEFAULT_FROM_EMAIL,
+                         [email.to_email], connection=connection).send()
+            email.status = OutboxEmail.SENT
+            email.sent_at = timezone.now()
+            sent += 1
+        except Exception as e:
+            logger.error(f"failed to send outbox email {email.id}: {str(e)}")
+            email.attempts += 1
+            email.last_error = str(e)
+            if email.attempts >= OUTBOX_MAX_ATTEMPTS:
+                email.status = OutboxEmail.FAILED
+            else:
+                email.next_attempt_at = now + OUTBOX_BACKOFF * 2 ** (email.attempts - 1)
+            failed += 1
+    connection.close()
+    OutboxEmail.objects.bulk_update(emails, ['status', 'sent_at', 'attempts', 'last_error', 'next_attempt_at'])
+
+    if len(emails) == OUTBOX_BATCH_SIZE:
+        # There may be more waiting, keep going
+        drain_email_outbox.delay()
+    # Failed emails are picked up again by the drain-email-outbox beat job once due
+    return sent
+
+
+def send_in_chunks(task, emails, total):
+    # Send the messages in fixed size chunks over one reused SMTP connection,
+    # reporting progress on the task after every chunk
+    sent = 0
+    done = 0
+    connection = get_connection()
+    emails = iter(emails)
+    while True:
+        chunk = list(islice(emails, NOTIFY_CHUNK_SIZE))
+        if not chunk:
+            break
+        try:
+            sent += connection.send_messages(chunk) or 0
+        except Exception as e:
+            logger.error(f"failed to send notification chunk: {str(e)}")
+        done += len(chunk)
+        task.update_state(state='PROGRESS', meta={'done': done, 'sent': sent, 'total': total})
+    connection.close()
+    return {'done': done, 'sent': sent, 'total': total}
+
+
+@shared_task(bind=True)
+def notify_room_renamed(self, room_id, old_room_name):
+    # Tell everyone with a reservation for the room that its name has changed
+    reservations = Reservation.objects.filter(room_id=room_id).exclude(user__email='').select_related('user', 'room')
+
+    def build():
+        for res in reservations.iterator(chunk_size=NOTIFY_CHUNK_SIZE):
+            subject = f'Room Name Changed - {res.room.name}'
+            message = f"""
+                    Hello {res.user.username},
+                    
+                    Please note that the room you have a reservation for has been updated:
+                    
+                    Old Room Name: {old_room_name}
+                    New Room Name: {res.room.name}
+                    Date: {res.date.strftime('%d-%m-%Y')}
+                    Time: {res.start_time.strftime('%I:%M %p')}-{res.end_time.strftime('%I:%M %p')}
+                    
+                    Thank you!
+                    Te Whare Runaga Conference Room Booking System staff
+                    """
+            yield EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [res.user.email])
+
+    return send_in_chunks(self, build(), reservations.count())
+
+
+@shared_task(bind=True)
+def notify_room_deleted(self, room_id):
+    # Email everyone who had a booking in the deleted room, from the copies
+    # delete_room kept, then drop the copies
+    bookings = CancelledBooking.objects.filter(room_id=room_id).order_by('id')
+
+    def build():
+        for booking in bookings.iterator(chunk_size=NOTIFY_CHUNK_SIZE):
+            subject = f'Room Reservation Canceled - {booking.room_name}'
+            message = f"""
+            Hello {booking.username},
+            
+            Unfortunately, the room you have a reservation for has been deleted by our staff.
+            As a result of this, your reservation has been canceled.
+            
+            Date: {booking.date.strftime('%d-%m-%Y')}
+            Time: {booking.start_time.strftime('%I:%M %p')}-{booking.end_time.strftime('%I:%M %p')}
+            
+            Please choose another one of our rooms that may suit your needs.
+            Thank you!
+            Te Whare Runaga Conference Room Booking System staff
+            """
+            yield EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [booking.email])
+
+    result = send_in_chunks(self, build(), bookings.count())
+    bookings.delete()
+    return result
+
+
+@shared_task(bind=True)
+def notify_user_deleted(self, bookings):
+    # bookings is a list of [email, username, room, date, start, end] captured before
+    # the users and their reservations were deleted, in user order. One email each
+    def build():
+        for (user_email, username), rows in groupby(bookings, key=lambda row: (row[0], row[1])):
+            lines = '\n'.join(f"            {room}: {date} {start}-{end}" for _, _, room, date, start, end in rows)
+            subject = 'Room Reservations Canceled'
+            message = f"""
+            Hello {username},
+            
+            Your account has been removed by our staff, and with it these reservations:
+            
+{lines}
+            
+            Thank you!
+            Te Whare Runaga Conference Room Booking System staff
+            """
+            yield EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [user_email])
+
+    return send_in_chunks(self, build(), len({row[0] for row in bookings}))
+
 
 @shared_task
 def send_reminder_emails():
    logger.info("Running send_reminder_emails task")
    now = timezone.now()
-   one_hour_from_now = now + timedelta(hours=1)
+   window_end = now + REMINDER_WINDOW
+   sent = 0
+   after = None
+
+   # A batch at a time until one comes back short, so a busy hour is drained in one run
+   while True:
+       batch_sent, claimed, after = send_reminder_batch(now, window_end, after)
+       sent += batch_sent
+       if claimed < REMINDER_BATCH_SIZE:
+           return sent
 
-   # Fetch all reservations that haven't had reminders sent
-   reservations = Reservation.objects.filter(reminder_sent=False)
 
-   for reservation in reservations:
-       # combine the date and time to get the exact datetime of the reservation
-       reservation_start = datetime.combine(reservation.date, reservation.start_time)
+def send_reminder_batch(now, window_end, after):
+   """Send the reminders for one batch and return (sent, reservations claimed, last (start_at, id)).
 
-       # check if the reservation is within the next hour
-       if now <= reservation_start <= one_hour_from_now:
+   Batches follow on from `after`, so a reservation whose email failed is left
+   for the next run rather than claimed again by this one.
+   """
+   sent_ids = []
+   handled_ids = []
+
+   with transaction.atomic():
+       # Only look at reservations starting within the next hour that still need a reminder.
+       # skip_locked means parallel workers each claim different rows instead of waiting
+       reservations = Reservation.objects.select_for_update(skip_locked=True, of=('self',)).filter(
+           reminder_sent=False,
+           start_at__gte=now,
+           start_at__lte=window_end
+       )
+       if after:
+           reservations = reservations.filter(Q(start_at__gt=after[0]) | Q(start_at=after[0], id__gt=after[1]))
+       reservations = list(reservations.select_related('user', 'room').order_by('start_at', 'id')[:REMINDER_BATCH_SIZE])
+
+       connection = get_connection()
+       for reservation in reservations:
            user_email = reservation.user.email
-           if user_email:
-               subject = f'Reminder: Your reservation for {reservation.room.name}'
-               message = f"""Reminder: Your reservation for {reservation.room.name} starts in one hour.
+           if not user_email:
+               # Nobody to remind, marked so it isn't claimed again every run
+               handled_ids.append(reservation.id)
+               continue
+           subject = f'Reminder: Your reservation for {reservation.room.name}'
+           message = f"""Reminder: Your reservation for {reservation.room.name} starts in one hour.
                
                Room: {reservation.room.name}
                Date: {reservation.date.strftime('%d-%m-%Y')}
@@ -33,16 +230,63 @@ def send_reminder_emails():
                
                Thank you!
                """
-               try:
-                   send_mail(
-                       subject,
-                       message,
-                       'quingillanders@gmail.com',
-                       [user_email],
-                       fail_silently=False,
-                   )
-                   # Mark the reminder as set
-                   reservation.reminder_sent = True
-                   reservation.save()
-               except Exception as e:
-                   logger.error(f"Failed to send reminder email: {str(e)}")
+           try:
+               EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [user_email], connection=connection).send()
+               sent_ids.append(reservation.id)
+           except Exception as e:
+               logger.error(f"Failed to send reminder email: {str(e)}")
+       connection.close()
+
+       # Mark the reminders as sent in one query
+       Reservation.objects.filter(id__in=sent_ids + handled_ids).update(reminder_sent=True)
+
+   last = (reservations[-1].start_at, reservations[-1].id) if reservations else after
+   return len(sent_ids), len(reservations), last
+
+
+@shared_task
+def prune_reservation_changes():
+    # Calendar clients that last synced before this have to start over anyway
+    cutoff = timezone.now() - CHANGE_RETENTION
+    deleted, _ = ReservationChange.objects.filter(changed_at__lt=cutoff).delete()
+    logger.info(f"pruned {deleted} reservation changes")
+
+
+@shared_task
+def prune_expired_sessions():
+    # Sessions that expired without the user logging out stay in the database until
+    # removed. Deleted a batch at a time so a large backlog doesn't lock the table for long
+    store = import_module(settings.SESSION_ENGINE).SessionStore
+    if not issubclass(store, DatabaseSessionStore):
+        # Nothing is stored server side, or the store cleans up after itself
+        store.clear_expired()
+        return 0
+    sessions = store.get_model_class().objects
+    deleted = 0
+    while True:
+        keys = list(sessions.filter(expire_date__lt=timezone.now())
+                    .values_list('session_key', flat=True)[:SESSION_PRUNE_BATCH_SIZE])
+        if not keys:
+            break
+        deleted += sessions.filter(session_key__in=keys).delete()[0]
+    logger.info(f"pruned {deleted} expired sessions")
+    return deleted
+
+
+@shared_task
+def run_user_job(job_id):
+    # A bulk deactivate or delete from the user directory. A retried job carries
+    # on from the last chunk it finished
+    job = UserJob.objects.filter(id=job_id).exclude(status__in=[UserJob.DONE, UserJob.FAILED]).first()
+    if job is None:
+        return 0
+    try:
+        accounts.run_user_job(job)
+    except Exception as e:
+        logger.error(f"user job {job.id} failed: {str(e)}")
+        job.status = UserJob.FAILED
+        job.error = str(e)
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at'])
+        raise
+    return job.done
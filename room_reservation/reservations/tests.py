@@ -1,3 +1,1777 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time as clock
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, time, timedelta
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from unittest import mock
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from io import StringIO
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.management import call_command, CommandError
+from django.db import connection, connections
+from django.db.models import QuerySet
+from django.http import HttpResponse
+from django.test import AsyncClient, AsyncRequestFactory, Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.template import engines
+from django.template.loaders.cached import Loader as CachedLoader
+from django.utils import timezone
+from room_reservation.celery import app as celery_app
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from .availability import availability_for_date, has_conflict, get_cache, CacheStats, DAY_START, DAY_END
+from .models import CancelledBooking, ConferenceRoom, Reservation, ReservationSeries, ReservationChange, OutboxEmail, RoomDayOccupancy, UserJob
+from .services import ReservationService, BookingConflict
+from .tasks import drain_email_outbox, send_reminder_emails, prune_reservation_changes, prune_expired_sessions, \
+    notify_room_deleted
+from .accounts import deactivate_users, delete_users
+from .auth import forget_users, get_user_cache, user_key
+from .search import find_free_slots
+from .fragments import get_row_cache
+from .occupancy import OccupancyGrid, slot_mask, runs, utilization, least_busy_rooms
+from .recurrence import occurrence_dates
+from . import transfer, feeds
+from .email_backends import TimedSMTPBackend
+from .metrics import MetricsMiddleware, RequestMetrics, current_metrics, registry
+from .staticfiles import StaticFilesMiddleware, accepted_encodings
+from benchmarks import generators, runner
+from benchmarks.scenarios import (MetricsOverhead, PageBytes, ReminderEmails, RenderReservationTable, RoomListCold, UserList,
+                                  ViewQueries)
+from .events import InProcessBroker, RedisBroker
+from .listing import decode_cursor, encode_cursor
+from . import api, events
 
-# Create your tests here.
+
+class EagerTasksMixin:
+    # Run Celery tasks in the test process instead of sending them to the broker
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.addClassCleanup(setattr, celery_app.conf, 'task_always_eager', celery_app.conf.task_always_eager)
+        celery_app.conf.task_always_eager = True
+
+
+class AvailabilityTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'pass12345')
+        self.room = ConferenceRoom.objects.create(name='Kauri', location='Level 1', capacity=8)
+        self.day = date(2030, 1, 15)
+
+    def book(self, room, start, end, day=None):
+        return Reservation.objects.create(user=self.user, room=room, date=day or self.day,
+                                          start_time=start, end_time=end)
+
+    def test_booked_intervals_and_free_gaps(self):
+        self.book(self.room, time(13, 0), time(14, 0))
+        self.book(self.room, time(9, 0), time(10, 30))
+        availability = availability_for_date(self.day)[0]
+        self.assertFalse(availability.is_available)
+        self.assertEqual(availability.booked, [(time(9, 0), time(10, 30)), (time(13, 0), time(14, 0))])
+        self.assertEqual(availability.free, [
+            (DAY_START, time(9, 0)),
+            (time(10, 30), time(13, 0)),
+            (time(14, 0), DAY_END),
+        ])
+        self.assertEqual(availability.booking_times[0], {'start': '9:00 AM', 'end': '10:30 AM'})
+
+    def test_other_dates_are_ignored(self):
+        self.book(self.room, time(9, 0), time(10, 0), day=date(2030, 1, 16))
+        availability = availability_for_date(self.day)[0]
+        self.assertTrue(availability.is_available)
+        self.assertEqual(availability.free, [(DAY_START, DAY_END)])
+
+    def test_has_conflict(self):
+        reservation = self.book(self.room, time(9, 0), time(10, 0))
+        self.assertTrue(has_conflict(self.room, self.day, time(9, 30), time(11, 0)))
+        self.assertFalse(has_conflict(self.room, self.day, time(10, 0), time(11, 0)))
+        self.assertFalse(has_conflict(self.room, self.day, time(9, 30), time(11, 0), exclude_id=reservation.id))
+
+    def test_room_list_query_count_is_constant(self):
+        # The number of queries must not grow with the number of rooms
+        self.client.force_login(self.user)
+        url = reverse('reservations:room_list') + '?date=2030-01-15'
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            return len(ctx)
+
+        self.book(self.room, time(9, 0), time(10, 0))
+        self.client.get(reverse('reservations:my_reservations'))  # caches the signed-in user
+        baseline = count_queries()
+        for i in range(20):
+            room = ConferenceRoom.objects.create(name=f'Room {i}', location='Level 2', capacity=4)
+            self.book(room, time(11, 0), time(12, 0))
+        self.assertEqual(count_queries(), baseline)
+
+    def test_make_reservation_shows_room_bookings(self):
+        self.book(self.room, time(9, 0), time(10, 0))
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('reservations:make_reservation'),
+                                   {'room': self.room.id, 'date': '2030-01-15'})
+        self.assertContains(response, 'Kauri is booked for:')
+        self.assertContains(response, '9:00 AM - 10:00 AM')
+
+
+class ReservationServiceTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('bob', 'bob@example.com', 'pass12345')
+        self.room = ConferenceRoom.objects.create(name='Rimu', location='Level 3', capacity=6)
+
+    def reservation(self, start, end):
+        return Reservation(user=self.user, room=self.room, date=date(2030, 2, 1), start_time=start, end_time=end)
+
+    def test_book_rejects_overlap(self):
+        ReservationService.book(self.reservation(time(9, 0), time(10, 0)))
+        with self.assertRaises(BookingConflict):
+            ReservationService.book(self.reservation(time(9, 30), time(10, 30)))
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_book_allows_editing_own_slot(self):
+        reservation = ReservationService.book(self.reservation(time(9, 0), time(10, 0)))
+        reservation.end_time = time(10, 30)
+        ReservationService.book(reservation)
+        self.assertEqual(Reservation.objects.get().end_time, time(10, 30))
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    def test_parallel_bookings_never_double_book(self):
+        user = User.objects.create_user('carol', 'carol@example.com', 'pass12345')
+        rooms = [ConferenceRoom.objects.create(name=f'Room {i}', location='Level 4', capacity=4) for i in range(4)]
+        day = date(2030, 3, 1)
+
+        def attempt(i):
+            # Every room gets many requests for the same few overlapping slots
+            room = rooms[i % len(rooms)]
+            start = time(9 + i % 3, 0)
+            reservation = Reservation(user=user, room=room, date=day, start_time=start, end_time=time(start.hour + 1, 30))
+            began = clock.monotonic()
+            try:
+                ReservationService.book(reservation)
+                booked = True
+            except BookingConflict:
+                booked = False
+            finally:
+                connections.close_all()
+            return booked, clock.monotonic() - began
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            results = list(pool.map(attempt, range(300)))
+
+        for room in rooms:
+            booked = list(Reservation.objects.filter(room=room, date=day).order_by('start_time'))
+            for earlier, later in zip(booked, booked[1:]):
+                self.assertLessEqual(earlier.end_time, later.start_time)
+        self.assertEqual(sum(booked for booked, _ in results), Reservation.objects.count())
+        self.assertLess(max(elapsed for _, elapsed in results), 10)
+
+
+class EmailOutboxTests(EagerTasksMixin, TestCase):
+    def setUp(self):
+        # Run Celery tasks in process so the whole pipeline runs against locmem mail
+        self.user = User.objects.create_user('dave', 'dave@example.com', 'pass12345')
+        self.room = ConferenceRoom.objects.create(name='Totara', location='Level 5', capacity=10)
+        self.client.force_login(self.user)
+
+    def reserve(self, start='09:00', end='10:00'):
+        return self.client.post(reverse('reservations:make_reservation'), {
+            'room': self.room.id, 'date': '2030-04-01', 'start_time': start, 'end_time': end,
+        })
+
+    def test_booking_queues_email_and_worker_sends_it(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.reserve()
+        # Nothing is sent during the request itself
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.status, OutboxEmail.PENDING)
+        self.assertEqual(email.to_email, 'dave@example.com')
+
+        for callback in callbacks:
+            callback()
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.SENT)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, 'Room Reservation Confirmation - Totara')
+
+    def test_claimed_emails_are_left_to_their_worker(self):
+        OutboxEmail.objects.create(subject='Hi', body='Hello', to_email='dave@example.com')
+        drained = []
+
+        def send(message):
+            # Another worker draining while this one talks to the SMTP server
+            drained.append(drain_email_outbox.apply().result)
+            return 1
+
+        with mock.patch('reservations.tasks.EmailMessage.send', autospec=True, side_effect=send):
+            self.assertEqual(drain_email_outbox.apply().result, 1)
+        self.assertEqual(drained, [0])
+        self.assertEqual(OutboxEmail.objects.get().status, OutboxEmail.SENT)
+
+    def test_conflicting_booking_queues_nothing(self):
+        self.reserve()
+        self.reserve('09:30', '10:30')
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+
+    def test_cancel_queues_email(self):
+        self.reserve()
+        reservation = Reservation.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('reservations:cancel_reservation', args=[reservation.id]))
+        self.assertFalse(Reservation.objects.exists())
+        self.assertEqual([m.subject for m in mail.outbox][-1], 'Room Reservation Canceled - Totara')
+
+    def test_failed_send_backs_off(self):
+        OutboxEmail.objects.create(subject='Hi', body='Hello', to_email='dave@example.com')
+        with mock.patch('reservations.tasks.EmailMessage.send', side_effect=OSError('smtp down')):
+            result = drain_email_outbox.apply()
+        # Left for the beat job rather than retried on a fixed countdown
+        self.assertEqual(result.state, 'SUCCESS')
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.status, OutboxEmail.PENDING)
+        self.assertEqual(email.attempts, 1)
+        self.assertGreater(email.next_attempt_at, timezone.now())
+
+        # Not due yet, so the next drain leaves it alone
+        drain_email_outbox.apply()
+        self.assertEqual(len(mail.outbox), 0)
+
+
+class RoomNotificationTests(EagerTasksMixin, TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('erin', 'erin@example.com', 'pass12345', is_staff=True)
+        self.room = ConferenceRoom.objects.create(name='Matai', location='Level 6', capacity=12)
+        for i in range(5):
+            user = User.objects.create_user(f'user{i}', f'user{i}@example.com', 'pass12345')
+            Reservation.objects.create(user=user, room=self.room, date=date(2030, 5, 1),
+                                       start_time=time(8 + i, 0), end_time=time(8 + i, 30))
+        self.client.force_login(self.staff)
+
+    def test_rename_notifies_in_background_over_one_connection(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(reverse('reservations:edit_room', args=[self.room.id]),
+                             {'name': 'Matai Suite', 'location': 'Level 6', 'capacity': 12})
+        self.assertEqual(len(mail.outbox), 0)
+
+        with mock.patch('reservations.tasks.get_connection', wraps=mail.get_connection) as get_connection:
+            with self.assertNumQueries(2):
+                for callback in callbacks:
+                    callback()
+        get_connection.assert_called_once()
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(mail.outbox[0].subject, 'Room Name Changed - Matai Suite')
+
+    def test_delete_notifies_every_booking(self):
+        room_id = self.room.id
+        with self.captureOnCommitCallbacks() as callbacks, \
+                mock.patch('reservations.views.RESERVATION_DELETE_BATCH', 2):
+            self.client.post(reverse('reservations:delete_room', args=[room_id]))
+        self.assertFalse(Reservation.objects.exists())
+        self.assertEqual(CancelledBooking.objects.filter(room_id=room_id).count(), 5)
+
+        # The task is only given the room, and reads the bookings itself
+        with mock.patch.object(notify_room_deleted, 'apply') as apply:
+            for callback in callbacks:
+                callback()
+        apply.assert_called_once_with(args=(room_id,))
+        notify_room_deleted.apply(args=(room_id,))
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), [f'user{i}@example.com' for i in range(5)])
+        self.assertEqual(mail.outbox[0].subject, 'Room Reservation Canceled - Matai')
+        self.assertFalse(CancelledBooking.objects.exists())
+
+    def test_delete_queries_do_not_grow_with_bookings(self):
+        def delete_queries(room):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(reverse('reservations:delete_room', args=[room.id]))
+            return len(queries)
+
+        # Warm the signed-in user cache
+        self.client.get(reverse('reservations:room_list'))
+        few = delete_queries(self.room)
+        room = ConferenceRoom.objects.create(name='Rimu', location='Level 6', capacity=12)
+        Reservation.objects.bulk_create([
+            Reservation(user=self.staff, room=room, date=date(2030, 5, 1) + timedelta(days=i),
+                        start_time=time(9, 0), end_time=time(10, 0))
+            for i in range(40)
+        ])
+        self.assertEqual(delete_queries(room), few)
+        self.assertEqual(ReservationChange.objects.filter(action=ReservationChange.DELETED).count(), 45)
+
+
+class ReminderTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('frank', 'frank@example.com', 'pass12345')
+        self.room = ConferenceRoom.objects.create(name='Kowhai', location='Level 7', capacity=4)
+
+    def book_at(self, start, user=None):
+        start = timezone.localtime(start)
+        return Reservation.objects.create(user=user or self.user, room=self.room, date=start.date(),
+                                          start_time=start.time(), end_time=(start + timedelta(minutes=30)).time())
+
+    def test_start_at_follows_date_and_time(self):
+        reservation = Reservation.objects.create(user=self.user, room=self.room, date=date(2030, 6, 1),
+                                                 start_time=time(9, 0), end_time=time(10, 0))
+        self.assertEqual(reservation.start_at, timezone.make_aware(timezone.datetime(2030, 6, 1, 9, 0)))
+        reservation.start_time = time(11, 0)
+        reservation.save(update_fields=['start_time'])
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.start_at.hour, 11)
+
+    def test_only_due_window_is_reminded_once(self):
+        now = timezone.now().replace(second=0, microsecond=0)
+        due = self.book_at(now + timedelta(minutes=30))
+        later = self.book_at(now + timedelta(hours=3))
+        past = self.book_at(now - timedelta(days=30))
+
+        self.assertEqual(send_reminder_emails(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, 'Reminder: Your reservation for Kowhai')
+        self.assertEqual(list(Reservation.objects.filter(reminder_sent=True)), [due])
+
+        # Running again doesn't send a second reminder
+        self.assertEqual(send_reminder_emails(), 0)
+        self.assertEqual(len(mail.outbox), 1)
+        later.refresh_from_db()
+        past.refresh_from_db()
+        self.assertFalse(later.reminder_sent or past.reminder_sent)
+
+    def test_whole_window_is_drained_and_users_without_email_are_skipped(self):
+        now = timezone.now().replace(second=0, microsecond=0)
+        no_email = User.objects.create(username='nomail')
+        for minutes in range(10, 60, 10):
+            self.book_at(now + timedelta(minutes=minutes))
+        # First in start order, so they would fill every batch if left unmarked
+        for minutes in (5, 6):
+            self.book_at(now + timedelta(minutes=minutes), user=no_email)
+
+        with mock.patch('reservations.tasks.REMINDER_BATCH_SIZE', 2):
+            self.assertEqual(send_reminder_emails(), 5)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertFalse(Reservation.objects.filter(reminder_sent=False).exists())
+
+    def test_history_does_not_change_query_count(self):
+        now = timezone.now().replace(second=0, microsecond=0)
+        self.book_at(now + timedelta(minutes=30))
+        Reservation.objects.bulk_create([
+            Reservation(user=self.user, room=self.room, date=date(2020, 1, 1) + timedelta(days=i),
+                        start_time=time(9, 0), end_time=time(10, 0),
+                        start_at=Reservation.combine_start(date(2020, 1, 1) + timedelta(days=i), time(9, 0)))
+            for i in range(500)
+        ])
+        # One select for the due rows and one bulk update, inside a savepoint pair
+        with self.assertNumQueries(4):
+            send_reminder_emails()
+
+
+class AdminReservationListingTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('gina', 'gina@example.com', 'pass12345', is_staff=True)
+        self.other = User.objects.create_user('hemi', 'hemi@example.com', 'pass12345')
+        self.rooms = [ConferenceRoom.objects.create(name=f'Room {i}', location='Level 8', capacity=4) for i in range(2)]
+        Reservation.objects.bulk_create([
+            Reservation(user=self.staff if i % 2 else self.other, room=self.rooms[i % 2],
+                        date=date(2030, 7, 1) + timedelta(days=i // 4), start_time=time(8 + i % 4, 0),
+                        end_time=time(8 + i % 4, 30))
+            for i in range(120)
+        ])
+        self.client.force_login(self.staff)
+
+    def test_pages_cover_every_row_once_in_order(self):
+        url = reverse('reservations:admin_reservations')
+        seen = []
+        response = self.client.get(url)
+        while True:
+            seen.extend(response.context['reservations'])
+            if not response.context['next_query']:
+                break
+            response = self.client.get(url + '?' + response.context['next_query'])
+        self.assertEqual([r.id for r in seen],
+                         list(Reservation.objects.order_by('-date', 'start_time', 'id').values_list('id', flat=True)))
+
+    def test_cursor_keeps_microseconds(self):
+        reservation = Reservation(id=42, date=date(2030, 1, 15), start_time=time(9, 0, 0, 250000))
+        self.assertEqual(decode_cursor(encode_cursor(reservation)), (date(2030, 1, 15), time(9, 0, 0, 250000), 42))
+        self.assertEqual(decode_cursor('2030-01-15_09:00:00_42'), (date(2030, 1, 15), time(9, 0), 42))
+        self.assertIsNone(decode_cursor('2030-01-15_nine_42'))
+
+    def test_filters(self):
+        response = self.client.get(reverse('reservations:admin_reservations'), {
+            'room': self.rooms[0].id, 'username': 'hemi', 'date_from': '2030-07-05', 'date_to': '2030-07-10',
+        })
+        rows = response.context['reservations']
+        self.assertTrue(rows)
+        for row in rows:
+            self.assertEqual((row.room_id, row.user.username), (self.rooms[0].id, 'hemi'))
+            self.assertTrue(date(2030, 7, 5) <= row.date <= date(2030, 7, 10))
+
+    def test_query_count_does_not_grow_with_table(self):
+        url = reverse('reservations:admin_reservations')
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get(url)
+            return len(ctx)
+
+        count_queries()  # caches the signed-in user
+        baseline = count_queries()
+        Reservation.objects.bulk_create([
+            Reservation(user=self.other, room=self.rooms[0], date=date(2031, 1, 1) + timedelta(days=i),
+                        start_time=time(9, 0), end_time=time(10, 0))
+            for i in range(200)
+        ])
+        self.assertEqual(count_queries(), baseline)
+
+
+class ReservationRowCacheTests(TestCase):
+    ROW_TEMPLATE = 'reservations/rows/admin_reservation.html'
+
+    def setUp(self):
+        self.staff = User.objects.create(username='gina', email='gina@example.com', is_staff=True)
+        self.room = ConferenceRoom.objects.create(name='Kowhai', location='Level 2', capacity=6)
+        self.reservation = Reservation.objects.create(user=self.staff, room=self.room, date=date(2030, 7, 1),
+                                                      start_time=time(9, 0), end_time=time(10, 0))
+        get_row_cache().clear()
+        self.client.force_login(self.staff)
+
+    def listing(self):
+        return self.client.get(reverse('reservations:admin_reservations'))
+
+    def test_rows_are_rendered_once(self):
+        self.assertTemplateUsed(self.listing(), self.ROW_TEMPLATE)
+        response = self.listing()
+        self.assertTemplateNotUsed(response, self.ROW_TEMPLATE)
+        self.assertContains(response, 'Kowhai')
+
+    def test_saved_reservations_and_renamed_rooms_render_again(self):
+        self.listing()
+        self.reservation.start_time = time(9, 30)
+        self.reservation.save(update_fields=['start_time'])
+        self.assertContains(self.listing(), '9:30 AM')
+
+        self.room.name = 'Rimu'
+        self.room.save()
+        response = self.listing()
+        self.assertContains(response, 'Rimu')
+        self.assertNotContains(response, 'Kowhai')
+
+    def test_cached_rows_cancel_with_the_visitors_token(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.staff)
+        self.listing()
+        page = client.get(reverse('reservations:admin_reservations')).content.decode()
+        self.assertNotIn('csrfmiddlewaretoken', page.split('<tbody>')[1])
+        token = page.split('name="csrfmiddlewaretoken" value="')[1].split('"')[0]
+        client.post(reverse('reservations:admin_cancel_reservation', args=[self.reservation.id]),
+                    {'csrfmiddlewaretoken': token})
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_templates_are_compiled_once(self):
+        loaders = engines.all()[0].engine.template_loaders
+        self.assertEqual([type(loader) for loader in loaders], [CachedLoader])
+
+
+class StaffLookupTests(EagerTasksMixin, TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('iris', 'iris@example.com', 'pass12345', is_staff=True)
+        User.objects.bulk_create([User(username=f'Member{i:02}', email=f'm{i:02}@example.com') for i in range(30)])
+        self.carol = User.objects.create(username='carol', email='memo@example.com')
+        self.room = ConferenceRoom.objects.create(name='Pohutukawa', location='Level 4', capacity=6)
+        ConferenceRoom.objects.create(name='Kauri', location='Pier Building', capacity=12)
+        self.client.force_login(self.staff)
+
+    def lookup(self, name, **params):
+        return self.client.get(reverse(f'reservations:api_{name}_lookup'), params)
+
+    def test_user_lookup_matches_prefixes_in_any_case(self):
+        results = self.lookup('user', q='MEM').json()['results']
+        # 20 of the members, plus carol whose email starts with "mem", in username order
+        self.assertEqual(len(results), 20)
+        self.assertEqual(results[0], {'id': self.carol.id, 'label': 'carol (memo@example.com)'})
+        self.assertEqual(results[1]['label'], 'Member00 (m00@example.com)')
+        self.assertEqual(len(self.lookup('user', q='member2', limit=5).json()['results']), 5)
+        self.assertEqual(self.lookup('user', q='ember').json()['results'], [])
+        self.assertEqual(self.lookup('user', q='').json()['results'], [])
+        self.assertEqual(self.lookup('user', q='m', limit='x').status_code, 400)
+
+    def test_room_lookup_matches_name_or_location(self):
+        labels = [result['label'] for result in self.lookup('room', q='p').json()['results']]
+        self.assertEqual(labels, ['Kauri @ Pier Building - Seats: 12', 'Pohutukawa @ Level 4 - Seats: 6'])
+
+    def test_lookups_are_staff_only(self):
+        self.client.force_login(self.carol)
+        self.assertEqual(self.lookup('user', q='m').status_code, 403)
+        self.assertEqual(self.lookup('room', q='p').status_code, 403)
+
+    def test_booking_form_submits_ids_without_listing_every_user(self):
+        url = reverse('reservations:admin_make_reservation')
+        response = self.client.get(url)
+        self.assertNotContains(response, '<option')
+        self.assertNotContains(response, 'Member29')
+
+        data = {'user': self.carol.id, 'room': self.room.id, 'date': '2031-06-01',
+                'start_time': '09:00', 'end_time': '10:00'}
+        response = self.client.post(url, {**data, 'user': 999999})
+        self.assertContains(response, 'Select a valid choice')
+        # The picked room is shown by name again, not as an id
+        self.assertContains(response, 'value="Pohutukawa @ Level 4 - Seats: 6"')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data)
+        self.assertRedirects(response, reverse('reservations:room_list'))
+        self.assertTrue(Reservation.objects.filter(user=self.carol, room=self.room).exists())
+
+
+class CachedUserTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('rua', 'rua@example.com', 'pass12345')
+        self.client.force_login(self.user)
+        self.url = reverse('reservations:my_reservations')
+
+    def user_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries if 'FROM "auth_user"' in query['sql']], response
+
+    def test_cache_holds_no_password_hash(self):
+        self.user_queries()
+        values, session_hash = get_user_cache().get(user_key(self.user.id))
+        self.assertNotIn('password', values)
+        self.assertNotIn(self.user.password, repr(values) + session_hash)
+
+        # Served from the cache, and saving the cached user keeps the password
+        queries, response = self.user_queries()
+        self.assertEqual(queries, [])
+        user = response.wsgi_request.user
+        self.assertEqual(user.get_deferred_fields(), {'password'})
+        user.email = 'rua@example.org'
+        user.save()
+        self.assertTrue(User.objects.get(id=self.user.id).check_password('pass12345'))
+
+        # A new password still signs out the other sessions
+        self.user.set_password('changed12345')
+        self.user.save()
+        self.assertRedirects(self.client.get(self.url), f"{reverse('login')}?next={self.url}")
+
+    def test_bulk_paths_forget_users(self):
+        other = User.objects.create_user('mihi', 'mihi@example.com', 'pass12345')
+        other_client = Client()
+        other_client.force_login(other)
+        self.user_queries()
+        other_client.get(self.url)
+
+        with mock.patch('reservations.accounts.forget_users', wraps=forget_users) as forget:
+            with self.captureOnCommitCallbacks(execute=True):
+                deactivate_users([self.user.id])
+            with self.captureOnCommitCallbacks(execute=True):
+                delete_users([other.id])
+        self.assertEqual(forget.call_args_list, [mock.call(self.user.id)] * 2 + [mock.call(other.id)] * 2)
+        self.assertIsNone(get_user_cache().get(user_key(self.user.id)))
+        self.assertIsNone(get_user_cache().get(user_key(other.id)))
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+        self.assertEqual(other_client.get(self.url).status_code, 302)
+
+
+class UserDirectoryTests(EagerTasksMixin, TestCase):
+    def setUp(self):
+        self.staff = User.objects.create(username='admin', email='admin@example.com', is_staff=True)
+        User.objects.bulk_create([
+            User(username=f'user{i:02}', email=f'u{i:02}@example.com', is_active=i % 3 != 0,
+                 date_joined=timezone.make_aware(timezone.datetime(2030, 1, 1 + i)))
+            for i in range(12)
+        ])
+        self.room = ConferenceRoom.objects.create(name='Matai', location='Level 5', capacity=8)
+        self.client.force_login(self.staff)
+
+    def usernames(self, **params):
+        return [user.username for user in self.client.get(reverse('reservations:user_list'), params).context['users']]
+
+    def book(self, user, day):
+        return Reservation.objects.create(user=user, room=self.room, date=day, start_time=time(9, 0), end_time=time(10, 0))
+
+    def bulk(self, **data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('reservations:user_bulk_action'), data)
+
+    def test_pages_and_filters(self):
+        with mock.patch('reservations.accounts.USER_PAGE_SIZE', 5):
+            url = reverse('reservations:user_list')
+            seen = []
+            response = self.client.get(url, {'q': 'USER'})
+            while True:
+                seen.extend(user.username for user in response.context['users'])
+                if not response.context['next_query']:
+                    break
+                response = self.client.get(url + '?' + response.context['next_query'])
+        self.assertEqual(seen, [f'user{i:02}' for i in range(12)])
+
+        self.assertEqual(self.usernames(q='u1'), ['user10', 'user11'])
+        self.assertEqual(self.usernames(staff='yes'), ['admin'])
+        self.assertEqual(self.usernames(active='no'), ['user00', 'user03', 'user06', 'user09'])
+        self.assertEqual(self.usernames(joined_from='2030-01-02', joined_to='2030-01-03'), ['user01', 'user02'])
+
+    def test_bulk_deactivate_ticked_users(self):
+        ids = list(User.objects.filter(username__in=['user01', 'user02']).values_list('id', flat=True))
+        self.bulk(action='deactivate', scope='selected', user_ids=ids + [self.staff.id])
+        self.assertEqual(self.usernames(active='no'), ['user00', 'user01', 'user02', 'user03', 'user06', 'user09'])
+
+        # The staff member who ran it is left alone
+        job = UserJob.objects.get()
+        self.assertEqual((job.status, job.done, job.total), (UserJob.DONE, 2, 2))
+        self.assertTrue(User.objects.get(id=self.staff.id).is_active)
+        self.assertContains(self.client.get(reverse('reservations:admin_panel')), '2 of 2 users')
+
+    def test_bulk_action_on_matching_users_needs_a_filter(self):
+        count = User.objects.count()
+        for filter_query in ['', 'q=&staff=&active=', 'joined_from=junk']:
+            response = self.bulk(action='delete', scope='matching', filter_query=filter_query)
+            self.assertEqual(User.objects.count(), count)
+            self.assertContains(self.client.get(response.url), 'Filter the list first')
+        self.assertFalse(UserJob.objects.exists())
+
+    def test_bulk_delete_matching_users_in_chunks(self):
+        inactive = User.objects.filter(is_active=False).order_by('id')
+        kept = User.objects.get(username='user01')
+        for user in inactive:
+            for day in range(3):
+                self.book(user, date(2031, 7, 1 + day))
+        self.book(kept, date(2031, 7, 1))
+        self.assertEqual(ReservationChange.objects.count(), 13)
+
+        published = []
+        with mock.patch('reservations.accounts.USER_JOB_CHUNK_SIZE', 3), \
+                mock.patch('reservations.signals.RESERVATION_DELETE_BATCH', 2), \
+                mock.patch.object(events, 'broker', mock.Mock(publish=published.append)):
+            self.bulk(action='delete', scope='matching', filter_query='active=no')
+
+        job = UserJob.objects.get()
+        self.assertEqual((job.status, job.done, job.total, job.filters['active']), (UserJob.DONE, 4, 4, 'no'))
+        self.assertFalse(User.objects.filter(is_active=False).exists())
+        self.assertEqual(list(Reservation.objects.values_list('user', flat=True)), [kept.id])
+        self.assertEqual(list(ReservationChange.objects.values_list('user', flat=True)), [kept.id])
+        self.assertEqual(list(RoomDayOccupancy.objects.values_list('date', 'booking_count')), [(date(2031, 7, 1), 1)])
+
+        # Live clients reload the freed dates, and each holder gets one email
+        self.assertEqual({(event['action'], event['date']) for event in published},
+                         {('resync', '2031-07-01'), ('resync', '2031-07-02'), ('resync', '2031-07-03')})
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         ['u00@example.com', 'u03@example.com', 'u06@example.com', 'u09@example.com'])
+        self.assertEqual(mail.outbox[0].body.count('Matai: '), 3)
+
+    def test_deleting_one_user_with_reservations(self):
+        user = User.objects.get(username='user04')
+        self.book(user, date(2031, 7, 1))
+        self.client.post(reverse('reservations:delete_user', args=[user.id]))
+        self.assertFalse(User.objects.filter(id=user.id).exists())
+        self.assertFalse(RoomDayOccupancy.objects.exists())
+
+        # A plain cascade doesn't log changes for a user who no longer exists
+        other = User.objects.get(username='user05')
+        self.book(other, date(2031, 7, 2))
+        other.delete()
+        self.assertFalse(ReservationChange.objects.exists())
+
+
+class SessionCacheTests(EagerTasksMixin, TestCase):
+    def setUp(self):
+        self.staff = User.objects.create(username='mere', email='mere@example.com', is_staff=True)
+        self.user = User.objects.create(username='tama', email='tama@example.com')
+
+    def page_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('reservations:add_user'))
+        return response, [query['sql'] for query in queries]
+
+    def test_signed_in_pages_skip_session_and_user_queries(self):
+        self.client.force_login(self.staff)
+        self.page_queries()
+        response, queries = self.page_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, [])
+
+    def test_changed_users_are_read_again(self):
+        self.client.force_login(self.staff)
+        self.page_queries()
+        self.client.post(reverse('reservations:edit_user', args=[self.staff.id]),
+                         {'username': 'mere', 'email': 'mere@example.com', 'is_active': 'on'})
+        # No longer staff, so sent to the admin login
+        response, queries = self.page_queries()
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(any('auth_user' in sql for sql in queries))
+
+        self.client.force_login(self.user)
+        self.client.get(reverse('reservations:my_reservations'))
+        deactivate_users([self.user.id])
+        self.assertFalse(self.client.get(reverse('reservations:my_reservations')).wsgi_request.user.is_authenticated)
+
+    def test_prune_expired_sessions(self):
+        now = timezone.now()
+        Session.objects.bulk_create(
+            [Session(session_key=f'old{i}', session_data='', expire_date=now - timedelta(days=1)) for i in range(5)]
+            + [Session(session_key='current', session_data='', expire_date=now + timedelta(days=1))]
+        )
+        with mock.patch('reservations.tasks.SESSION_PRUNE_BATCH_SIZE', 2):
+            self.assertEqual(prune_expired_sessions(), 5)
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['current'])
+
+
+class AvailabilityCacheTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user('ivy', 'ivy@example.com', 'pass12345')
+        self.room = ConferenceRoom.objects.create(name='Pohutukawa', location='Level 9', capacity=6)
+        self.client.force_login(self.user)
+
+    def booked(self, day):
+        return availability_for_date(day)[0].booked
+
+    def test_second_read_is_a_hit(self):
+        hits, misses = CacheStats.hits, CacheStats.misses
+        self.booked(date(2030, 8, 1))
+        with self.assertNumQueries(1):  # only the rooms query
+            self.booked(date(2030, 8, 1))
+        self.assertEqual((CacheStats.hits - hits, CacheStats.misses - misses), (1, 1))
+
+    def test_never_stale_after_create_edit_and_cancel(self):
+        day, other_day = date(2030, 8, 1), date(2030, 8, 2)
+        self.assertEqual(self.booked(day), [])
+
+        self.client.post(reverse('reservations:make_reservation'), {
+            'room': self.room.id, 'date': '2030-08-01', 'start_time': '09:00', 'end_time': '10:00',
+        })
+        self.assertEqual(self.booked(day), [(time(9, 0), time(10, 0))])
+        self.assertEqual(self.booked(other_day), [])
+
+        # Moving it to another day clears both dates
+        reservation = Reservation.objects.get()
+        self.client.post(reverse('reservations:edit_reservation', args=[reservation.id]), {
+            'room': self.room.id, 'date': '2030-08-02', 'start_time': '11:00', 'end_time': '12:00',
+        })
+        self.assertEqual(self.booked(day), [])
+        self.assertEqual(self.booked(other_day), [(time(11, 0), time(12, 0))])
+
+        self.client.post(reverse('reservations:cancel_reservation', args=[reservation.id]))
+        self.assertEqual(self.booked(other_day), [])
+
+    def test_room_changes_clear_every_date(self):
+        self.booked(date(2030, 8, 1))
+        self.booked(date(2030, 8, 2))
+        misses = CacheStats.misses
+        ConferenceRoom.objects.create(name='Harakeke', location='Level 9', capacity=6)
+        self.booked(date(2030, 8, 1))
+        self.booked(date(2030, 8, 2))
+        self.assertEqual(CacheStats.misses - misses, 2)
+
+
+class AvailabilityApiTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user('jack', 'jack@example.com', 'pass12345')
+        self.room = ConferenceRoom.objects.create(name='Nikau', location='Level 10', capacity=8)
+        Reservation.objects.create(user=self.user, room=self.room, date=date(2030, 9, 1),
+                                   start_time=time(9, 0), end_time=time(10, 0))
+        self.client.force_login(self.user)
+        self.url = reverse('reservations:api_availability')
+
+    def test_returns_booked_and_free_slots(self):
+        response = self.client.get(self.url, {'date': '2030-09-01'})
+        room = response.json()['dates'][0]['rooms'][0]
+        self.assertEqual(room['name'], 'Nikau')
+        self.assertEqual(room['booked'], [{'start': '09:00', 'end': '10:00'}])
+        self.assertEqual(room['free'][0], {'start': '00:00', 'end': '09:00'})
+
+    def test_date_range(self):
+        response = self.client.get(self.url, {'start': '2030-09-01', 'end': '2030-09-03'})
+        self.assertEqual([d['date'] for d in response.json()['dates']], ['2030-09-01', '2030-09-02', '2030-09-03'])
+        self.assertEqual(self.client.get(self.url, {'start': '2030-09-01', 'end': '2030-12-01'}).status_code, 400)
+
+    def test_unchanged_poll_is_304_without_database(self):
+        etag = self.client.get(self.url, {'date': '2030-09-01'})['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        # Only the session and user lookups, nothing from the reservation tables
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, {'date': '2030-09-01'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([q for q in ctx.captured_queries if 'reservations_' in q['sql']])
+
+    def test_booking_changes_etag(self):
+        etag = self.client.get(self.url, {'date': '2030-09-01'})['ETag']
+        Reservation.objects.create(user=self.user, room=self.room, date=date(2030, 9, 1),
+                                   start_time=time(11, 0), end_time=time(12, 0))
+        response = self.client.get(self.url, {'date': '2030-09-01'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()['dates'][0]['rooms'][0]['booked']), 2)
+
+
+class AvailabilityEventTests(EagerTasksMixin, TestCase):
+    def setUp(self):
+        self.broker = InProcessBroker()
+        patcher = mock.patch.object(events, 'broker', self.broker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user('kate', 'kate@example.com', 'pass12345')
+        self.room = ConferenceRoom.objects.create(name='Tawa', location='Level 11', capacity=6)
+        self.client.force_login(self.user)
+
+    def test_views_publish_deltas(self):
+        published = []
+        self.broker.publish = published.append
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('reservations:make_reservation'), {
+                'room': self.room.id, 'date': '2030-10-01', 'start_time': '09:00', 'end_time': '10:00',
+            })
+        reservation = Reservation.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('reservations:edit_reservation', args=[reservation.id]), {
+                'room': self.room.id, 'date': '2030-10-02', 'start_time': '09:00', 'end_time': '10:00',
+            })
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('reservations:cancel_reservation', args=[reservation.id]))
+        self.assertEqual([(e['action'], e['date']) for e in published], [
+            ('created', '2030-10-01'),
+            ('cancelled', '2030-10-01'),
+            ('created', '2030-10-02'),
+            ('cancelled', '2030-10-02'),
+        ])
+        self.assertEqual(published[-1]['reservation'], reservation.id)
+
+    def test_stream_falls_back_to_polling_under_wsgi(self):
+        url = reverse('reservations:api_availability_stream')
+        response = self.client.get(url, {'date': '2030-10-01'})
+        self.assertFalse(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response.content, b'retry: 30000\nid: poll\n\n')
+        self.assertEqual(self.broker.subscriber_count(), 0)
+
+        # Each reconnect tells the page to reload the date
+        response = self.client.get(url, {'date': '2030-10-01'}, headers={'Last-Event-ID': 'poll'})
+        self.assertIn(b'data: {"action": "resync", "date": "2030-10-01"}\n\n', response.content)
+
+    def test_redis_listener_reconnects_and_resyncs(self):
+        broker = RedisBroker.__new__(RedisBroker)
+        InProcessBroker.__init__(broker)
+        loop = mock.Mock()
+        # Without starting the listener thread
+        subscription = InProcessBroker.subscribe(broker, '2030-10-01', loop)
+        event = {'action': 'created', 'date': '2030-10-01'}
+
+        def listen():
+            yield {'data': json.dumps(event)}
+            raise ConnectionError('redis went away')
+
+        # Dropped once connected, then refused once
+        pubsubs = [mock.Mock(**{'listen.side_effect': listen}),
+                   mock.Mock(**{'subscribe.side_effect': ConnectionError('refused')}),
+                   mock.Mock(**{'listen.side_effect': listen})]
+        broker.redis = mock.Mock(**{'pubsub.side_effect': pubsubs + [StopIteration]})
+        with mock.patch('reservations.events.time.sleep') as sleep, self.assertRaises(StopIteration):
+            broker.listen()
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [1, 2, 1])
+        self.assertTrue(all(pubsub.close.called for pubsub in pubsubs))
+        offered = [call.args[1] for call in loop.call_soon_threadsafe.call_args_list]
+        self.assertEqual(offered, [event, {'action': 'resync', 'date': '2030-10-01'}, event])
+        self.assertTrue(all(call.args[0] == subscription.offer for call in loop.call_soon_threadsafe.call_args_list))
+
+    def test_stream_sends_published_events(self):
+        async def run():
+            stream = api.stream_events('2030-10-01')
+            self.assertEqual(await anext(stream), 'retry: 5000\n\n')
+            next_message = asyncio.ensure_future(anext(stream))
+            await asyncio.sleep(0)
+            self.broker.publish({'action': 'created', 'date': '2030-10-01', 'room': 1})
+            message = await asyncio.wait_for(next_message, 1)
+            await stream.aclose()
+            return message
+
+        message = asyncio.run(run())
+        self.assertTrue(message.startswith('event: availability\ndata: {"action": "created"'))
+        self.assertEqual(self.broker.subscriber_count(), 0)
+
+
+class EventFanOutLoadTests(SimpleTestCase):
+    def test_idle_subscribers_are_cheap_and_delivery_is_linear(self):
+        broker = InProcessBroker()
+        subscribers = 5000
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            subscriptions = [broker.subscribe('2030-10-01', loop) for _ in range(subscribers)]
+            per_subscriber = (tracemalloc.get_traced_memory()[0] - before) / subscribers
+            tracemalloc.stop()
+
+            # An event for a date nobody watches costs nothing
+            self.assertEqual(broker.deliver({'action': 'created', 'date': '2030-10-02'}), 0)
+
+            began = clock.perf_counter()
+            delivered = broker.deliver({'action': 'created', 'date': '2030-10-01'})
+            await asyncio.sleep(0)
+            elapsed = clock.perf_counter() - began
+            self.assertEqual(delivered, subscribers)
+            self.assertTrue(all(s.queue.qsize() == 1 for s in subscriptions))
+            return per_subscriber, elapsed
+
+        per_subscriber, elapsed = asyncio.run(run())
+        self.assertLess(per_subscriber, 8 * 1024)
+        self.assertLess(elapsed, 1.0)
+
+    def test_slow_subscriber_is_told_to_resync(self):
+        broker = InProcessBroker()
+
+        async def run():
+            subscription = broker.subscribe('2030-10-01', asyncio.get_running_loop())
+            for i in range(events.SUBSCRIBER_QUEUE_SIZE + 5):
+                broker.deliver({'action': 'created', 'date': '2030-10-01', 'reservation': i})
+            await asyncio.sleep(0)
+            return [subscription.queue.get_nowait() for _ in range(subscription.queue.qsize())]
+
+        queued = asyncio.run(run())
+        self.assertEqual(queued[0]['action'], 'resync')
+        self.assertLessEqual(len(queued), events.SUBSCRIBER_QUEUE_SIZE)
+
+
+class FreeSlotSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('liam', 'liam@example.com', 'pass12345')
+        self.small = ConferenceRoom.objects.create(name='Small', location='North', capacity=4)
+        self.large = ConferenceRoom.objects.create(name='Large', location='North', capacity=20)
+        self.south = ConferenceRoom.objects.create(name='South', location='South', capacity=6)
+        self.day = date(2030, 11, 1)
+
+    def book(self, room, start, end, day=None):
+        Reservation.objects.create(user=self.user, room=room, date=day or self.day, start_time=start, end_time=end)
+
+    def test_ranked_by_time_then_best_fit(self):
+        self.book(self.small, time(8, 0), time(9, 0))
+        slots = find_free_slots(self.day, self.day, timedelta(hours=1), min_capacity=4, location='North')
+        self.assertEqual([(s.room.name, s.start, s.end) for s in slots], [
+            ('Large', time(8, 0), time(18, 0)),
+            ('Small', time(9, 0), time(18, 0)),
+        ])
+
+    def test_gaps_shorter_than_duration_are_skipped(self):
+        self.book(self.south, time(8, 0), time(9, 0))
+        self.book(self.south, time(9, 30), time(17, 0))
+        slots = find_free_slots(self.day, self.day, timedelta(hours=1), min_capacity=5, location='South')
+        self.assertEqual([(s.start, s.end) for s in slots], [(time(17, 0), time(18, 0))])
+
+    def test_api(self):
+        self.client.force_login(self.user)
+        url = reverse('reservations:api_free_slots')
+        response = self.client.get(url, {'start': '2030-11-01', 'end': '2030-11-02', 'duration': 60,
+                                         'capacity': 10, 'from': '09:00', 'to': '12:00'})
+        self.assertEqual(response.json()['slots'][0], {
+            'room': {'id': self.large.id, 'name': 'Large', 'location': 'North', 'capacity': 20},
+            'date': '2030-11-01', 'start': '09:00', 'end': '12:00',
+        })
+        self.assertEqual(self.client.get(url, {'start': '2030-11-01', 'end': '2030-11-01'}).status_code, 400)
+
+    def test_stops_reading_reservations_once_the_limit_is_found(self):
+        for offset in range(30):
+            self.book(self.south, time(8, 0), time(9, 0), self.day + timedelta(days=offset))
+        fetched = []
+        iterator = QuerySet.iterator
+
+        def counting_iterator(queryset, chunk_size=None):
+            for row in iterator(queryset, chunk_size=chunk_size):
+                fetched.append(row)
+                yield row
+
+        with mock.patch.object(QuerySet, 'iterator', counting_iterator):
+            slots = find_free_slots(self.day, self.day + timedelta(days=29), timedelta(hours=1),
+                                    location='South', limit=3)
+        self.assertEqual([s.date for s in slots], [self.day + timedelta(days=offset) for offset in range(3)])
+        # The three days searched, and the next one's first row
+        self.assertEqual(len(fetched), 4)
+
+    def test_thousand_rooms_ninety_days(self):
+        rooms = ConferenceRoom.objects.bulk_create([
+            ConferenceRoom(name=f'Room {i}', location=f'Block {i % 10}', capacity=2 + i % 30) for i in range(1000)
+        ])
+        Reservation.objects.bulk_create([
+            Reservation(user=self.user, room=rooms[(i * 7) % 1000], date=self.day + timedelta(days=i % 90),
+                        start_time=time(8 + i % 9, 0), end_time=time(9 + i % 9, 0))
+            for i in range(20000)
+        ])
+        began = clock.perf_counter()
+        with self.assertNumQueries(2):
+            slots = find_free_slots(self.day, self.day + timedelta(days=89), timedelta(hours=2),
+                                    min_capacity=25, limit=10000)
+        elapsed = clock.perf_counter() - began
+        self.assertTrue(slots)
+        self.assertTrue(all(s.room.capacity >= 25 for s in slots))
+        self.assertLess(elapsed, 5)
+
+
+class CalendarTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('maya', 'maya@example.com', 'pass12345')
+        self.room = ConferenceRoom.objects.create(name='Board', location='HQ', capacity=10)
+        self.day = date(2030, 12, 2)  # a Monday
+
+    def test_slot_mask_and_runs(self):
+        self.assertEqual(slot_mask(time(9, 0), time(10, 0)), 0b11 << 18)
+        self.assertEqual(slot_mask(time(9, 15), time(10, 0)), 0b11 << 18)
+        self.assertEqual(slot_mask(time(9, 0), time(9, 40)), 0b11 << 18)
+        self.assertEqual(slot_mask(time(23, 30), time(23, 59)), 1 << 47)
+        self.assertEqual(list(runs(slot_mask(time(1, 0), time(2, 0)) | slot_mask(time(9, 0), time(12, 0)))),
+                         [(2, 2), (18, 6)])
+
+    def test_grid_loads_in_two_queries(self):
+        Reservation.objects.create(user=self.user, room=self.room, date=self.day + timedelta(days=2),
+                                   start_time=time(9, 0), end_time=time(11, 0))
+        with self.assertNumQueries(2):
+            grid = OccupancyGrid.load(self.day, 7)
+        self.assertEqual(grid.booked_slots(self.room.id, self.day + timedelta(days=2)), 4)
+        self.assertTrue(grid.is_booked(self.room.id, self.day + timedelta(days=2), 19))
+        self.assertFalse(grid.is_booked(self.room.id, self.day, 19))
+
+    def test_week_view(self):
+        Reservation.objects.create(user=self.user, room=self.room, date=self.day + timedelta(days=3),
+                                   start_time=time(12, 0), end_time=time(18, 0))
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('reservations:room_calendar'), {'date': '2030-12-05'})
+        self.assertEqual(response.context['days'][0], self.day)
+        self.assertEqual(len(response.context['days']), 7)
+        self.assertContains(response, 'left: 50.00%; width: 25.00%')
+        self.assertContains(response, 'title="6.0 h booked"')
+
+    def test_two_hundred_room_month(self):
+        rooms = ConferenceRoom.objects.bulk_create([
+            ConferenceRoom(name=f'Room {i:03}', location='HQ', capacity=4) for i in range(200)
+        ])
+        Reservation.objects.bulk_create([
+            Reservation(user=self.user, room=rooms[i % 200], date=date(2030, 12, 1) + timedelta(days=i % 31),
+                        start_time=time(8 + i % 10, 0), end_time=time(9 + i % 10, 30))
+            for i in range(6000)
+        ])
+        self.client.force_login(self.user)
+        began = clock.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('reservations:room_calendar'), {'date': '2030-12-10', 'view': 'month'})
+        elapsed = clock.perf_counter() - began
+        self.assertEqual(len(response.context['days']), 31)
+        self.assertLess(len(queries), 6)
+        self.assertLess(elapsed, 2)
+
+
+class RoomOccupancyTests(EagerTasksMixin, TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('ruth', 'ruth@example.com', 'pass12345', is_staff=True)
+        self.room = ConferenceRoom.objects.create(name='Kowhai', location='Level 2', capacity=10)
+        self.other = ConferenceRoom.objects.create(name='Rimu', location='Level 3', capacity=4)
+
+    def book(self, room, day, start, end):
+        return Reservation.objects.create(user=self.staff, room=room, date=day, start_time=start, end_time=end)
+
+    def occupancy(self):
+        return {(o.room_id, o.date): (o.booked_minutes, o.booking_count, o.first_start, o.last_end)
+                for o in RoomDayOccupancy.objects.all()}
+
+    def test_kept_up_to_date_on_create_edit_and_cancel(self):
+        day = date(2031, 5, 1)
+        first = self.book(self.room, day, time(9, 0), time(10, 0))
+        self.book(self.room, day, time(13, 0), time(13, 30))
+        self.assertEqual(self.occupancy(), {(self.room.id, day): (90, 2, time(9, 0), time(13, 30))})
+
+        # Moving a booking to another room and day updates both old and new
+        first.room, first.date = self.other, day + timedelta(days=1)
+        first.save()
+        self.assertEqual(self.occupancy(), {(self.room.id, day): (30, 1, time(13, 0), time(13, 30)),
+                                            (self.other.id, day + timedelta(days=1)): (60, 1, time(9, 0), time(10, 0))})
+
+        first.delete()
+        self.assertEqual(list(self.occupancy()), [(self.room.id, day)])
+
+    def test_series_and_import_update_occupancy(self):
+        reservation = Reservation(user=self.staff, room=self.room, date=date(2031, 5, 5),
+                                  start_time=time(9, 0), end_time=time(11, 0))
+        ReservationService.book_series(reservation, ReservationSeries.DAILY, date(2031, 5, 7),
+                                       [date(2031, 5, 5), date(2031, 5, 6), date(2031, 5, 7)])
+        transfer.import_reservations(transfer.csv_rows(StringIO(
+            'room,user,date,start_time,end_time\nKowhai,ruth,2031-05-05,14:00,15:00\n'
+        ), transfer.RESERVATION_COLUMNS))
+        occupancy = self.occupancy()
+        self.assertEqual(len(occupancy), 3)
+        self.assertEqual(occupancy[(self.room.id, date(2031, 5, 5))], (180, 2, time(9, 0), time(15, 0)))
+
+    def test_deleting_room_deletes_its_occupancy(self):
+        self.book(self.room, date(2031, 5, 1), time(9, 0), time(10, 0))
+        self.book(self.other, date(2031, 5, 1), time(9, 0), time(10, 0))
+        self.client.force_login(self.staff)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('reservations:delete_room', args=[self.room.id]))
+        self.assertEqual(list(self.occupancy()), [(self.other.id, date(2031, 5, 1))])
+
+    def test_rebuild_command_finds_and_fixes_drift(self):
+        self.book(self.room, date(2031, 5, 1), time(9, 0), time(10, 0))
+        self.book(self.room, date(2031, 5, 2), time(9, 0), time(10, 0))
+        call_command('rebuild_occupancy', '--verify', stdout=StringIO())
+
+        RoomDayOccupancy.objects.filter(date=date(2031, 5, 1)).update(booked_minutes=5)
+        RoomDayOccupancy.objects.filter(date=date(2031, 5, 2)).delete()
+        RoomDayOccupancy.objects.create(room=self.other, date=date(2031, 5, 3), booked_minutes=60,
+                                        booking_count=1, first_start=time(9, 0), last_end=time(10, 0))
+        with self.assertRaises(CommandError):
+            call_command('rebuild_occupancy', '--verify', stdout=StringIO(), stderr=StringIO())
+
+        call_command('rebuild_occupancy', stdout=StringIO())
+        call_command('rebuild_occupancy', '--verify', stdout=StringIO())
+        self.assertEqual(set(self.occupancy()), {(self.room.id, date(2031, 5, 1)), (self.room.id, date(2031, 5, 2))})
+
+    def test_utilization_and_least_busy_rooms(self):
+        day = date(2031, 5, 1)
+        self.book(self.room, day, time(8, 0), time(13, 0))
+        self.book(self.other, day, time(9, 0), time(10, 0))
+        quiet = ConferenceRoom.objects.create(name='Totara', location='Level 1', capacity=6)
+
+        rows = utilization(day, day + timedelta(days=1))
+        self.assertEqual([(row['room'].id, row['utilization'], row['busy_days']) for row in rows],
+                         [(self.room.id, 25.0, 1), (self.other.id, 5.0, 1), (quiet.id, 0.0, 0)])
+        self.assertEqual([room.id for room in least_busy_rooms(day)], [quiet.id, self.other.id, self.room.id])
+        self.assertEqual([room.id for room in least_busy_rooms(day, min_capacity=8)], [self.room.id])
+
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('reservations:room_utilization'), {'from': '2031-05-01', 'to': '2031-05-02'})
+        self.assertContains(response, '25.0%')
+
+
+class RecurringReservationTests(EagerTasksMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('noah', 'noah@example.com', 'pass12345')
+        self.room = ConferenceRoom.objects.create(name='Totara', location='Level 1', capacity=8)
+        self.client.force_login(self.user)
+
+    def post(self, **data):
+        data = {'room': self.room.id, 'date': '2031-01-31', 'start_time': '09:00', 'end_time': '10:00', **data}
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('reservations:make_reservation'), data)
+
+    def test_occurrence_dates(self):
+        self.assertEqual(occurrence_dates(date(2031, 1, 1), 'daily', date(2031, 1, 4), [date(2031, 1, 2)]),
+                         [date(2031, 1, 1), date(2031, 1, 3), date(2031, 1, 4)])
+        self.assertEqual(occurrence_dates(date(2031, 1, 6), 'weekly', date(2031, 1, 20)),
+                         [date(2031, 1, 6), date(2031, 1, 13), date(2031, 1, 20)])
+        # Months without a 31st are skipped
+        self.assertEqual(occurrence_dates(date(2031, 1, 31), 'monthly', date(2031, 5, 31)),
+                         [date(2031, 1, 31), date(2031, 3, 31), date(2031, 5, 31)])
+
+    def test_weekly_series_with_one_summary_email(self):
+        response = self.post(date='2031-01-06', repeat='weekly', repeat_until='2031-02-03', skip_dates='2031-01-20')
+        self.assertRedirects(response, reverse('reservations:my_reservations'))
+        series = ReservationSeries.objects.get()
+        self.assertEqual(list(series.reservations.order_by('date').values_list('date', flat=True)),
+                         [date(2031, 1, 6), date(2031, 1, 13), date(2031, 1, 27), date(2031, 2, 3)])
+        self.assertTrue(all(r.start_at == Reservation.combine_start(r.date, r.start_time)
+                            for r in series.reservations.all()))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('4 dates', mail.outbox[0].body)
+
+    def test_clash_books_nothing(self):
+        Reservation.objects.create(user=self.user, room=self.room, date=date(2031, 1, 3),
+                                   start_time=time(9, 30), end_time=time(11, 0))
+        response = self.post(date='2031-01-01', repeat='daily', repeat_until='2031-01-05')
+        self.assertContains(response, '03-01-2031')
+        self.assertEqual(Reservation.objects.count(), 1)
+        self.assertFalse(ReservationSeries.objects.exists())
+
+    def test_series_clears_cached_availability(self):
+        self.assertTrue(availability_for_date(date(2031, 1, 2))[0].is_available)
+        ReservationService.book_series(Reservation(user=self.user, room=self.room, start_time=time(9, 0),
+                                                   end_time=time(10, 0)), 'daily', date(2031, 1, 3),
+                                       [date(2031, 1, 1), date(2031, 1, 2), date(2031, 1, 3)])
+        self.assertFalse(availability_for_date(date(2031, 1, 2))[0].is_available)
+
+    def test_limit(self):
+        response = self.post(date='2031-01-01', repeat='daily', repeat_until='2033-01-01')
+        self.assertContains(response, 'at most 500 dates')
+
+        # A far off end date stops at one past the limit rather than listing every day
+        self.assertEqual(len(occurrence_dates(date(2031, 1, 1), 'daily', date(9999, 12, 31), limit=501)), 501)
+        with mock.patch('reservations.forms.occurrence_dates', wraps=occurrence_dates) as dates:
+            response = self.post(date='2031-01-01', repeat='daily', repeat_until='9999-12-31')
+        self.assertContains(response, 'at most 500 dates')
+        self.assertEqual(dates.call_args.kwargs['limit'], 501)
+
+    def test_five_hundred_occurrences(self):
+        days = [date(2031, 1, 1) + timedelta(days=i) for i in range(500)]
+        Reservation.objects.bulk_create([
+            Reservation(user=self.user, room=self.room, date=day, start_time=time(14, 0), end_time=time(15, 0),
+                        start_at=Reservation.combine_start(day, time(14, 0)))
+            for day in days
+        ])
+        began = clock.perf_counter()
+        response = self.post(date='2031-01-01', repeat='daily', repeat_until=str(days[-1]))
+        elapsed = clock.perf_counter() - began
+        self.assertRedirects(response, reverse('reservations:my_reservations'))
+        self.assertEqual(Reservation.objects.filter(series__isnull=False).count(), 500)
+        self.assertLess(elapsed, 1.0)
+
+
+class ImportExportTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('olivia', 'olivia@example.com', 'pass12345', is_staff=True)
+        self.room = ConferenceRoom.objects.create(name='Harakeke', location='Level 2', capacity=10)
+        self.client.force_login(self.staff)
+
+    def book(self, day, start, end):
+        return Reservation.objects.create(user=self.staff, room=self.room, date=day, start_time=start, end_time=end)
+
+    def export(self, **params):
+        response = self.client.get(reverse('reservations:export_reservations'), params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_import_rooms_command(self):
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'rooms.csv')
+        with open(path, 'w') as f:
+            f.write('name,location,capacity\nKowhai,Level 4,12\nX,Level 4,5\nPohutukawa,Level 5,0\n')
+        out, err = StringIO(), StringIO()
+        call_command('import_rooms', path, stdout=out, stderr=err)
+        self.assertIn('Imported 1 rooms, skipped 2', out.getvalue())
+        self.assertIn('line 3', err.getvalue())
+        self.assertTrue(ConferenceRoom.objects.filter(name='Kowhai', capacity=12).exists())
+
+    def test_import_reservations_reports_bad_rows(self):
+        self.book(date(2031, 3, 1), time(9, 0), time(10, 0))
+        lines = StringIO(
+            'room,user,date,start_time,end_time\n'
+            'Harakeke,olivia,2031-03-01,10:00,11:00\n'
+            'Harakeke,olivia,2031-03-01,09:30,10:30\n'   # clashes with the existing booking
+            'Harakeke,olivia,2031-03-01,10:30,11:30\n'   # clashes with the row above
+            'Nowhere,olivia,2031-03-01,10:00,11:00\n'
+            'Harakeke,nobody,2031-03-01,12:00,13:00\n'
+            'Harakeke,,01/03/2031,12:00,13:00\n'
+            'Harakeke,,2031-03-02,12:00,13:00\n'
+        )
+        result = transfer.import_reservations(transfer.csv_rows(lines, transfer.RESERVATION_COLUMNS),
+                                              default_user='olivia', batch_size=3)
+        self.assertEqual(result.created, 2)
+        self.assertEqual(sorted(line for line, _ in result.errors), [3, 4, 5, 6, 7])
+        self.assertTrue(all(r.start_at for r in Reservation.objects.all()))
+
+    def test_import_checks_only_the_days_it_books_and_tells_live_clients(self):
+        self.book(date(2035, 6, 1), time(9, 0), time(10, 0))
+        lines = StringIO(
+            'room,user,date,start_time,end_time\n'
+            'Harakeke,olivia,2031-03-01,10:00,11:00\n'
+            'Harakeke,olivia,2041-03-01,10:00,11:00\n'
+        )
+        published = []
+        with mock.patch.object(events, 'broker', mock.Mock(publish=published.append)), \
+                self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            result = transfer.import_reservations(transfer.csv_rows(lines, transfer.RESERVATION_COLUMNS))
+        self.assertEqual(result.created, 2)
+        # The first read of the batch's bookings, before any are inserted
+        clash_query = next(q['sql'] for q in queries if q['sql'].startswith('SELECT "reservations_reservation"."room_id"'))
+        self.assertNotIn('BETWEEN', clash_query)
+        self.assertEqual([(event['action'], event['date']) for event in published],
+                         [('resync', '2031-03-01'), ('resync', '2041-03-01')])
+
+    def test_csv_export_is_filtered_and_round_trips(self):
+        self.book(date(2031, 3, 1), time(9, 0), time(10, 0))
+        self.book(date(2031, 4, 1), time(9, 0), time(10, 0))
+        content = self.export(format='csv', date_from='2031-03-01', date_to='2031-03-31')
+        self.assertEqual(content.splitlines(), ['room,user,date,start_time,end_time',
+                                                'Harakeke,olivia,2031-03-01,09:00,10:00'])
+
+        Reservation.objects.all().delete()
+        result = transfer.import_reservations(transfer.csv_rows(StringIO(content), transfer.RESERVATION_COLUMNS))
+        self.assertEqual((result.created, result.errors), (1, []))
+
+    def test_ics_round_trip(self):
+        self.room.name = 'Harakeke, the big one'
+        self.room.save()
+        self.book(date(2031, 3, 1), time(9, 0), time(10, 30))
+        content = self.export(format='ics')
+        self.assertIn('DTSTART:20310301T090000Z', content)
+        self.assertIn('SUMMARY:Harakeke\\, the big one', content)
+
+        Reservation.objects.all().delete()
+        result = transfer.import_reservations(transfer.ics_rows(StringIO(content)))
+        self.assertEqual(result.created, 1)
+        self.assertEqual(Reservation.objects.get().end_time, time(10, 30))
+
+    def test_upload(self):
+        upload = SimpleUploadedFile('rooms.csv', b'name,location,capacity\nKauri,Level 6,8\n')
+        response = self.client.post(reverse('reservations:import_data'), {'kind': 'rooms', 'file': upload})
+        self.assertContains(response, '1 created, 0 skipped')
+
+    def test_export_streams_in_chunks(self):
+        Reservation.objects.bulk_create([
+            Reservation(user=self.staff, room=self.room, date=date(2031, 1, 1) + timedelta(days=i // 10),
+                        start_time=time(8 + i % 10, 0), end_time=time(9 + i % 10, 0))
+            for i in range(20000)
+        ])
+        chunks = transfer.reservations_csv(transfer.export_rows())
+        next(chunks)
+        tracemalloc.start()
+        try:
+            count = sum(chunk.count('\n') for chunk in chunks)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(count, 20000)
+        # Only a chunk of rows is held at once, loading all 20,000 would take several times this
+        self.assertLess(peak, 4 * 1024 * 1024)
+
+
+class CalendarFeedTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user('piri', 'piri@example.com', 'pass12345')
+        self.room = ConferenceRoom.objects.create(name='Kahikatea', location='Level 7', capacity=6)
+        self.token = feeds.get_feed(self.user).token
+        self.day = timezone.localdate() + timedelta(days=3)
+
+    def book(self, start=time(9, 0), end=time(10, 0)):
+        return Reservation.objects.create(user=self.user, room=self.room, date=self.day, start_time=start, end_time=end)
+
+    def changes(self, since=None):
+        params = {'since': since} if since else {}
+        return self.client.get(reverse('reservations:calendar_changes', args=[self.token]), params)
+
+    def test_feed_and_conditional_poll(self):
+        reservation = self.book()
+        url = reverse('reservations:calendar_feed', args=[self.token])
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        self.assertContains(response, f'UID:reservation-{reservation.id}@room-reservation')
+
+        # An unchanged calendar is answered from the cache alone
+        with self.assertNumQueries(0):
+            unchanged = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(unchanged.status_code, 304)
+
+        reservation.end_time = time(11, 0)
+        ReservationService.book(reservation)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_unknown_and_reset_tokens(self):
+        self.assertEqual(self.client.get(reverse('reservations:calendar_feed', args=['nope'])).status_code, 404)
+        self.client.get(reverse('reservations:calendar_feed', args=[self.token]))
+        feeds.reset_feed(self.user)
+        self.assertEqual(self.client.get(reverse('reservations:calendar_feed', args=[self.token])).status_code, 404)
+
+    def test_changes_since(self):
+        kept, moved, cancelled = self.book(), self.book(time(11, 0), time(12, 0)), self.book(time(13, 0), time(14, 0))
+        everything = self.changes().json()
+        self.assertEqual([c['id'] for c in everything['changes']], [kept.id, moved.id, cancelled.id])
+
+        moved.start_time = time(15, 0)
+        moved.end_time = time(16, 0)
+        moved.save()
+        moved.save()
+        cancelled_id = cancelled.id
+        cancelled.delete()
+        added = self.book(time(17, 0), time(18, 0))
+        since = self.changes(everything['sync_token']).json()
+        self.assertEqual(since['changes'], [
+            {'id': moved.id, 'action': 'saved', 'room': {'id': self.room.id, 'name': 'Kahikatea', 'location': 'Level 7'},
+             'date': self.day.isoformat(), 'start': '15:00', 'end': '16:00'},
+            {'id': cancelled_id, 'action': 'deleted'},
+            {'id': added.id, 'action': 'saved', 'room': {'id': self.room.id, 'name': 'Kahikatea', 'location': 'Level 7'},
+             'date': self.day.isoformat(), 'start': '17:00', 'end': '18:00'},
+        ])
+        self.assertEqual(self.changes(since['sync_token']).json()['changes'], [])
+
+        # Renaming the room changes every entry that shows it
+        self.room.name = 'Rimu'
+        self.room.save()
+        renamed = self.changes(since['sync_token']).json()['changes']
+        self.assertEqual({c['id'] for c in renamed}, {kept.id, moved.id, added.id})
+        self.assertEqual({c['room']['name'] for c in renamed}, {'Rimu'})
+
+    def test_bulk_bookings_are_recorded(self):
+        token = self.changes().json()['sync_token']
+        ReservationService.book_series(Reservation(user=self.user, room=self.room, start_time=time(9, 0),
+                                                   end_time=time(10, 0)), 'daily', self.day + timedelta(days=1),
+                                       [self.day, self.day + timedelta(days=1)])
+        self.assertEqual(len(self.changes(token).json()['changes']), 2)
+
+    def test_room_edits_are_recorded_once_and_only_when_calendars_change(self):
+        self.book()
+        self.book(time(11, 0), time(12, 0))
+        ReservationChange.objects.all().delete()
+        staff = User.objects.create(username='staff', is_staff=True)
+        self.client.force_login(staff)
+        url = reverse('reservations:edit_room', args=[self.room.id])
+
+        self.client.post(url, {'name': 'Kahikatea', 'location': 'Level 7', 'capacity': 10})
+        self.assertFalse(ReservationChange.objects.exists())
+        self.client.post(url, {'name': 'Kahikatea', 'location': 'Level 8', 'capacity': 10})
+        self.assertEqual(ReservationChange.objects.count(), 2)
+
+    def test_expired_sync_token(self):
+        token = self.changes().json()['sync_token']
+        with mock.patch('reservations.feeds.time.time', return_value=clock.time() + 31 * 24 * 3600):
+            self.assertEqual(self.changes(token).status_code, 410)
+        self.assertEqual(self.changes('garbage').status_code, 400)
+
+    def test_prune(self):
+        self.book()
+        ReservationChange.objects.update(changed_at=timezone.now() - timedelta(days=31))
+        self.book(time(11, 0), time(12, 0))
+        prune_reservation_changes.apply()
+        self.assertEqual(ReservationChange.objects.count(), 1)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        registry.reset()
+        self.addCleanup(registry.reset)
+        self.staff = User.objects.create_user('quinn', 'quinn@example.com', 'pass12345', is_staff=True)
+        ConferenceRoom.objects.create(name='Matai', location='Level 8', capacity=4)
+        self.client.force_login(self.staff)
+
+    def test_records_time_queries_and_templates(self):
+        self.client.get(reverse('reservations:room_list'))
+        self.client.get(reverse('reservations:room_list'))
+        stats = registry.views['reservations:room_list']
+        self.assertEqual(stats.count, 2)
+        self.assertEqual(sum(stats.buckets), 2)
+        self.assertGreater(stats.queries, 0)
+        self.assertGreater(stats.template_time, 0)
+        self.assertGreaterEqual(stats.total_time, stats.db_time + stats.template_time)
+
+        response = self.client.get(reverse('reservations:admin_panel'))
+        self.assertContains(response, 'reservations:room_list')
+
+    def test_prometheus_endpoint(self):
+        self.client.get(reverse('reservations:room_list'))
+        body = self.client.get(reverse('reservations:metrics')).content.decode()
+        self.assertIn('room_reservation_request_seconds_count{view="reservations:room_list"} 1', body)
+        self.assertIn('room_reservation_request_seconds_bucket{view="reservations:room_list",le="+Inf"} 1', body)
+        self.assertIn('# TYPE room_reservation_db_queries_total counter', body)
+
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('reservations:metrics')).status_code, 403)
+        with override_settings(METRICS_TOKEN='s3cret'):
+            response = self.client.get(reverse('reservations:metrics'), HTTP_AUTHORIZATION='Bearer s3cret')
+            self.assertEqual(response.status_code, 200)
+            response = self.client.get(reverse('reservations:metrics'), HTTP_AUTHORIZATION='Bearer wrong')
+            self.assertEqual(response.status_code, 403)
+
+    def test_smtp_time(self):
+        with mock.patch('django.core.mail.backends.smtp.EmailBackend.send_messages', return_value=1):
+            TimedSMTPBackend().send_messages([mail.EmailMessage('Hi', 'Body', to=['a@example.com'])])
+        self.assertEqual(registry.smtp_sends, 1)
+
+    async def test_stream_stays_on_the_event_loop_under_asgi(self):
+        # If any middleware were sync only, Django would run the chain on a
+        # worker thread, and the metrics would be recorded there
+        broker = InProcessBroker()
+        client = AsyncClient()
+        await client.aforce_login(self.staff)
+        record = registry.record
+        threads = []
+
+        def record_thread(*args):
+            threads.append(threading.current_thread())
+            record(*args)
+
+        with mock.patch.object(events, 'broker', broker), mock.patch.object(registry, 'record', record_thread):
+            response = await client.get(reverse('reservations:api_availability_stream'), {'date': '2030-10-01'})
+            stream = aiter(response.streaming_content)
+            self.assertEqual(await anext(stream), b'retry: 5000\n\n')
+            self.assertEqual(broker.subscriber_count(), 1)
+            await stream.aclose()
+        self.assertEqual(threads, [threading.current_thread()])
+        self.assertEqual(registry.views['reservations:api_availability_stream'].count, 1)
+
+    def test_queries_on_other_threads_count_toward_the_request(self):
+        def query():
+            # A thread of its own, so its own connection
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+            finally:
+                connection.close()
+
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            asyncio.run(sync_to_async(query, thread_sensitive=False)())
+        finally:
+            current_metrics.reset(token)
+        self.assertEqual(metrics.queries, 1)
+
+
+class StaticFilesTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create(username='mere', email='mere@example.com', is_staff=True)
+        self.user = User.objects.create(username='tama', email='tama@example.com')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+
+    def collect(self):
+        call_command('collectstatic', interactive=False, verbosity=0)
+        with open(os.path.join(self.root, 'staticfiles.json')) as f:
+            return json.load(f)['paths']
+
+    def test_collectstatic_writes_hashed_and_compressed_files(self):
+        with override_settings(STATIC_ROOT=self.root):
+            paths = self.collect()
+            hashed = paths['reservations/css/site.css']
+            self.assertRegex(hashed, r'^reservations/css/site\.[0-9a-f]{12}\.css$')
+            self.assertTrue(os.path.exists(os.path.join(self.root, hashed + '.gz')))
+
+            self.client.force_login(self.user)
+            response = self.client.get(reverse('reservations:room_list'))
+            self.assertContains(response, f'href="/static/{hashed}"')
+
+    def test_middleware_serves_hashed_files_for_a_year(self):
+        with override_settings(STATIC_ROOT=self.root):
+            hashed = self.collect()['reservations/css/site.css']
+            client = Client()
+            response = client.get(f'/static/{hashed}', HTTP_ACCEPT_ENCODING='gzip, deflate')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'text/css')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+            self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+            with open(finders.find('reservations/css/site.css'), 'rb') as f:
+                self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), f.read())
+
+            response = client.get(f'/static/{hashed}')
+            self.assertNotIn('Content-Encoding', response)
+
+            response = client.get(f'/static/{hashed}', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(response.status_code, 304)
+
+            # Unhashed names may change on the next deploy
+            response = client.get('/static/reservations/css/site.css')
+            self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+            self.assertEqual(client.get('/static/reservations/css/missing.css').status_code, 404)
+
+    def test_only_the_manifest_is_read_at_startup(self):
+        with override_settings(STATIC_ROOT=self.root):
+            hashed = self.collect()['reservations/css/site.css']
+            with mock.patch('os.walk') as walk, mock.patch('os.path.isfile', wraps=os.path.isfile) as isfile:
+                middleware = StaticFilesMiddleware(lambda request: HttpResponse(status=404))
+                factory = RequestFactory()
+                self.assertEqual(middleware(factory.get('/static/not/in/the/manifest.css')).status_code, 404)
+                self.assertEqual(middleware(factory.get('/static/../settings.py')).status_code, 404)
+                for _ in range(2):
+                    self.assertEqual(middleware(factory.get(f'/static/{hashed}')).status_code, 200)
+            walk.assert_not_called()
+            self.assertEqual(isfile.call_count, 1)
+
+    def test_collected_files_are_committed(self):
+        # The deploy serves STATIC_ROOT as committed, nothing runs collectstatic there
+        manifest = os.path.join(settings.STATIC_ROOT, 'staticfiles.json')
+        self.assertTrue(os.path.exists(manifest), 'run collectstatic and commit staticfiles/')
+        with open(manifest) as f:
+            paths = json.load(f)['paths']
+        for finder in finders.get_finders():
+            for name, _ in finder.list(['CVS', '.*', '*~']):
+                name = name.replace(os.sep, '/')
+                self.assertIn(name, paths, 'run collectstatic and commit staticfiles/')
+                self.assertTrue(os.path.exists(os.path.join(settings.STATIC_ROOT, paths[name])), name)
+
+    def test_accept_encoding_q_values(self):
+        self.assertEqual(accepted_encodings('gzip;q=0, br; q=0.5 ,identity'),
+                         {'gzip': 0.0, 'br': 0.5, 'identity': 1.0})
+        with override_settings(STATIC_ROOT=self.root):
+            hashed = self.collect()['reservations/css/site.css']
+            client = Client()
+            for header, encoding in [('gzip;q=0', None), ('br, gzip;q=0', None), ('*;q=0.3', 'gzip'),
+                                     ('gzip;q=0.8, *;q=0', 'gzip')]:
+                response = client.get(f'/static/{hashed}', HTTP_ACCEPT_ENCODING=header)
+                self.assertEqual(response.get('Content-Encoding'), encoding, header)
+
+    def test_middleware_stays_async_under_asgi(self):
+        async def view(request):
+            return HttpResponse('page')
+
+        with override_settings(STATIC_ROOT=self.root):
+            hashed = self.collect()['reservations/css/site.css']
+            middleware = StaticFilesMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        factory = AsyncRequestFactory()
+        response = asyncio.run(middleware(factory.get(f'/static/{hashed}', headers={'Accept-Encoding': 'gzip'})))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        with open(finders.find('reservations/css/site.css'), 'rb') as f:
+            self.assertEqual(gzip.decompress(response.content), f.read())
+        self.assertEqual(asyncio.run(middleware(factory.get('/rooms/'))).content, b'page')
+
+    def test_pages_link_stylesheets_instead_of_inlining_them(self):
+        self.client.force_login(self.staff)
+        for name in ['room_list', 'make_reservation', 'my_reservations', 'admin_panel', 'user_list']:
+            response = self.client.get(reverse(f'reservations:{name}'))
+            self.assertContains(response, 'reservations/css/site.')
+            self.assertNotContains(response, '<style')
+
+    def test_cached_navigation_matches_the_user(self):
+        admin_link = f'href="{reverse("reservations:admin_panel")}"'
+        self.client.force_login(self.staff)
+        self.assertContains(self.client.get(reverse('reservations:room_list')), admin_link)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('reservations:room_list'))
+        self.assertNotContains(response, admin_link)
+        self.assertContains(response, 'tama')
+
+        # The logout form sits outside the cached fragment, so its token is the session's own
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        page = client.get(reverse('reservations:room_list'))
+        token = page.content.decode().split('name="csrfmiddlewaretoken" value="')[1].split('"')[0]
+        client.post(reverse('logout'), {'csrfmiddlewaretoken': token})
+        self.assertNotIn('_auth_user_id', client.session)
+
+
+class BenchmarkTests(TestCase):
+    def signature(self):
+        return list(Reservation.objects.order_by('id').values_list('room__name', 'user__username', 'date', 'start_time'))
+
+    def test_generator_is_seeded_and_never_double_books(self):
+        created = generators.generate(rooms=5, users=10, reservations=300, days=10, seed=7)
+        self.assertEqual(created, {'rooms': 5, 'users': 10, 'reservations': 300})
+        first = self.signature()
+        for room in ConferenceRoom.objects.all():
+            for day in {r.date for r in room.reservation_set.all()}:
+                booked = list(room.reservation_set.filter(date=day).order_by('start_time'))
+                for earlier, later in zip(booked, booked[1:]):
+                    self.assertLessEqual(earlier.end_time, later.start_time)
+
+        Reservation.objects.all().delete()
+        ConferenceRoom.objects.all().delete()
+        User.objects.all().delete()
+        generators.generate(rooms=5, users=10, reservations=300, days=10, seed=7)
+        self.assertEqual(self.signature(), first)
+
+    def test_runner_reports_each_scenario(self):
+        generators.generate(rooms=5, users=10, reservations=200, days=10, seed=1)
+        results = runner.run([RoomListCold, UserList, ReminderEmails], repeat=2, data={}, log=lambda line: None)
+        self.assertEqual(set(results['results']), {'room_list_cold', 'user_list', 'send_reminder_emails'})
+        for result in results['results'].values():
+            self.assertGreater(result['wall_seconds'], 0)
+            self.assertGreater(result['queries'], 0)
+            self.assertGreater(result['peak_memory_bytes'], 0)
+        json.dumps(results)
+        self.assertEqual(len(runner.compare(results, results)), 4)
+
+    def test_view_queries_counts_every_page_before_and_after(self):
+        generators.generate(rooms=3, users=5, reservations=20, days=5, seed=1)
+        scenario = ViewQueries()
+        scenario.prepare()
+        result = scenario.run()
+        self.assertIn('admin_panel', result['views'])
+        self.assertEqual(result['views']['room_list']['before'] - result['views']['room_list']['after'], 2)
+        self.assertGreater(result['queries_removed'], 0)
+
+    def test_page_bytes_counts_each_stylesheet_once(self):
+        generators.generate(rooms=3, users=5, reservations=20, days=5, seed=1)
+        scenario = PageBytes()
+        scenario.prepare()
+        result = scenario.run()
+        self.assertEqual(set(result['pages']), set(PageBytes.PAGES))
+        self.assertGreater(result['stylesheet_bytes'], 0)
+        self.assertEqual(result['first_visit_bytes'] - result['repeat_visit_bytes'], result['stylesheet_gzip_bytes'])
+
+    def test_metrics_overhead_is_checked_against_its_budget(self):
+        generators.generate(rooms=3, users=5, reservations=20, days=5, seed=1)
+        with mock.patch.object(MetricsOverhead, 'RUNS', 10), mock.patch.object(MetricsOverhead, 'PAGES', 2):
+            results = runner.run([MetricsOverhead], repeat=1, data={}, log=lambda line: None)
+        result = results['results']['metrics_overhead']
+        self.assertGreater(result['page_seconds'], 0)
+        self.assertAlmostEqual(result['overhead_percent'], result['overhead_seconds'] / result['page_seconds'] * 100)
+
+        # Timing is left to run_benchmarks --check, the budget itself is checked here
+        self.assertEqual(MetricsOverhead().check({'overhead_percent': 0.5}), [])
+        results['results']['metrics_overhead'] = {'over_budget': MetricsOverhead().check({'overhead_percent': 2.0})}
+        self.assertEqual(runner.over_budget(results),
+                         ['metrics_overhead: metrics middleware adds 2.00% to a page, over the 1% budget'])
+
+    def test_render_reservation_table_reuses_cached_rows(self):
+        generators.generate(rooms=3, users=5, reservations=60, days=5, seed=1)
+        scenario = RenderReservationTable()
+        scenario.prepare()
+        with self.assertTemplateNotUsed('reservations/rows/admin_reservation.html'):
+            result = scenario.run()
+        self.assertEqual(result['rows'], 60)
+
+
+class StartupTests(SimpleTestCase):
+    def test_cold_start_skips_celery_and_smtp(self):
+        out = StringIO()
+        call_command('startup_benchmark', runs=1, stdout=out)
+        result = json.loads(out.getvalue())
+        self.assertEqual(result['status'], '200 OK')
+        self.assertFalse(result['celery_imported'])
+        self.assertFalse(result['smtp_imported'])
+
+        with self.assertRaisesMessage(CommandError, 'over the 0s budget'):
+            call_command('startup_benchmark', runs=1, budget=0, check=True, stdout=StringIO())
+
+
+class WebImportTimeTests(SimpleTestCase):
+    # How long the import takes is checked by startup_benchmark --check, where a
+    # slow machine can't fail the suite
+    def test_web_startup_skips_celery_and_email(self):
+        env = dict(os.environ, DJANGO_SETTINGS_PROFILE='web')
+        stderr = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'from room_reservation.wsgi import application'],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+        ).stderr
+
+        # Lines look like "import time:  self [us] | cumulative | imported package"
+        modules = {line.rsplit('|', 1)[1].strip() for line in stderr.splitlines()
+                   if line.startswith('import time:') and 'self [us]' not in line}
+        for name in ('celery', 'kombu', 'reservations.tasks', 'smtplib'):
+            self.assertNotIn(name, modules)
+
+
+class CeleryConfigTests(SimpleTestCase):
+    def celery_conf(self, **env):
+        # Load the Celery app the way the celery command does, in a fresh interpreter
+        script = (
+            "import json\n"
+            "from celery.bin.celery import find_app\n"
+            "app = find_app('room_reservation')\n"
+            "conf = app.conf\n"
+            "print(json.dumps({'beat': sorted(conf.beat_schedule), 'prefetch': conf.worker_prefetch_multiplier,\n"
+            "                  'acks_late': conf.task_acks_late, 'eager': conf.task_always_eager,\n"
+            "                  'broker': conf.broker_url, 'imports': list(conf.imports)}))\n"
+        )
+        output = subprocess.run([sys.executable, '-c', script], cwd=settings.BASE_DIR, env=dict(os.environ, **env),
+                                capture_output=True, text=True, check=True).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+    def test_routes_keep_bulk_email_away_from_reminders(self):
+        def queue(name):
+            return celery_app.amqp.router.route({}, name)['queue'].name
+
+        self.assertEqual(queue('reservations.tasks.send_reminder_emails'), 'reminders')
+        self.assertEqual(queue('reservations.tasks.drain_email_outbox'), 'email')
+        self.assertEqual(queue('reservations.tasks.notify_room_renamed'), 'bulk_email')
+        self.assertEqual(queue('reservations.tasks.notify_room_deleted'), 'bulk_email')
+        self.assertEqual(queue('reservations.tasks.run_user_job'), 'bulk')
+
+    def test_worker_profile_has_schedule_and_tuning(self):
+        conf = self.celery_conf()
+        self.assertEqual(conf['beat'], ['drain-email-outbox', 'prune-expired-sessions', 'prune-reservation-changes',
+                                        'send-reminder-emails'])
+        self.assertEqual(conf['prefetch'], 1)
+        self.assertTrue(conf['acks_late'])
+        self.assertEqual(conf['imports'], ['reservations.tasks'])
+
+    def test_local_mode_needs_no_redis(self):
+        conf = self.celery_conf(CELERY_LOCAL='True')
+        self.assertTrue(conf['eager'])
+        self.assertEqual(conf['broker'], 'memory://')
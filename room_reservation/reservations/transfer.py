@@ -0,0 +1,294 @@
+import csv
+from datetime import datetime, timezone as dt_timezone
+from itertools import islice
+from django.contrib.auth.models import User
+from django.db.models import Q
+from django.utils import timezone
+from .availability import invalidate_all
+from .events import publish_resync
+from .forms import ConferenceRoomForm
+from .listing import filter_reservations
+from .models import ConferenceRoom, Reservation
+from .services import ReservationService
+from .signals import reservations_created
+
+# Rows validated and inserted together when importing
+IMPORT_BATCH_SIZE = 500
+
+# Rows fetched from the database at a time when exporting
+EXPORT_CHUNK_SIZE = 2000
+
+# CSV columns, exports use the same ones so a file can be imported again
+ROOM_COLUMNS = ['name', 'location', 'capacity']
+RESERVATION_COLUMNS = ['room', 'user', 'date', 'start_time', 'end_time']
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.errors = []  # (line number, message)
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def csv_rows(lines, columns):
+    # (line number, row) for each row of a CSV file with the given header columns
+    reader = csv.DictReader(lines)
+    missing = set(columns) - {name.strip() for name in reader.fieldnames or []}
+    if missing:
+        raise ValueError(f"The CSV file needs a header row with the columns {', '.join(columns)}.")
+    for row in reader:
+        yield reader.line_num, {key.strip(): (value or '').strip() for key, value in row.items() if key}
+
+
+def import_rooms(rows, batch_size=IMPORT_BATCH_SIZE):
+    """Create rooms from (line number, row) pairs, checked by ConferenceRoomForm.
+
+    Invalid rows are reported and skipped. Each batch is saved with one bulk insert.
+    """
+    result = ImportResult()
+    for batch in batches(rows, batch_size):
+        rooms = []
+        for line, row in batch:
+            form = ConferenceRoomForm(row)
+            if form.is_valid():
+                rooms.append(form.save(commit=False))
+            else:
+                result.errors.append((line, ' '.join(error for errors in form.errors.values() for error in errors)))
+        ConferenceRoom.objects.bulk_create(rooms)
+        result.created += len(rooms)
+    if result.created:
+        # bulk_create doesn't send post_save, so clear the cached availability here
+        invalidate_all()
+    return result
+
+
+def parse_reservation(row, default_user=None):
+    # Check one row's values, raising ValueError with a message for the user
+    if row.get('error'):
+        raise ValueError(row['error'])
+    if not row.get('room'):
+        raise ValueError('Missing room.')
+    username = row.get('user') or default_user
+    if not username:
+        raise ValueError('Missing user.')
+    try:
+        day = datetime.strptime(row.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f"Invalid date \"{row.get('date', '')}\", use YYYY-MM-DD.")
+    try:
+        start_time = datetime.strptime(row.get('start_time', ''), '%H:%M').time()
+        end_time = datetime.strptime(row.get('end_time', ''), '%H:%M').time()
+    except ValueError:
+        raise ValueError('Invalid start or end time, use HH:MM.')
+    if end_time <= start_time:
+        raise ValueError('The end time must be after the start time.')
+    return {'room': row['room'], 'user': username, 'date': day, 'start_time': start_time, 'end_time': end_time}
+
+
+def import_reservations(rows, default_user=None, batch_size=IMPORT_BATCH_SIZE):
+    """Create reservations from (line number, row) pairs with room names and usernames.
+
+    Each batch costs a few queries whatever its size: one each to look up its
+    rooms and users, and one for the reservations on the same rooms and days,
+    all under the booking lock of its rooms, then one bulk insert. Rows that are
+    invalid or clash with another booking are reported and skipped.
+    """
+    result = ImportResult()
+    for batch in batches(rows, batch_size):
+        parsed = []
+        for line, row in batch:
+            try:
+                parsed.append((line, parse_reservation(row, default_user)))
+            except ValueError as e:
+                result.errors.append((line, str(e)))
+        if not parsed:
+            continue
+
+        room_ids = {}
+        for room_id, name in ConferenceRoom.objects.filter(name__in={r['room'] for _, r in parsed}).values_list('id', 'name'):
+            room_ids.setdefault(name, []).append(room_id)
+        user_ids = dict(User.objects.filter(username__in={r['user'] for _, r in parsed}).values_list('username', 'id'))
+
+        valid = []
+        for line, r in parsed:
+            if len(room_ids.get(r['room'], [])) != 1:
+                result.errors.append((line, f"No single room is called \"{r['room']}\"."))
+            elif r['user'] not in user_ids:
+                result.errors.append((line, f"There is no user \"{r['user']}\"."))
+            else:
+                valid.append((line, r, room_ids[r['room']][0]))
+        if not valid:
+            continue
+
+        # Only the days each room is booked for in this batch, so a file spanning
+        # years doesn't load every booking in between
+        days_by_room = {}
+        for _, r, room_id in valid:
+            days_by_room.setdefault(room_id, set()).add(r['date'])
+        same_days = Q()
+        for room_id, days in days_by_room.items():
+            same_days |= Q(room_id=room_id, date__in=days)
+
+        with ReservationService.booking(*days_by_room):
+            booked = {}
+            for room_id, day, start_time, end_time in Reservation.objects.filter(same_days).values_list(
+                    'room_id', 'date', 'start_time', 'end_time'):
+                booked.setdefault((room_id, day), []).append((start_time, end_time))
+
+            reservations = []
+            for line, r, room_id in valid:
+                intervals = booked.setdefault((room_id, r['date']), [])
+                if any(start < r['end_time'] and end > r['start_time'] for start, end in intervals):
+                    result.errors.append((line, f"{r['room']} is already booked at that time."))
+                    continue
+                intervals.append((r['start_time'], r['end_time']))
+                reservations.append(Reservation(
+                    user_id=user_ids[r['user']],
+                    room_id=room_id,
+                    date=r['date'],
+                    start_time=r['start_time'],
+                    end_time=r['end_time'],
+                    start_at=Reservation.combine_start(r['date'], r['start_time']),
+                ))
+            reservations_created(Reservation.objects.bulk_create(reservations))
+            # Live clients reload the imported dates once the batch commits
+            publish_resync({reservation.date for reservation in reservations})
+        result.created += len(reservations)
+    return result
+
+
+def ics_escape(value):
+    return value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def ics_text(name, value):
+    # A text property line, folded onto continuation lines past 75 characters
+    line = f'{name}:{ics_escape(value)}'
+    return '\r\n '.join(line[i:i + 74] for i in range(0, len(line), 74)) + '\r\n'
+
+
+def ics_unescape(value):
+    return value.replace('\\n', '\n').replace('\\N', '\n').replace('\\,', ',').replace('\\;', ';').replace('\\\\', '\\')
+
+
+def ics_datetime(day, at):
+    return Reservation.combine_start(day, at).astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def parse_ics_datetime(value):
+    # UTC (ending in Z) or floating time, which is taken as the site's time zone
+    if value.endswith('Z'):
+        moment = timezone.localtime(datetime.strptime(value, '%Y%m%dT%H%M%SZ').replace(tzinfo=dt_timezone.utc))
+    else:
+        moment = datetime.strptime(value, '%Y%m%dT%H%M%S')
+    return moment.date(), moment.time()
+
+
+def unfold(lines):
+    # Join ICS lines that were folded onto continuation lines starting with a space
+    current = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if current is not None and line[:1] in (' ', '\t'):
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current is not None:
+        yield current
+
+
+def ics_rows(lines):
+    """(event number, row) for each VEVENT, in the same shape as the CSV rows.
+
+    The room is the SUMMARY and the user is X-RESERVATION-USER, which is how
+    exports write them.
+    """
+    event = None
+    number = 0
+    for line in unfold(lines):
+        name, _, value = line.partition(':')
+        name = name.split(';')[0].upper()
+        if name == 'BEGIN' and value.upper() == 'VEVENT':
+            number += 1
+            event = {}
+        elif name == 'END' and value.upper() == 'VEVENT' and event is not None:
+            yield number, ics_event_row(event)
+            event = None
+        elif event is not None:
+            event[name] = value
+
+
+def ics_event_row(event):
+    row = {'room': ics_unescape(event.get('SUMMARY', '')).strip(),
+           'user': ics_unescape(event.get('X-RESERVATION-USER', '')).strip()}
+    try:
+        day, start_time = parse_ics_datetime(event.get('DTSTART', ''))
+        end_day, end_time = parse_ics_datetime(event.get('DTEND', ''))
+    except ValueError:
+        row['error'] = 'Invalid DTSTART or DTEND.'
+        return row
+    if end_day != day:
+        row['error'] = 'Reservations must start and end on the same day.'
+        return row
+    row.update(date=day.isoformat(), start_time=start_time.strftime('%H:%M'), end_time=end_time.strftime('%H:%M'))
+    return row
+
+
+def export_rows(**filters):
+    # Reservations matching ReservationFilterForm's filters, as plain tuples
+    return filter_reservations(Reservation.objects.order_by('date', 'start_time', 'id'), **filters).values_list(
+        'id', 'room__name', 'room__location', 'user__username', 'date', 'start_time', 'end_time'
+    )
+
+
+class Echo:
+    # csv.writer target that returns each row instead of keeping it
+    def write(self, value):
+        return value
+
+
+def reservations_csv(rows):
+    """Yield a CSV export of export_rows() a chunk at a time.
+
+    Rows are read with iterator(), so memory stays flat however many there are.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(RESERVATION_COLUMNS)
+    lines = (
+        writer.writerow([room, username, day.isoformat(), start_time.strftime('%H:%M'), end_time.strftime('%H:%M')])
+        for _, room, _, username, day, start_time, end_time in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    for chunk in batches(lines, EXPORT_CHUNK_SIZE):
+        yield ''.join(chunk)
+
+
+def reservations_ics(rows, calendar_name='Room reservations'):
+    # Same as reservations_csv, as an iCalendar file
+    stamp = timezone.now().astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    yield ('BEGIN:VCALENDAR\r\n'
+           'VERSION:2.0\r\n'
+           'PRODID:-//Te Whare Runaga//Conference Room Booking//EN\r\n'
+           + ics_text('X-WR-CALNAME', calendar_name))
+    events = (
+        'BEGIN:VEVENT\r\n'
+        f'UID:reservation-{reservation_id}@room-reservation\r\n'
+        f'DTSTAMP:{stamp}\r\n'
+        f'DTSTART:{ics_datetime(day, start_time)}\r\n'
+        f'DTEND:{ics_datetime(day, end_time)}\r\n'
+        + ics_text('SUMMARY', room)
+        + ics_text('LOCATION', location)
+        + ics_text('X-RESERVATION-USER', username)
+        + 'END:VEVENT\r\n'
+        for reservation_id, room, location, username, day, start_time, end_time
+        in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    for chunk in batches(events, EXPORT_CHUNK_SIZE):
+        yield ''.join(chunk)
+    yield 'END:VCALENDAR\r\n'
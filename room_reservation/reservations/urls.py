@@ -1,10 +1,11 @@
 from django.urls import path
-from . import views
+from . import views, api
 from django.contrib.auth import views as auth_views
 app_name = 'reservations'
 
 urlpatterns = [
     path('', views.room_list, name='room_list'),
+    path('calendar/', views.room_calendar, name='room_calendar'),
     path('reserve/', views.make_reservation, name='make_reservation'),
     path('my_reservations/', views.my_reservations, name='my_reservations'),
     path('reservation/edit/<int:reservation_id>/', views.edit_reservation, name='edit_reservation'),
@@ -15,11 +16,24 @@ urlpatterns = [
     path('rooms/delete/<int:room_id>/', views.delete_room, name='delete_room'),
     path('admin-reserve/', views.admin_make_reservation, name='admin_make_reservation'),
     path('reservations/', views.view_all_reservations, name='admin_reservations'),
+    path('reservations/export/', views.export_reservations, name='export_reservations'),
+    path('import/', views.import_data, name='import_data'),
     path('admin-reservation/cancel/<int:reservation_id>/', views.admin_cancel_reservation, name='admin_cancel_reservation'),
     path('users/', views.user_list, name='user_list'),
+    path('users/bulk/', views.user_bulk_action, name='user_bulk_action'),
     path('user/<int:user_id>/edit/', views.edit_user, name='edit_user'),
     path('user/<int:user_id>/delete/', views.delete_user, name='delete_user'),
     path('user/add/', views.add_user, name='add_user'),
     path('admin_panel/', views.admin_panel, name='admin_panel'),
+    path('utilization/', views.room_utilization, name='room_utilization'),
+    path('api/availability/', api.availability, name='api_availability'),
+    path('api/availability/stream/', api.availability_stream, name='api_availability_stream'),
+    path('api/free-slots/', api.free_slots, name='api_free_slots'),
+    path('api/lookup/users/', api.user_lookup, name='api_user_lookup'),
+    path('api/lookup/rooms/', api.room_lookup, name='api_room_lookup'),
+    path('calendar/feed/<str:token>.ics', api.calendar_feed, name='calendar_feed'),
+    path('calendar/feed/<str:token>/changes/', api.calendar_changes, name='calendar_changes'),
+    path('metrics/', api.metrics, name='metrics'),
+    path('calendar/feed/reset/', views.reset_calendar_feed, name='reset_calendar_feed'),
 
 ]
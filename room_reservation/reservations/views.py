@@ -3,22 +3,31 @@ from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import login, authenticate
 from django.contrib import messages
 from django.utils import timezone
+from django.db import transaction
 from django.db.models import Q
-from datetime import datetime, time
+from django.http import StreamingHttpResponse
+import io
+from calendar import monthrange
+from datetime import datetime, time, timedelta
+from itertools import islice
 from .forms import CustomUserCreationForm, ConferenceRoomForm, ReservationForm
-from .models import ConferenceRoom, Reservation
-from .forms import AdminReservationForm
-from django.core.mail import send_mail
-from django.conf import settings
+from .models import CancelledBooking, ConferenceRoom, Reservation, UserJob
+from .forms import AdminReservationForm, ReservationFilterForm, ImportForm, UserFilterForm, UserBulkActionForm
+from .availability import availability_for_date, room_availability
+from .services import ReservationService, BookingConflict
+from .listing import reservation_page
+from .fragments import render_rows
+from .accounts import user_page, start_user_job, delete_users
+from .occupancy import OccupancyGrid, utilization, least_busy_rooms
+from .outbox import queue_email, enqueue_after_commit
+from .events import publish_change
+from .signals import RESERVATION_DELETE_BATCH, delete_reservations
+from .feeds import get_feed, reset_feed
+from .metrics import registry as metrics_registry
+from . import transfer
 from django.contrib.auth.models import User
 from django.shortcuts import render, redirect, get_object_or_404
-
-@staff_member_required
-def view_all_reservations(request):
-    reservations = Reservation.objects.all().order_by('-date', 'start_time')
-    return render(request, 'reservations/admin_reservations.html', {
-        'reservations': reservations
-    })
+from django.urls import reverse
 
 # Login page
 def login_view(request):
@@ -59,24 +68,13 @@ def room_list(request):
     # get the current time for availability
     current_time = timezone.now().time()
 
-    # get all rooms
-    rooms = ConferenceRoom.objects.all()
-
-    # find all reservations for that specific date
-    reservations = Reservation.objects.filter(date=selected_date)
-
-# Attach availability status to each room
-    for room in rooms:
-        room_reservations = reservations.filter(room=room).order_by('start_time')
-        room.is_available = not room_reservations.exists()
-
-        # store the time slots of rooms
-        room.booking_times = []
-        for res in room_reservations:
-            room.booking_times.append({
-                'start': res.start_time.strftime('%I:%M %p').lstrip('0'),
-                'end': res.end_time.strftime('%I:%M %p').lstrip('0')
-            })
+    # get all rooms with their bookings for that specific date
+    rooms = []
+    for availability in availability_for_date(selected_date):
+        room = availability.room
+        room.is_available = availability.is_available
+        room.booking_times = availability.booking_times  # store the time slots of rooms
+        rooms.append(room)
 
     context = {
         'rooms': rooms,
@@ -88,7 +86,37 @@ def room_list(request):
 
 
 
-# Make a reservation
+# Week or month calendar of every room
+@login_required
+def room_calendar(request):
+    view = 'month' if request.GET.get('view') == 'month' else 'week'
+    try:
+        selected_date = datetime.strptime(request.GET.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        selected_date = timezone.now().date()
+
+    if view == 'month':
+        start_date = selected_date.replace(day=1)
+        days = monthrange(start_date.year, start_date.month)[1]
+        previous_date = (start_date - timedelta(days=1)).replace(day=1)
+        next_date = start_date + timedelta(days=days)
+    else:
+        # Weeks start on Monday
+        start_date = selected_date - timedelta(days=selected_date.weekday())
+        days = 7
+        previous_date = start_date - timedelta(days=7)
+        next_date = start_date + timedelta(days=7)
+
+    grid = OccupancyGrid.load(start_date, days)
+    return render(request, 'reservations/room_calendar.html', {
+        'view': view,
+        'days': grid.days,
+        'rows': grid.rows(),
+        'previous_date': previous_date,
+        'next_date': next_date,
+    })
+
+
 # Make a reservation
 @login_required
 def make_reservation(request):
@@ -98,28 +126,60 @@ def make_reservation(request):
 
     if request.method == 'POST':
         form = ReservationForm(request.POST)
-        if form.is_valid():
+        if form.is_valid() and form.occurrences:
             reservation = form.save(commit=False)
             reservation.user = request.user
 
-            # Check for overlapping reservations
-            overlapping = Reservation.objects.filter(
-                room=reservation.room,
-                date=reservation.date,
-                start_time__lt=reservation.end_time,
-                end_time__gt=reservation.start_time
-            ).exists()
+            # Repeating booking: every date is checked and saved together, with one summary email
+            try:
+                with transaction.atomic():
+                    occurrences = ReservationService.book_series(
+                        reservation, form.cleaned_data['repeat'], form.cleaned_data['repeat_until'], form.occurrences)
+                    for occurrence in occurrences:
+                        publish_change('created', occurrence)
 
-            if overlapping:
-                messages.error(request,
-                               'The time slot for this room has been taken, please select a different time or room.')
+                    user_email = request.user.email
+                    if user_email:
+                        subject = f'Repeating Room Reservation Confirmation - {reservation.room.name}'
+                        dates = "\n".join(f"                - {o.date.strftime('%d-%m-%Y')}" for o in occurrences)
+                        message = f"""
+                Hello {request.user.username},
+
+                Your repeating reservation has been confirmed for {len(occurrences)} dates:
+
+                Room: {reservation.room.name}
+                Time: {reservation.start_time.strftime('%I:%M %p').lstrip('0')} - {reservation.end_time.strftime('%I:%M %p').lstrip('0')}
+                Dates:
+{dates}
+
+                Thank you!
+                Te Whare Runaga Conference Room Booking System
+                """
+                        queue_email(subject, message, user_email)
+            except BookingConflict as e:
+                clashes = ', '.join(day.strftime('%d-%m-%Y') for day in e.dates[:10])
+                if len(e.dates) > 10:
+                    clashes += f' and {len(e.dates) - 10} more'
+                messages.error(request, f'The room is already booked at this time on {clashes}. '
+                                        'Skip those dates or choose a different time or room.')
             else:
-                reservation.save()
+                messages.success(request, f'{len(occurrences)} reservations created successfully!')
+                return redirect('reservations:my_reservations')
+        elif form.is_valid():
+            reservation = form.save(commit=False)
+            reservation.user = request.user
 
-                user_email = reservation.user.email
-                if user_email:
-                    subject = f'Room Reservation Confirmation - {reservation.room.name}'
-                    message = f"""
+            # Book the room, this fails if the time overlaps another reservation.
+            # The confirmation email is queued in the same transaction and sent in the background
+            try:
+                with transaction.atomic():
+                    ReservationService.book(reservation)
+                    publish_change('created', reservation)
+
+                    user_email = reservation.user.email
+                    if user_email:
+                        subject = f'Room Reservation Confirmation - {reservation.room.name}'
+                        message = f"""
                 Hello {request.user.username},
 
                 Your reservation has been confirmed:
@@ -131,24 +191,16 @@ def make_reservation(request):
                 Thank you!
                 Te Whare Runaga Conference Room Booking System
                 """
-
-                try:
-                    send_mail(
-                        subject=subject,
-                        message=message,
-                        from_email=settings.DEFAULT_FROM_EMAIL,
-                        recipient_list=[user_email],
-                        fail_silently=False,
-                    )
+                        queue_email(subject, message, user_email)
+            except BookingConflict:
+                messages.error(request,
+                               'The time slot for this room has been taken, please select a different time or room.')
+            else:
+                if user_email:
                     messages.success(request,
                                      'Reservation created successfully! A confirmation email has been sent to you.')
-                except Exception as e:
-                    # log error but do not fail reservation
-                    import logging
-                    logger = logging.getLogger(__name__)
-                    logger.error(f"failed to send confirmation email: {str(e)}")
-                    messages.success(request, 'Reservation created successfully! (Email notification failed to send)')
-
+                else:
+                    messages.success(request, 'Reservation created successfully!')
                 return redirect('reservations:my_reservations')
     else:
 
@@ -167,7 +219,15 @@ def make_reservation(request):
 
         form = ReservationForm(initial=initial_data)
 
-    return render(request, 'reservations/make_reservation.html', {'form': form})
+    # Show what is already booked for the chosen room and date
+    availability = None
+    chosen = getattr(form, 'cleaned_data', None) if form.is_bound else form.initial
+    room = chosen.get('room') if chosen else None
+    selected_date = chosen.get('date') if chosen else None
+    if room and selected_date:
+        availability = room_availability(room, selected_date)
+
+    return render(request, 'reservations/make_reservation.html', {'form': form, 'availability': availability})
 
 
 # View the user's reservations
@@ -183,13 +243,25 @@ def my_reservations(request):
         # This ensures we don't get past reservations from today
         Q(date__gt=now.date()) |
         Q(date=now.date(), end_time__gt=now.time())
-    ).order_by('date', 'start_time')
+    ).select_related('room').order_by('date', 'start_time')
 
+    feed = get_feed(request.user)
     return render(request, 'reservations/my_reservations.html', {
-        'reservations': reservations
+        'reservations': reservations,
+        'rows': render_rows('reservations/rows/my_reservation.html', reservations, vary_on=['room.name']),
+        'feed_url': request.build_absolute_uri(reverse('reservations:calendar_feed', args=[feed.token])),
     })
 
 
+# Replace the calendar feed link, e.g. if it was shared by mistake
+@login_required
+def reset_calendar_feed(request):
+    if request.method == 'POST':
+        reset_feed(request.user)
+        messages.success(request, 'Your calendar link has been replaced, subscribe again with the new one.')
+    return redirect('reservations:my_reservations')
+
+
 # Add a new conference room (Staff only access)
 @staff_member_required
 def add_room(request):
@@ -234,29 +306,23 @@ def register(request):
 @login_required
 def edit_reservation(request, reservation_id):
     reservation = get_object_or_404(Reservation, id=reservation_id, user=request.user)
+    previous_date = reservation.date
     if request.method == 'POST':
         form = ReservationForm(request.POST, instance=reservation)
         if form.is_valid():
             updated_reservation = form.save(commit=False)
 
-            # Exclude current reservation from overlapping checks
-            overlapping = Reservation.objects.filter(
-                room=updated_reservation.room,
-                date=updated_reservation.date,
-                start_time__lt=updated_reservation.end_time,
-                end_time__gt=updated_reservation.start_time
-            ).exclude(id=reservation_id).exists()
-
-            if overlapping:
-                messages.error(request, 'This room is already booked for the selected time slot. Please choose a different time or room.')
-            else:
-                updated_reservation.save()
+            # The current reservation is excluded from the overlap check
+            try:
+                with transaction.atomic():
+                    ReservationService.book(updated_reservation)
+                    publish_change('updated', updated_reservation, previous_date)
 
-                # Send the user an email after updating reservation
-                user_email = updated_reservation.user.email
-                if user_email:
-                    subject = f'Room Reservation Updated - {updated_reservation.room.name}'
-                    message = f"""
+                    # Send the user an email after updating reservation
+                    user_email = updated_reservation.user.email
+                    if user_email:
+                        subject = f'Room Reservation Updated - {updated_reservation.room.name}'
+                        message = f"""
                 Hello {updated_reservation.user.username},
                 
                 Your reservation for {updated_reservation.room.name} has been updated.
@@ -268,19 +334,10 @@ def edit_reservation(request, reservation_id):
                 Thank you!
                 Te Whare Runaga Conference Room Booking System
                 """
-                    try:
-                        send_mail(
-                            subject=subject,
-                            message=message,
-                            from_email=settings.DEFAULT_FROM_EMAIL,
-                            recipient_list=[user_email],
-                            fail_silently=False,
-                        )
-                    except Exception as e:
-                        import logging
-                        logger = logging.getLogger(__name__)
-                        logger.error(f'Failed to send reservation update email: {str(e)}')
-
+                        queue_email(subject, message, user_email)
+            except BookingConflict:
+                messages.error(request, 'This room is already booked for the selected time slot. Please choose a different time or room.')
+            else:
                 messages.success(request, 'Reservation updated successfully!')
                 return redirect('reservations:my_reservations')
     else:
@@ -301,13 +358,14 @@ def cancel_reservation(request, reservation_id):
         reservation_date = reservation.date
         start_time = reservation.start_time
         end_time = reservation.end_time
-        reservation.delete()
-        messages.success(request, 'Reservation canceled successfully!')
+        with transaction.atomic():
+            publish_change('cancelled', reservation)
+            reservation.delete()
 
-        # Once the user has canceled their reservation:
-        if user_email:
-            subject = f'Room Reservation Canceled - {reservation.room.name}'
-            message = f"""
+            # Once the user has canceled their reservation:
+            if user_email:
+                subject = f'Room Reservation Canceled - {room_name}'
+                message = f"""
         Hello {request.user.username},
         
         Your reservation for room {room_name} has been canceled.
@@ -319,18 +377,8 @@ def cancel_reservation(request, reservation_id):
         Thank you!
         Te Whare Runaga Conference Room Booking System
         """
-            try:
-                send_mail(
-                    subject=subject,
-                    message=message,
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    recipient_list=[user_email],
-                    fail_silently=False,
-                )
-            except Exception as e:
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.error(f"failed to send cancellation email: {str(e)}")
+                queue_email(subject, message, user_email)
+        messages.success(request, 'Reservation canceled successfully!')
 
     return redirect('reservations:my_reservations')
 
@@ -345,40 +393,10 @@ def edit_room(request, room_id):
         form = ConferenceRoomForm(request.POST, instance=room)
         if form.is_valid():
             updated_room = form.save()
-            updated_room.save()
 
-            # if the room name has changed recently, send an email notification to users with reservations:
+            # if the room name has changed recently, email users with reservations in the background
             if old_room_name != updated_room.name:
-                reservations = Reservation.objects.filter(room=room)
-                for res in reservations:
-                    user_email = res.user.email
-                    if user_email:
-                        subject = f'Room Name Changed - {updated_room.name}'
-                        message = f"""
-                    Hello {res.user.username},
-                    
-                    Please note that the room you have a reservation for has been updated:
-                    
-                    Old Room Name: {old_room_name}
-                    New Room Name: {updated_room.name}
-                    Date: {res.date.strftime('%d-%m-%Y')}
-                    Time: {res.start_time.strftime('%I:%M %p')}-{res.end_time.strftime('%I:%M %p')}
-                    
-                    Thank you!
-                    Te Whare Runaga Conference Room Booking System staff
-                    """
-                        try:
-                            send_mail(
-                                subject=subject,
-                                message=message,
-                                from_email=settings.DEFAULT_FROM_EMAIL,
-                                recipient_list=[user_email],
-                                fail_silently=False,
-                            )
-                        except Exception as e:
-                            import logging
-                            logger = logging.getLogger(__name__)
-                            logger.error(f'Failed to send room name change email: {str(e)}')
+                enqueue_after_commit('notify_room_renamed', updated_room.id, old_room_name)
             messages.success(request, 'Room updated successfully!')
             return redirect('reservations:room_list')
 
@@ -395,42 +413,30 @@ def delete_room(request, room_id):
     room = get_object_or_404(ConferenceRoom, id=room_id)
 
     if request.method == 'POST':
-        # get all reservations in current room before deletion
-        reservations = Reservation.objects.filter(room=room)
-        for res in reservations:
-            user_email = res.user.email
-            if user_email:
-                subject = f'Room Reservation Canceled - {room.name}'
-                message = f"""
-            Hello {res.user.username},
-            
-            Unfortunately, the room you have a reservation for has been deleted by our staff.
-            As a result of this, your reservation has been canceled.
-            
-            Date: {res.date.strftime('%d-%m-%Y')}
-            Time: {res.start_time.strftime('%I:%M %p')}-{res.end_time.strftime('%I:%M %p')}
-            
-            Please choose another one of our rooms that may suit your needs.
-            Thank you!
-            Te Whare Runaga Conference Room Booking System staff
-            """
-                try:
-                    send_mail(
-                        subject=subject,
-                        message=message,
-                        from_email=settings.DEFAULT_FROM_EMAIL,
-                        recipient_list=[user_email],
-                        fail_silently=False,
-                    )
-                except Exception as e:
-                    import logging
-                    logger = logging.getLogger(__name__)
-                    logger.error(f"failed to send cancellation email: {str(e)}")
-
-        # delete all reservations for this room
-        reservations.delete()
-        room.delete()
-        messages.success(request, 'Room deleted successfully! Any users with existing reservations have been emailed.')
+        with transaction.atomic():
+            reservations = Reservation.objects.filter(room=room)
+            # The worker emails the owners from copies of the bookings, written
+            # in chunks so neither the request nor the task holds them all
+            booked = reservations.exclude(user__email='').values_list(
+                'user__email', 'user__username', 'date', 'start_time', 'end_time')
+            rows = (CancelledBooking(room_id=room.id, room_name=room.name, email=email, username=username,
+                                     date=day, start_time=start, end_time=end)
+                    for email, username, day, start, end in booked.iterator(chunk_size=RESERVATION_DELETE_BATCH))
+            copied = 0
+            while chunk := list(islice(rows, RESERVATION_DELETE_BATCH)):
+                CancelledBooking.objects.bulk_create(chunk)
+                copied += len(chunk)
+
+            # Reservations go in batches rather than one post_delete each in the
+            # cascade. The room's occupancy rows are deleted with it
+            delete_reservations(reservations, refresh=False)
+            room_id = room.id
+            room.delete()
+
+            # The emails are sent in the background once the delete is committed
+            if copied:
+                enqueue_after_commit('notify_room_deleted', room_id)
+        messages.success(request, 'Room deleted successfully! Any users with existing reservations are being emailed.')
         return redirect('reservations:room_list')
 
     messages.info(request, f'Room "{room.name}" deletion cancelled')
@@ -441,14 +447,17 @@ def admin_make_reservation(request):
     if request.method == 'POST':
         form = AdminReservationForm(request.POST)
         if form.is_valid():
-            reservation = form.save()
-
+            reservation = form.save(commit=False)
+            try:
+                with transaction.atomic():
+                    ReservationService.book(reservation)
+                    publish_change('created', reservation)
 
-            # send user a confirmation email on behalf of an admin.
-            user_email = reservation.user.email
-            if user_email:
-                subject = f'Room Reservation confirmation on behalf of our staff - {reservation.room.name}'
-                message = f"""
+                    # send user a confirmation email on behalf of an admin.
+                    user_email = reservation.user.email
+                    if user_email:
+                        subject = f'Room Reservation confirmation on behalf of our staff - {reservation.room.name}'
+                        message = f"""
                 Hello {reservation.user.username},
 
                 Our staff have created a reservation for you on your behalf:
@@ -460,21 +469,13 @@ def admin_make_reservation(request):
                 Thank you!
                 Te Whare Runaga Conference Room Booking System staff
                 """
+                        queue_email(subject, message, user_email)
+            except BookingConflict:
+                messages.error(request, 'This room is already booked for the selected time slot. Please choose a different time or room.')
+                return render(request, 'reservations/admin_make_reservation.html', {'form': form})
 
-                try:
-                    send_mail(
-                        subject=subject,
-                        message=message,
-                        from_email=settings.DEFAULT_FROM_EMAIL,
-                        recipient_list=[user_email],
-                        fail_silently=False,
-                    )
-                    messages.success(request, 'Reservation created successfully! A confirmation email has been sent to the user')
-                except Exception as e:
-                    import logging
-                    logger = logging.getLogger(__name__)
-                    logger.error(f"failed to send confirmation email (admin reservation): {str(e)}")
-                    messages.success(request, 'Reservation created successfully! (Email notification failed to send)')
+            if user_email:
+                messages.success(request, 'Reservation created successfully! A confirmation email has been sent to the user')
             else:
                 messages.success(request, 'Reservation created successfully, but this user does not have an email on their account')
 
@@ -488,8 +489,79 @@ def admin_make_reservation(request):
 # Oversee all reservations and cancel reservations, meant for staff only
 @staff_member_required
 def view_all_reservations(request):
-    reservations = Reservation.objects.all().order_by('-date', 'start_time')
-    return render(request, 'reservations/admin_reservations.html', {'reservations': reservations})
+    form = ReservationFilterForm(request.GET or None)
+    filters = form.cleaned_data if form.is_valid() else {}
+    reservations, next_cursor = reservation_page(after=request.GET.get('after'), **filters)
+
+    # Keep the filters in the page links
+    next_query = first_query = None
+    if next_cursor:
+        query = request.GET.copy()
+        query['after'] = next_cursor
+        next_query = query.urlencode()
+    if 'after' in request.GET:
+        query = request.GET.copy()
+        del query['after']
+        first_query = query.urlencode()
+    # Exports cover every page
+    export_query = request.GET.copy()
+    export_query.pop('after', None)
+
+    return render(request, 'reservations/admin_reservations.html', {
+        'form': form,
+        'reservations': reservations,
+        'rows': render_rows('reservations/rows/admin_reservation.html', reservations,
+                            vary_on=['user.username', 'room.name']),
+        'next_query': next_query,
+        'first_query': first_query,
+        'export_query': export_query.urlencode(),
+    })
+
+# Download the filtered reservations as CSV or ICS, streamed so any number of rows fits in memory
+@staff_member_required
+def export_reservations(request):
+    form = ReservationFilterForm(request.GET or None)
+    filters = form.cleaned_data if form.is_valid() else {}
+    rows = transfer.export_rows(**filters)
+    if request.GET.get('format') == 'ics':
+        response = StreamingHttpResponse(transfer.reservations_ics(rows), content_type='text/calendar; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="reservations.ics"'
+    else:
+        response = StreamingHttpResponse(transfer.reservations_csv(rows), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="reservations.csv"'
+    return response
+
+# Import rooms or reservations from an uploaded CSV or ICS file
+@staff_member_required
+def import_data(request):
+    result = None
+    if request.method == 'POST':
+        form = ImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            # Read the upload a line at a time rather than all at once
+            lines = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+            try:
+                if form.cleaned_data['kind'] == ImportForm.ROOMS:
+                    result = transfer.import_rooms(transfer.csv_rows(lines, transfer.ROOM_COLUMNS))
+                else:
+                    if upload.name.lower().endswith('.ics'):
+                        rows = transfer.ics_rows(lines)
+                    else:
+                        rows = transfer.csv_rows(lines, transfer.RESERVATION_COLUMNS)
+                    result = transfer.import_reservations(rows, default_user=form.cleaned_data['default_user'] or None)
+            except ValueError as e:
+                messages.error(request, f"Could not read the file: {e}")
+            else:
+                messages.success(request, f"Imported {result.created} {form.cleaned_data['kind']}.")
+    else:
+        form = ImportForm()
+
+    return render(request, 'reservations/admin_import.html', {
+        'form': form,
+        'result': result,
+        'errors': result.errors[:100] if result else [],
+    })
 
 @staff_member_required
 def admin_cancel_reservation(request, reservation_id):
@@ -502,13 +574,14 @@ def admin_cancel_reservation(request, reservation_id):
         end_time = reservation.end_time
         username = reservation.user.username
 
-        reservation.delete()
-        messages.success(request, 'Reservation canceled successfully! A confirmation email has been sent to the user.')
+        with transaction.atomic():
+            publish_change('cancelled', reservation)
+            reservation.delete()
 
-        # Send the user an email notifying them of the staff cancellation
-        if user_email:
-            subject = f'Room Reservation Canceled - {room_name}'
-            message = f"""
+            # Send the user an email notifying them of the staff cancellation
+            if user_email:
+                subject = f'Room Reservation Canceled - {room_name}'
+                message = f"""
         Hello {username},
         As per your request, our staff have canceled your reservation for {room_name}:
         
@@ -519,25 +592,60 @@ def admin_cancel_reservation(request, reservation_id):
         Thank you!
         Te Whare Runaga Conference Room Booking System staff
         """
-            try:
-                send_mail(
-                    subject=subject,
-                    message=message,
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    recipient_list=[user_email],
-                    fail_silently=False,
-                )
-            except Exception as e:
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.error(f"failed to send cancellation email (admin reservation): {str(e)}")
+                queue_email(subject, message, user_email)
+        messages.success(request, 'Reservation canceled successfully! A confirmation email has been sent to the user.')
 
     return redirect('reservations:admin_reservations')
 
+# Searchable user directory, a page at a time, with bulk actions run in the background
 @staff_member_required
 def user_list(request):
-    users = User.objects.all()
-    return render(request, 'reservations/user_list.html', {'users': users})
+    form = UserFilterForm(request.GET or None)
+    filters = form.cleaned_data if form.is_valid() else {}
+    users, next_cursor = user_page(after=request.GET.get('after'), **filters)
+
+    # Keep the filters in the page links
+    next_query = first_query = None
+    if next_cursor:
+        query = request.GET.copy()
+        query['after'] = next_cursor
+        next_query = query.urlencode()
+    if 'after' in request.GET:
+        query = request.GET.copy()
+        del query['after']
+        first_query = query.urlencode()
+    # Bulk actions on every matching user cover every page
+    filter_query = request.GET.copy()
+    filter_query.pop('after', None)
+
+    return render(request, 'reservations/user_list.html', {
+        'form': form,
+        'users': users,
+        'next_query': next_query,
+        'first_query': first_query,
+        'filter_query': filter_query.urlencode(),
+        'action_form': UserBulkActionForm(),
+    })
+
+
+@staff_member_required
+def user_bulk_action(request):
+    if request.method != 'POST':
+        return redirect('reservations:user_list')
+    filter_query = request.POST.get('filter_query', '')
+    form = UserBulkActionForm(request.POST)
+    if form.is_valid():
+        scope = form.cleaned_data['scope']
+        if scope == UserBulkActionForm.SELECTED:
+            job = start_user_job(form.cleaned_data['action'], request.user, user_ids=form.cleaned_data['user_ids'])
+        else:
+            job = start_user_job(form.cleaned_data['action'], request.user, filters=form.cleaned_data['filters'])
+        messages.success(request, f"{job.get_action_display()} of {job.total} users started, "
+                                  f"its progress is shown on the admin panel.")
+    else:
+        for error in form.non_field_errors():
+            messages.error(request, error)
+    return redirect(reverse('reservations:user_list') + (f'?{filter_query}' if filter_query else ''))
 
 @staff_member_required
 def edit_user(request, user_id):
@@ -561,7 +669,7 @@ def delete_user(request, user_id):
         return redirect('reservations:user_list')
 
     if request.method == "POST":
-        user.delete()
+        delete_users([user.id])
         messages.success(request, 'User deleted successfully!')
         return redirect('reservations:user_list')
     return render(request, 'reservations/confirm_delete_user.html', {'user': user})
@@ -578,8 +686,31 @@ def add_user(request):
         form = CustomUserCreationForm()
     return render(request, 'reservations/add_user.html', {'form': form})
 
+# Booked time per room over a date range, from the occupancy summary
+@staff_member_required
+def room_utilization(request):
+    today = timezone.localdate()
+    try:
+        date_from = datetime.strptime(request.GET.get('from', ''), '%Y-%m-%d').date()
+        date_to = datetime.strptime(request.GET.get('to', ''), '%Y-%m-%d').date()
+    except ValueError:
+        date_from, date_to = today - timedelta(days=29), today
+    if date_to < date_from:
+        date_from, date_to = date_to, date_from
+
+    return render(request, 'reservations/room_utilization.html', {
+        'date_from': date_from,
+        'date_to': date_to,
+        'rows': utilization(date_from, date_to),
+        'least_busy': least_busy_rooms(today),
+        'today': today,
+    })
+
 @staff_member_required
 def admin_panel(request):
-    return render(request, 'reservations/admin_panel.html')
+    return render(request, 'reservations/admin_panel.html', {
+        'metrics': metrics_registry.summary(),
+        'user_jobs': UserJob.objects.select_related('requested_by').order_by('-id')[:10],
+    })
 
 
@@ -1,5 +1,12 @@
-import os
+# The Celery app is only imported when something asks for it (the worker, or the
+# first task queued from a web process), so web cold starts don't pay for it
 
-if os.environ.get('VERCEL') != '1':
-    from .celery import app as celery_app
-    __all__ = ('celery_app',)
\ No newline at end of file
+
+def __getattr__(name):
+    if name == 'celery_app':
+        from .celery import app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ('celery_app',)
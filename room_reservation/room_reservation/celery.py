@@ -1,7 +1,11 @@
 import os
 from celery import Celery
+from django.conf import settings
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'room_reservation.settings')
+if not settings.configured:
+    # Django isn't set up yet, so this was imported by the celery command itself
+    os.environ.setdefault('DJANGO_SETTINGS_PROFILE', 'worker')
+
 app = Celery('room_reservation')
 app.config_from_object('django.conf:settings', namespace='CELERY')
-app.autodiscover_tasks()
\ No newline at end of file
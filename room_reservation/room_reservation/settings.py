@@ -46,6 +46,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so static files skip everything else
+    'reservations.staticfiles.StaticFilesMiddleware',
+    # Next, so its timings include the rest of the middleware
+    'reservations.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -57,12 +61,20 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'room_reservation.urls'
 
+APP_TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django's template backend, timed for the request metrics
+        'BACKEND': 'reservations.metrics.TimedDjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Templates are compiled once per process in production. With DEBUG on
+            # they are read again on every render, so edits show up straight away
+            'loaders': APP_TEMPLATE_LOADERS if DEBUG else [('django.template.loaders.cached.Loader', APP_TEMPLATE_LOADERS)],
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
@@ -80,10 +92,32 @@ WSGI_APPLICATION = 'room_reservation.wsgi.application'
 
 
 DATABASE_URL = config('DATABASE_URL', default='')
+
+# Keep database connections open between requests (checked before reuse) instead of
+# paying for a new TLS handshake every time. Set DATABASE_POOL=True to use psycopg 3's
+# connection pool instead, and DATABASE_PGBOUNCER=True when connecting through
+# pgbouncer in transaction pooling mode.
+DATABASE_CONN_MAX_AGE = config('DATABASE_CONN_MAX_AGE', default=600, cast=int)
+DATABASE_POOL = config('DATABASE_POOL', default=False, cast=bool)
+DATABASE_PGBOUNCER = config('DATABASE_PGBOUNCER', default=False, cast=bool)
+
 if DATABASE_URL:
     DATABASES = {
-        'default': dj_database_url.config(default=DATABASE_URL, conn_max_age=0, ssl_require=True)
+        'default': dj_database_url.config(
+            default=DATABASE_URL,
+            conn_max_age=0 if DATABASE_POOL else DATABASE_CONN_MAX_AGE,
+            conn_health_checks=True,
+            disable_server_side_cursors=DATABASE_PGBOUNCER,
+            ssl_require=True,
+        )
     }
+    if DATABASE_POOL:
+        # Needs the psycopg[pool] package, the pool replaces persistent connections
+        DATABASES['default'].setdefault('OPTIONS', {})['pool'] = {
+            'min_size': config('DATABASE_POOL_MIN_SIZE', default=1, cast=int),
+            'max_size': config('DATABASE_POOL_MAX_SIZE', default=10, cast=int),
+            'timeout': 10,
+        }
 else:
     DATABASES = {
         'default': {
@@ -91,6 +125,56 @@ else:
                 'NAME': BASE_DIR / 'db.sqlite3',
         }
     }
+
+# Caches
+# Local memory by default. Point CACHE_BACKEND/CACHE_LOCATION at a file based cache
+# (django.core.cache.backends.filebased.FileBasedCache) or Redis
+# (django.core.cache.backends.redis.RedisCache) to share it between processes
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='room-reservation'),
+    }
+}
+if CACHES['default']['BACKEND'].endswith('LocMemCache'):
+    # The default of 300 entries couldn't hold even one long page of reservation rows
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': 10000}
+
+# Sessions are read from the cache and written through to the database, so a signed-in
+# page doesn't query django_session unless the cache has lost the session. Set
+# SESSION_ENGINE=django.contrib.sessions.backends.signed_cookies to keep them in the
+# cookie instead. Expired rows are removed by the prune-expired-sessions beat job
+SESSION_ENGINE = config('SESSION_ENGINE', default='django.contrib.sessions.backends.cached_db')
+SESSION_CACHE_ALIAS = 'default'
+
+# The signed-in user is read from the cache rather than auth_user on each request.
+# Every process has its own copy unless the cache is shared, so a change made by
+# another process, like deactivating the user, can take USER_CACHE_TIMEOUT seconds to apply
+AUTHENTICATION_BACKENDS = ['reservations.auth.CachedModelBackend']
+USER_CACHE = 'default'
+USER_CACHE_TIMEOUT = config('USER_CACHE_TIMEOUT', default=60, cast=int)
+
+# Which cache holds the rendered rows of the reservation tables, and for how long.
+# Rows are keyed on each reservation's updated_at, so they never go stale, the
+# timeout only lets rows of old or deleted reservations expire
+ROW_CACHE = 'default'
+ROW_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Which cache holds per-date room availability, and for how long
+AVAILABILITY_CACHE = 'default'
+AVAILABILITY_CACHE_TIMEOUT = 60 * 60
+
+# Live availability events. InProcessBroker only reaches clients connected to the same
+# process, use reservations.events.RedisBroker when running several ASGI workers
+AVAILABILITY_EVENTS_BROKER = config('AVAILABILITY_EVENTS_BROKER', default='reservations.events.InProcessBroker')
+AVAILABILITY_EVENTS_REDIS_URL = config('AVAILABILITY_EVENTS_REDIS_URL', default='redis://localhost:6379/1')
+
+# Request metrics: per-view timings and query counts, shown on the admin panel and
+# at /metrics/ for Prometheus, which authenticates with "Authorization: Bearer <METRICS_TOKEN>"
+REQUEST_METRICS = config('REQUEST_METRICS', default=True, cast=bool)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -128,6 +212,18 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
+# collectstatic gives each file a name with a hash of its contents and writes .gz
+# copies of text files, and .br copies too when the brotli package is installed.
+# StaticFilesMiddleware serves them from STATIC_ROOT, hashed names with a year long
+# Cache-Control. Set SERVE_STATIC=False when a web server or CDN serves them instead.
+# The Vercel build doesn't run collectstatic, so staticfiles/ is committed: run it
+# and commit the output after changing anything under static/
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'reservations.staticfiles.CompressedManifestStaticFilesStorage'},
+}
+SERVE_STATIC = config('SERVE_STATIC', default=True, cast=bool)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -139,7 +235,7 @@ LOGOUT_REDIRECT_URL = '/login'
 # Email settings
 #EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'  # For development only
 # For production, use these settings instead:
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_BACKEND = 'reservations.email_backends.TimedSMTPBackend'  # SMTP, timed for the request metrics
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
@@ -155,3 +251,36 @@ DEFAULT_FROM_EMAIL = 'quingillanders@gmail.com'
 PASSWORD_RESET_CONFIRM = 'password_reset_confirm'
 PASSWORD_RESET_COMPLETE = 'password_reset_complete'
 
+
+# Celery
+# Set CELERY_LOCAL=True to run without Redis: tasks run eagerly in the calling process
+# and the broker and result backend are kept in memory
+
+CELERY_LOCAL = config('CELERY_LOCAL', default=False, cast=bool)
+if CELERY_LOCAL:
+    CELERY_BROKER_URL = 'memory://'
+    CELERY_RESULT_BACKEND = 'cache+memory://'
+    CELERY_TASK_ALWAYS_EAGER = True
+else:
+    CELERY_BROKER_URL = config('CELERY_BROKER_URL', default='redis://localhost:6379/0')
+    CELERY_RESULT_BACKEND = config('CELERY_RESULT_BACKEND', default=None)
+CELERY_TIMEZONE = TIME_ZONE
+
+# Each kind of work gets its own queue, so a big fan-out can't hold up reminders
+CELERY_TASK_DEFAULT_QUEUE = 'default'
+CELERY_TASK_ROUTES = {
+    'reservations.tasks.send_reminder_emails': {'queue': 'reminders'},
+    'reservations.tasks.drain_email_outbox': {'queue': 'email'},
+    'reservations.tasks.notify_room_*': {'queue': 'bulk_email'},
+    'reservations.tasks.notify_user_deleted': {'queue': 'bulk_email'},
+    'reservations.tasks.run_user_job': {'queue': 'bulk'},
+}
+
+# Settings profile
+# 'web' for the Django site and 'worker' for Celery. room_reservation/celery.py picks the
+# worker profile when the celery command starts, so only workers load the task modules
+SETTINGS_PROFILE = os.environ.get('DJANGO_SETTINGS_PROFILE', 'web')
+if SETTINGS_PROFILE == 'worker':
+    from .settings_worker import *  # noqa: F401,F403
+else:
+    from .settings_web import *  # noqa: F401,F403
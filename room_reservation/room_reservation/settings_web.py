@@ -0,0 +1,9 @@
+"""
+Settings only used by the web processes, loaded at the end of settings.py.
+
+The web side never imports reservations.tasks: tasks are queued by name from
+reservations/outbox.py, which keeps Celery and the mail code out of startup.
+"""
+
+# No task modules are imported in web processes
+CELERY_IMPORTS = ()
@@ -0,0 +1,47 @@
+"""
+Settings only used by Celery workers and beat, loaded at the end of settings.py
+when DJANGO_SETTINGS_PROFILE is 'worker'.
+
+Run one worker per queue group so bulk fan-out can't starve reminders, e.g.
+
+    celery -A room_reservation worker -Q reminders,email,default
+    celery -A room_reservation worker -Q bulk_email,bulk
+    celery -A room_reservation beat
+"""
+from datetime import timedelta
+from decouple import config
+
+# The task modules are imported by the worker when it starts
+CELERY_IMPORTS = ('reservations.tasks',)
+
+# Leave Django's logging configuration alone
+CELERY_WORKER_HIJACK_ROOT_LOGGER = False
+
+# The tasks are short, so take one message at a time and only acknowledge it once
+# it has finished. A worker that dies part way through leaves the message for another
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+CELERY_WORKER_CONCURRENCY = config('CELERY_WORKER_CONCURRENCY', default=4, cast=int)
+CELERY_WORKER_MAX_TASKS_PER_CHILD = 1000
+
+# Periodic jobs, run by celery beat
+CELERY_BEAT_SCHEDULE = {
+    'send-reminder-emails': {
+        'task': 'reservations.tasks.send_reminder_emails',
+        'schedule': timedelta(minutes=5),
+    },
+    # Picks up outbox emails whose retry is due, or whose wake-up message was lost
+    'drain-email-outbox': {
+        'task': 'reservations.tasks.drain_email_outbox',
+        'schedule': timedelta(minutes=1),
+    },
+    'prune-reservation-changes': {
+        'task': 'reservations.tasks.prune_reservation_changes',
+        'schedule': timedelta(days=1),
+    },
+    'prune-expired-sessions': {
+        'task': 'reservations.tasks.prune_expired_sessions',
+        'schedule': timedelta(days=1),
+    },
+}